@@ -0,0 +1,303 @@
+"""Append-only log of contact attempts and responses, partitioned by month.
+
+Events go to one table per calendar month (`communication_log_YYYYMM`),
+created on first write. A month's events can then be dropped whole by
+`drop_expired` instead of deleted row by row, and reads that only care about
+recent history touch only the newest tables. Each table is indexed on
+`(owner_type, owner_id, occurred_at)`.
+
+`record` writes events in batches, one executemany per month, and updates
+each owner's `communication_summaries` row in the same transaction:
+attempt/response counts, the latest attempt and response, and the last few
+events. The decision engine and the entity view read these summaries and
+go to the partitions only for owners who actually responded.
+"""
+
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, func, insert, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+PREFIX = "communication_log_"
+RETENTION_MONTHS = int(os.getenv("COMMUNICATION_LOG_RETENTION_MONTHS", "24"))
+RECENT_EVENTS = 10
+CHUNK_SIZE = 5000
+
+DIRECTIONS = ("outbound", "inbound")
+
+_metadata = MetaData()
+
+
+def partition_name(month: date) -> str:
+    return f"{PREFIX}{month.year:04d}{month.month:02d}"
+
+
+def _partition_month(name: str) -> date:
+    suffix = name[len(PREFIX):]
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def partition_table(name: str) -> Table:
+    """The table object for partition `name` (not necessarily created yet)."""
+    if name not in _metadata.tables:
+        Table(
+            name,
+            _metadata,
+            Column("id", Integer, primary_key=True),
+            Column("owner_type", String, nullable=False),
+            Column("owner_id", Integer, nullable=False),
+            Column("direction", String, nullable=False),  # outbound | inbound
+            Column("channel", String, nullable=True),
+            Column("outcome", String, nullable=True),  # e.g. sent, retrying, failed, replied, promised_payment
+            Column("detail", String, nullable=True),
+            Column("message_id", Integer, nullable=True),  # outbox_messages.id for dispatched messages
+            Column("occurred_at", DateTime, nullable=False),
+            Index(f"ix_{name}_owner", "owner_type", "owner_id", "occurred_at"),
+        )
+    return _metadata.tables[name]
+
+
+def partitions(db: Session) -> List[str]:
+    """Existing partition names, oldest first."""
+    rows = db.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB :pattern"),
+        {"pattern": f"{PREFIX}[0-9][0-9][0-9][0-9][0-9][0-9]"},
+    )
+    return sorted(name for (name,) in rows)
+
+
+def _event_row(event: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    direction = event.get("direction") or "outbound"
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown direction {direction!r}")
+    return {
+        "owner_type": event.get("owner_type") or "user",
+        "owner_id": int(event["owner_id"]),
+        "direction": direction,
+        "channel": event.get("channel"),
+        "outcome": event.get("outcome"),
+        "detail": event.get("detail"),
+        "message_id": event.get("message_id"),
+        "occurred_at": event.get("occurred_at") or now,
+    }
+
+
+def _recent_entry(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "at": row["occurred_at"].isoformat(),
+        "direction": row["direction"],
+        "channel": row["channel"],
+        "outcome": row["outcome"],
+    }
+
+
+def record(db: Session, events: Iterable[Dict[str, Any]], *, now: Optional[datetime] = None) -> int:
+    """Append `events` and update their owners' summaries; the caller commits.
+
+    Each event has `owner_id` and optionally `owner_type` (default "user"),
+    `direction` ("outbound" attempt or "inbound" response, default
+    outbound), `channel`, `outcome`, `detail`, `message_id` and
+    `occurred_at` (default `now`).
+    """
+    now = now or datetime.utcnow()
+    rows = [_event_row(event, now) for event in events]
+    if not rows:
+        return 0
+
+    by_month: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        by_month[partition_name(row["occurred_at"])].append(row)
+    existing = set(partitions(db))
+    for name, month_rows in by_month.items():
+        table = partition_table(name)
+        if name not in existing:
+            table.create(db.connection(), checkfirst=True)
+        db.execute(insert(table), month_rows)
+
+    _update_summaries(db, rows, now)
+    return len(rows)
+
+
+def _update_summaries(db: Session, rows: List[Dict[str, Any]], now: datetime) -> None:
+    by_owner: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        by_owner[(row["owner_type"], row["owner_id"])].append(row)
+
+    # Only the short `recent` lists are read back; counters are incremented in SQL.
+    summary = models.CommunicationSummary
+    recent: Dict[tuple, List[Dict[str, Any]]] = {}
+    for owner_type in {key[0] for key in by_owner}:
+        ids = sorted(key[1] for key in by_owner if key[0] == owner_type)
+        for start in range(0, len(ids), CHUNK_SIZE):
+            for owner_id, entries in db.execute(
+                select(summary.owner_id, summary.recent).where(
+                    summary.owner_type == owner_type, summary.owner_id.in_(ids[start:start + CHUNK_SIZE])
+                )
+            ):
+                recent[(owner_type, owner_id)] = entries or []
+
+    values = []
+    for (owner_type, owner_id), owner_rows in by_owner.items():
+        owner_rows.sort(key=lambda r: r["occurred_at"], reverse=True)
+        outbound = [r for r in owner_rows if r["direction"] == "outbound"]
+        inbound = [r for r in owner_rows if r["direction"] == "inbound"]
+        merged = sorted(
+            [_recent_entry(r) for r in owner_rows[:RECENT_EVENTS]] + recent.get((owner_type, owner_id), []),
+            key=lambda entry: entry["at"],
+            reverse=True,
+        )[:RECENT_EVENTS]
+        values.append(
+            {
+                "owner_type": owner_type,
+                "owner_id": owner_id,
+                "attempts": len(outbound),
+                "responses": len(inbound),
+                "last_attempt_at": outbound[0]["occurred_at"] if outbound else None,
+                "last_response_at": inbound[0]["occurred_at"] if inbound else None,
+                "last_channel": merged[0]["channel"],
+                "recent": merged,
+                "updated_at": now,
+            }
+        )
+
+    table = summary.__table__
+    stmt = sqlite_insert(table)
+
+    def latest(column: str):
+        current, new = table.c[column], stmt.excluded[column]
+        return func.max(func.coalesce(current, new), func.coalesce(new, current))
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["owner_type", "owner_id"],
+        set_={
+            "attempts": table.c.attempts + stmt.excluded.attempts,
+            "responses": table.c.responses + stmt.excluded.responses,
+            "last_attempt_at": latest("last_attempt_at"),
+            "last_response_at": latest("last_response_at"),
+            "last_channel": stmt.excluded.last_channel,
+            "recent": stmt.excluded.recent,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt, values)
+
+
+def get_summary(db: Session, owner_type: str, owner_id: int) -> Optional[models.CommunicationSummary]:
+    return db.get(models.CommunicationSummary, (owner_type, owner_id))
+
+
+def history(
+    db: Session,
+    owner_type: str,
+    owner_id: int,
+    *,
+    limit: int = 50,
+    since: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """An owner's newest events first, reading partitions newest first until `limit` is reached."""
+    events: List[Dict[str, Any]] = []
+    for name in reversed(partitions(db)):
+        if since is not None and _partition_month(name) < since.date().replace(day=1):
+            break
+        table = partition_table(name)
+        query = (
+            select(table)
+            .where(table.c.owner_type == owner_type, table.c.owner_id == owner_id)
+            .order_by(table.c.occurred_at.desc(), table.c.id.desc())
+            .limit(limit - len(events))
+        )
+        if since is not None:
+            query = query.where(table.c.occurred_at >= since)
+        events.extend(dict(row._mapping) for row in db.execute(query))
+        if len(events) >= limit:
+            break
+    return events
+
+
+def count_responses(db: Session, owner_type: str, owner_ids: np.ndarray, since: np.ndarray) -> np.ndarray:
+    """Inbound events per owner on or after that owner's `since` (datetime64[D]).
+
+    Summaries rule out owners whose last response predates `since`; only the
+    rest are counted, and only in partitions from the earliest such `since`.
+    """
+    counts = np.zeros(len(owner_ids), dtype="int64")
+    if not len(owner_ids):
+        return counts
+    summary = models.CommunicationSummary
+    last = np.full(len(owner_ids), np.datetime64("NaT"), dtype="datetime64[s]")
+    ids = owner_ids.tolist()
+    for start in range(0, len(ids), CHUNK_SIZE):
+        rows = db.execute(
+            select(summary.owner_id, summary.last_response_at).where(
+                summary.owner_type == owner_type,
+                summary.owner_id.in_(ids[start:start + CHUNK_SIZE]),
+                summary.last_response_at.is_not(None),
+            )
+        ).all()
+        if rows:
+            found = np.array([r[0] for r in rows], dtype="int64")
+            order = np.argsort(owner_ids)
+            idx = order[np.searchsorted(owner_ids, found, sorter=order)]
+            last[idx] = np.array([r[1] for r in rows], dtype="datetime64[s]")
+
+    candidates = np.flatnonzero(~np.isnat(last) & (last >= since.astype("datetime64[s]")))
+    if not len(candidates):
+        return counts
+    earliest = since[candidates].min().astype(datetime)
+    cand_ids = owner_ids[candidates]
+    order = np.argsort(cand_ids)
+    frames = []
+    for name in partitions(db):
+        if _partition_month(name) < earliest.replace(day=1):
+            continue
+        table = partition_table(name)
+        chunk_ids = cand_ids.tolist()
+        for start in range(0, len(chunk_ids), CHUNK_SIZE):
+            rows = db.execute(
+                select(table.c.owner_id, table.c.occurred_at).where(
+                    table.c.owner_type == owner_type,
+                    table.c.owner_id.in_(chunk_ids[start:start + CHUNK_SIZE]),
+                    table.c.direction == "inbound",
+                    table.c.occurred_at >= datetime.combine(earliest, datetime.min.time()),
+                )
+            ).all()
+            if rows:
+                frames.append(pd.DataFrame.from_records(rows, columns=["owner_id", "occurred_at"]))
+    if not frames:
+        return counts
+    df = pd.concat(frames, ignore_index=True)
+    pos = candidates[order[np.searchsorted(cand_ids, df["owner_id"].to_numpy(dtype="int64"), sorter=order)]]
+    at = pd.to_datetime(df["occurred_at"]).to_numpy().astype("datetime64[D]")
+    counted = at >= since[pos]
+    counts += np.bincount(pos[counted], minlength=len(owner_ids))
+    return counts
+
+
+def drop_expired(db: Session, *, keep_months: int = RETENTION_MONTHS, now: Optional[datetime] = None) -> List[str]:
+    """Drop partitions older than the last `keep_months` months (the current one included)."""
+    now = now or datetime.utcnow()
+    months = now.year * 12 + now.month - 1 - (keep_months - 1)
+    cutoff = date(months // 12, months % 12 + 1, 1)
+    dropped = [name for name in partitions(db) if _partition_month(name) < cutoff]
+    for name in dropped:
+        partition_table(name).drop(db.connection(), checkfirst=True)
+    db.commit()
+    return dropped
+
+
+def event_counts(db: Session, names: Optional[Sequence[str]] = None) -> Dict[str, int]:
+    """Rows per partition."""
+    return {
+        name: db.execute(select(func.count()).select_from(partition_table(name))).scalar_one()
+        for name in (names if names is not None else partitions(db))
+    }
@@ -0,0 +1,171 @@
+"""Precomputed contact routing: which address to use for each user and channel.
+
+A user's `details["contact_methods"]` is a list of `{"method", "value",
+"is_preferred"}` entries. Resolving "the phone number for an SMS block" means
+scanning that list and lower-casing method names. Until now that happened
+for every block of every timeline, for every template placeholder, and for
+every message queued for dispatch.
+
+`contact_routes` holds the answer per `(user_id, channel)`. `value` is the
+preferred matching contact, or the first matching one if none is preferred.
+`fallback` is the next distinct matching value. Channels and the contact
+methods they accept:
+
+- email: email
+- phone: phone (call and phone blocks)
+- sms: sms or phone
+
+Rows are rebuilt from `user_changes` whenever a user is inserted or
+updated, so ingestion and edits keep them current. Readers load a user's
+routes with one indexed lookup, or many users' routes in chunks, and then
+resolve a block's contact with a dict lookup. `from_details` computes the
+same routes in a single pass for details that are already in memory.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Collection, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, true
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from . import models
+
+CHANNEL_METHODS = {"email": ("email",), "phone": ("phone",), "sms": ("sms", "phone")}
+
+# Block source -> routing channel.
+SOURCE_CHANNELS = {"email": "email", "call": "phone", "phone": "phone", "sms": "sms"}
+
+CHUNK_SIZE = 5000
+
+Route = Tuple[str, Optional[str], bool]  # value, fallback, value is preferred
+
+
+def build(contact_methods: Any) -> Dict[str, Route]:
+    """Routes per channel for a `contact_methods` list, in one pass over it."""
+    if not isinstance(contact_methods, list):
+        return {}
+    preferred: Dict[str, str] = {}
+    matching: Dict[str, List[str]] = {}
+    for cm in contact_methods:
+        if not isinstance(cm, dict) or not cm.get("value"):
+            continue
+        method = str(cm.get("method") or "").lower()
+        for channel, methods in CHANNEL_METHODS.items():
+            if method in methods:
+                matching.setdefault(channel, []).append(cm["value"])
+                if cm.get("is_preferred"):
+                    preferred.setdefault(channel, cm["value"])
+    routes: Dict[str, Route] = {}
+    for channel, values in matching.items():
+        value = preferred.get(channel, values[0])
+        fallback = next((v for v in values if v != value), None)
+        routes[channel] = (value, fallback, channel in preferred)
+    return routes
+
+
+def from_details(details: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Channel -> contact value computed from `details`, for owners not (yet) in the table."""
+    return {channel: route[0] for channel, route in build((details or {}).get("contact_methods")).items()}
+
+
+def for_source(routes: Dict[str, str], source: Optional[str]) -> Optional[str]:
+    """The contact value for a block `source` ("email", "call", "phone" or "sms")."""
+    channel = SOURCE_CHANNELS.get((source or "").lower())
+    return routes.get(channel) if channel else None
+
+
+def _parse(methods: Any) -> Any:
+    try:
+        return json.loads(methods) if isinstance(methods, str) else None
+    except ValueError:
+        return None
+
+
+def refresh_users(
+    db: Session,
+    user_filter: ColumnElement,
+    *,
+    columns: Optional[Collection[str]] = None,
+) -> None:
+    """Rebuild the routes of the users matching `user_filter`; the caller commits."""
+    if columns is not None and "details" not in columns:
+        return
+    route = models.ContactRoute
+    rows = db.execute(
+        select(models.User.id, func.json_extract(models.User.details, "$.contact_methods")).where(user_filter)
+    ).all()
+    ids = [user_id for user_id, _ in rows]
+    for start in range(0, len(ids), CHUNK_SIZE):
+        db.execute(delete(route).where(route.user_id.in_(ids[start:start + CHUNK_SIZE])))
+    values = [
+        {"user_id": user_id, "channel": channel, "value": value, "fallback": fallback, "preferred": preferred}
+        for user_id, methods in rows
+        for channel, (value, fallback, preferred) in build(_parse(methods)).items()
+    ]
+    if values:
+        db.execute(insert(route.__table__), values)
+
+
+def rebuild(db: Session, *, chunk_size: int = 50000) -> int:
+    """Rebuild every user's routes in chunks and commit; returns the number of routes."""
+    db.execute(delete(models.ContactRoute))
+    last_id = 0
+    while True:
+        ids = db.execute(
+            select(models.User.id).where(models.User.id > last_id).order_by(models.User.id).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            break
+        last_id = ids[-1]
+        refresh_users(db, models.User.id.between(ids[0], last_id))
+    db.commit()
+    return db.execute(select(func.count()).select_from(models.ContactRoute)).scalar_one()
+
+
+def _any_user_routable(db: Session) -> bool:
+    """Whether some user has a contact method `build` would turn into a route."""
+    cm = func.json_each(models.User.details, "$.contact_methods").table_valued("value", "type")
+    methods = sorted({m for ms in CHANNEL_METHODS.values() for m in ms})
+    routable = (
+        select(models.User.id)
+        .join(cm, true())
+        .where(
+            cm.c.type == "object",
+            func.lower(func.json_extract(cm.c.value, "$.method")).in_(methods),
+            func.coalesce(func.json_extract(cm.c.value, "$.value"), "") != "",
+        )
+        .limit(1)
+    )
+    return db.execute(routable).first() is not None
+
+
+def ensure_built(db: Session) -> None:
+    """Backfill the table for databases created before it existed.
+
+    An empty table alone does not mean the build never ran: a portfolio with
+    no usable contact methods has no routes either. So the rebuild only runs
+    if some user has a method that would give a route.
+    """
+    if db.execute(select(models.ContactRoute.user_id).limit(1)).first() is None:
+        if _any_user_routable(db):
+            rebuild(db)
+
+
+def load(db: Session, user_ids: Iterable[int]) -> Dict[int, Dict[str, str]]:
+    """Channel -> contact value for each of `user_ids` that has any route."""
+    route = models.ContactRoute
+    ids = sorted(set(user_ids))
+    routes: Dict[int, Dict[str, str]] = {}
+    for start in range(0, len(ids), CHUNK_SIZE):
+        for user_id, channel, value in db.execute(
+            select(route.user_id, route.channel, route.value).where(route.user_id.in_(ids[start:start + CHUNK_SIZE]))
+        ):
+            routes.setdefault(user_id, {})[channel] = value
+    return routes
+
+
+def for_user(db: Session, user_id: int) -> Dict[str, str]:
+    return load(db, [user_id]).get(user_id, {})
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import random
+import time
 from datetime import date, datetime
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
+from sqlalchemy import Float, case, cast, exists, func, literal, select, update
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
-from . import models, schemas
+from . import dynamic_groups, models, schemas, user_changes
 
 
 # ---- User CRUD ----
@@ -83,51 +90,115 @@ def create_user_document(
     return doc
 
 
-def add_user_payment(
-    db: Session,
-    *,
-    user_id: int,
-    payment: schemas.PaymentCreate,
-) -> models.User:
-    user = get_user(db, user_id)
-    if not user:
-        raise ValueError("User not found")
+class ConcurrentUpdateError(RuntimeError):
+    """Raised when an optimistic update keeps losing the race for a row."""
+
+
+PAYMENT_MAX_RETRIES = 20
+
 
-    # Update details JSON
-    details = dict(user.details or {})
+def _apply_payment_to_details(
+    details: Dict[str, Any],
+    payment: schemas.PaymentCreate,
+) -> Dict[str, Any]:
+    """Return a new details dict with `payment` appended and totals recomputed."""
+    details = dict(details or {})
     payment_history = list(details.get("payment_history", []))
-    
-    new_payment = {
+
+    payment_history.append({
         "amount": payment.amount,
         "date": payment.date,
         "installment_number": payment.installment_number,
         "notes": payment.notes,
         "added_at": datetime.utcnow().isoformat(),
-    }
-    payment_history.append(new_payment)
-    
-    # Update totals
+    })
+
     total_paid = float(details.get("total_paid", 0)) + payment.amount
     amount_owed = float(details.get("amount_owed", 0))
-    remaining_amount = max(0, amount_owed - total_paid)
-    
+
     details["payment_history"] = payment_history
     details["total_paid"] = total_paid
-    details["remaining_amount"] = remaining_amount
-    
-    user.details = details
+    details["remaining_amount"] = max(0, amount_owed - total_paid)
+    return details
+
 
-    if remaining_amount <= 0:
+def apply_payment(user: models.User, payment: schemas.PaymentCreate) -> None:
+    """Apply `payment` to a loaded user; the caller commits and handles a lost race."""
+    user.details = _apply_payment_to_details(user.details, payment)
+    if user.details["remaining_amount"] <= 0:
         user.status = models.StatusEnum.FINISHED
-    
-    # Force update for SQLAlchemy to detect JSON change
-    from sqlalchemy.orm.attributes import flag_modified
-    flag_modified(user, "details")
-    
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+
+
+def add_user_payment(
+    db: Session,
+    *,
+    user_id: int,
+    payment: schemas.PaymentCreate,
+    max_retries: int = PAYMENT_MAX_RETRIES,
+) -> models.User:
+    """Append a payment to the user's history and update totals atomically.
+
+    The user row carries a version counter (see `models.User.version`), so the
+    commit only succeeds if nobody else changed the row since we read it. On a
+    conflict the session is rolled back and the payment re-applied on top of
+    the fresh row, which makes concurrent payment posters safe without a
+    global lock.
+    """
+    for attempt in range(max_retries):
+        user = get_user(db, user_id)
+        if not user:
+            raise ValueError("User not found")
+        apply_payment(user, payment)
+
+        try:
+            db.commit()
+        except (StaleDataError, OperationalError):
+            # Lost the race (or the SQLite write lock); retry on a fresh read.
+            db.rollback()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+            continue
+
+        db.refresh(user)
+        return user
+
+    raise ConcurrentUpdateError(
+        f"Could not apply payment to user {user_id} after {max_retries} attempts"
+    )
+
+
+def stage_payments_batch(
+    db: Session,
+    payments_by_user: Dict[int, List[schemas.PaymentCreate]],
+    *,
+    chunk_size: int = 500,
+) -> List[int]:
+    """Apply many payments grouped by user inside the caller's transaction.
+
+    Each chunk of users is flushed, so the version check runs as it goes. The
+    caller commits, and on StaleDataError or OperationalError rolls back and
+    starts over. Returns the user ids that do not exist.
+    """
+    missing: List[int] = []
+    user_ids = list(payments_by_user)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        found = _apply_payments_to_users(db, payments_by_user, chunk)
+        db.flush()
+        missing.extend(uid for uid in chunk if uid not in found)
+    return missing
+
+
+def _apply_payments_to_users(
+    db: Session,
+    payments_by_user: Dict[int, List[schemas.PaymentCreate]],
+    user_ids: List[int],
+) -> Set[int]:
+    """Apply the payments of `user_ids` to the loaded users; returns the ids found."""
+    users = db.query(models.User).filter(models.User.id.in_(user_ids)).all()
+    for user in users:
+        for payment in payments_by_user[user.id]:
+            apply_payment(user, payment)
+    return {u.id for u in users}
 
 
 # ---- Group CRUD ----
@@ -148,31 +219,125 @@ def list_groups(
     return q.all()
 
 
+# Users per UPDATE ... WHERE id IN (...) statement.
+MEMBERSHIP_CHUNK_SIZE = 5000
+
+
+def _ids_not_in(db: Session, user_ids: List[int], members) -> List[int]:
+    """The ids in `user_ids` that `members` (a SELECT of user ids) does not return, in one query.
+
+    The ids are sent as a single JSON array parameter, so the query does not
+    grow with the number of ids.
+    """
+    listed = func.json_each(json.dumps(user_ids)).table_valued("value")
+    return sorted(db.execute(select(listed.c.value).where(listed.c.value.not_in(members))).scalars())
+
+
+def _format_ids(ids: List[int], limit: int = 20) -> str:
+    if len(ids) <= limit:
+        return str(ids)
+    return f"{ids[:limit]} and {len(ids) - limit} more"
+
+
+def _set_group_id(
+    db: Session,
+    user_ids: List[int],
+    group_id: Optional[int],
+    *,
+    only_group: Optional[int] = None,
+) -> int:
+    user = models.User
+    updated = 0
+    for start in range(0, len(user_ids), MEMBERSHIP_CHUNK_SIZE):
+        stmt = (
+            update(user)
+            .where(user.id.in_(user_ids[start:start + MEMBERSHIP_CHUNK_SIZE]))
+            .values(group_id=group_id, version=user.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if only_group is not None:
+            stmt = stmt.where(user.group_id == only_group)
+        updated += db.execute(stmt).rowcount
+    return updated
+
+
 def create_group_with_users(
     db: Session,
     *,
     name: str,
     user_ids: List[int],
 ) -> models.Group:
+    user_ids = sorted(set(user_ids))
+    missing = _ids_not_in(db, user_ids, select(models.User.id)) if user_ids else []
+    if missing:
+        raise ValueError(f"User IDs not found: {_format_ids(missing)}")
+
     group = models.Group(name=name)
     db.add(group)
     db.flush()  # get group.id before assigning users
+    _set_group_id(db, user_ids, group.id)
 
-    users = db.query(models.User).filter(models.User.id.in_(user_ids)).all()
-    found_ids = {u.id for u in users}
-    missing = set(user_ids) - found_ids
-    if missing:
-        raise ValueError(f"User IDs not found: {sorted(missing)}")
+    db.commit()
+    db.refresh(group)
+    return group
 
-    for user in users:
-        user.group_id = group.id
-        db.add(user)
 
+def create_dynamic_group(db: Session, *, name: str, rule: Dict[str, Any]) -> models.Group:
+    """Create a rule-based group and materialize its members."""
+    dynamic_groups.compile_rule(rule, date.today())  # raises ValueError if invalid
+    group = models.Group(name=name, rule=rule)
+    db.add(group)
+    db.flush()
+    dynamic_groups.refresh_group(db, group)
+    db.commit()
+    db.refresh(group)
+    return group
+
+
+def update_group_rule(db: Session, group: models.Group, rule: Dict[str, Any]) -> models.Group:
+    """Replace a rule-based group's rule and re-evaluate its members."""
+    if group.rule is None:
+        raise ValueError("Only rule-based groups have a rule")
+    dynamic_groups.compile_rule(rule, date.today())
+    group.rule = rule
+    dynamic_groups.refresh_group(db, group)
     db.commit()
     db.refresh(group)
     return group
 
 
+def add_group_members(db: Session, group: models.Group, user_ids: List[int]) -> int:
+    """Move the users into `group`, from whatever group they were in. Returns users added."""
+    if group.rule is not None:
+        raise ValueError("Members of a rule-based group follow its rule")
+    user_ids = sorted(set(user_ids))
+    missing = _ids_not_in(db, user_ids, select(models.User.id)) if user_ids else []
+    if missing:
+        raise ValueError(f"User IDs not found: {_format_ids(missing)}")
+    added = _set_group_id(db, user_ids, group.id)
+    db.commit()
+    return added
+
+
+def remove_group_members(db: Session, group: models.Group, user_ids: List[int]) -> int:
+    """Take the users out of `group`; every id must be a member. Returns users removed."""
+    if group.rule is not None:
+        raise ValueError("Members of a rule-based group follow its rule")
+    user_ids = sorted(set(user_ids))
+    user = models.User
+    missing = _ids_not_in(db, user_ids, select(user.id).where(user.group_id == group.id)) if user_ids else []
+    if missing:
+        raise ValueError(f"User IDs not in group {group.id}: {_format_ids(missing)}")
+    removed = _set_group_id(db, user_ids, None, only_group=group.id)
+    db.commit()
+    return removed
+
+
+def count_group_members(db: Session, group_id: int) -> int:
+    """Members of a static or rule-based group."""
+    return dynamic_groups.member_counts(db, [group_id]).get(group_id, 0)
+
+
 def update_group_status(db: Session, group: models.Group, status: str) -> models.Group:
     group.status = status
     db.add(group)
@@ -181,6 +346,35 @@ def update_group_status(db: Session, group: models.Group, status: str) -> models
     return group
 
 
+def _owes_balance():
+    """SQL condition: the user's `amount_owed` is above zero."""
+    return func.coalesce(cast(func.json_extract(models.User.details, "$.amount_owed"), Float), 0.0) > 0
+
+
+def group_has_balance(db: Session, group_id: int) -> bool:
+    """Whether any member of the group owes money, via one EXISTS query."""
+    members = dynamic_groups.members_clause(db, group_id)
+    return db.execute(select(exists().where(members, _owes_balance()))).scalar_one()
+
+
+def set_member_statuses_by_balance(db: Session, group_id: int) -> int:
+    """Mark members that owe money ongoing and the rest finished; the caller commits.
+
+    One UPDATE for the whole group; each row's version is bumped like an ORM
+    update would. Returns the number of members updated.
+    """
+    user = models.User
+    members = dynamic_groups.members_clause(db, group_id)
+    result = db.execute(
+        update(user)
+        .where(members)
+        .values(status=case((_owes_balance(), "ongoing"), else_="finished"), version=user.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    user_changes.users_changed(db, members, columns=("status",))
+    return result.rowcount
+
+
 # ---- Strategy CRUD ----
 
 
@@ -190,19 +384,169 @@ def _strategy_owner_filter(db: Session, owner_id: int, owner_type: str):
     return db.query(models.Strategy).filter(models.Strategy.user_id == owner_id)
 
 
+def backfill_strategy_heads(db: Session) -> int:
+    """Point each owner without a head at their newest strategy (highest id) and commit.
+
+    Strategies saved before `strategy_heads` existed have no head, and reads
+    go through the heads. Returns the number of heads added.
+    """
+    strategy, heads = models.Strategy, models.StrategyHead.__table__
+    added = 0
+    for owner_type, owner_col in (("user", strategy.user_id), ("group", strategy.group_id)):
+        newest = (
+            select(owner_col.label("owner_id"), func.max(strategy.id).label("strategy_id"))
+            .where(owner_col.is_not(None))
+            .group_by(owner_col)
+            .subquery()
+        )
+        headless = (
+            select(literal(owner_type), newest.c.owner_id, strategy.id, strategy.version, literal(datetime.utcnow()))
+            .join_from(newest, strategy, strategy.id == newest.c.strategy_id)
+            .where(
+                ~exists().where(heads.c.owner_type == owner_type, heads.c.owner_id == newest.c.owner_id)
+            )
+        )
+        added += db.execute(
+            heads.insert().from_select(["owner_type", "owner_id", "strategy_id", "version", "updated_at"], headless)
+        ).rowcount
+    db.commit()
+    return added
+
+
+def ensure_strategy_heads(db: Session) -> None:
+    """Backfill heads for databases whose strategies predate `strategy_heads`."""
+    if db.execute(select(models.StrategyHead.owner_id).limit(1)).first() is None:
+        if db.execute(select(models.Strategy.id).limit(1)).first() is not None:
+            backfill_strategy_heads(db)
+
+
 def get_latest_strategy_for_owner(
     db: Session,
     *,
     owner_id: int,
     owner_type: str,
 ) -> Optional[models.Strategy]:
+    # Primary-key lookup of the head, however many versions the owner has.
     return (
-        _strategy_owner_filter(db, owner_id, owner_type)
-        .order_by(models.Strategy.created_at.desc())
+        db.query(models.Strategy)
+        .join(models.StrategyHead, models.StrategyHead.strategy_id == models.Strategy.id)
+        .filter(models.StrategyHead.owner_type == owner_type, models.StrategyHead.owner_id == owner_id)
         .first()
     )
 
 
+def list_strategy_versions(db: Session, *, owner_id: int, owner_type: str) -> List[models.Strategy]:
+    """Every saved version of an owner's strategy, newest first."""
+    return _strategy_owner_filter(db, owner_id, owner_type).order_by(models.Strategy.version.desc()).all()
+
+
+def get_strategy_version(
+    db: Session,
+    *,
+    owner_id: int,
+    owner_type: str,
+    version: int,
+) -> Optional[models.Strategy]:
+    return _strategy_owner_filter(db, owner_id, owner_type).filter(models.Strategy.version == version).first()
+
+
+def canonical_timeline_json(timeline: List[Dict[str, Any]]) -> str:
+    """The JSON text a timeline is content-addressed by."""
+    return json.dumps(timeline, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def timeline_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def store_timelines(
+    db: Session,
+    timelines: List[List[Dict[str, Any]]],
+) -> List[models.StrategyTimeline]:
+    """Return the shared `StrategyTimeline` row for each timeline, adding missing ones.
+
+    Identical timelines (including the same list passed many times) map to
+    one row, so a campaign assigned to thousands of owners is stored once.
+    """
+    hashes: List[str] = []
+    unique: Dict[str, List[Dict[str, Any]]] = {}
+    sizes: Dict[str, int] = {}
+    seen: Dict[int, str] = {}  # id(list) -> hash, avoids re-encoding a shared list
+    for timeline in timelines:
+        digest = seen.get(id(timeline))
+        if digest is None:
+            text = canonical_timeline_json(timeline)
+            digest = seen[id(timeline)] = timeline_digest(text)
+            if digest not in unique:
+                unique[digest] = timeline
+                sizes[digest] = len(text.encode("utf-8"))
+        hashes.append(digest)
+
+    rows: Dict[str, models.StrategyTimeline] = {}
+    keys = list(unique)
+    for start in range(0, len(keys), 500):
+        for row in db.query(models.StrategyTimeline).filter(
+            models.StrategyTimeline.hash.in_(keys[start:start + 500])
+        ):
+            rows[row.hash] = row
+    for digest, timeline in unique.items():
+        if digest not in rows:
+            rows[digest] = models.StrategyTimeline(hash=digest, timeline=timeline, size=sizes[digest])
+            db.add(rows[digest])
+    return [rows[digest] for digest in hashes]
+
+
+def set_strategy_timeline(
+    strategy: models.Strategy,
+    shared: models.StrategyTimeline,
+    *,
+    apply_contacts: bool = False,
+) -> None:
+    """Point `strategy` at a shared timeline (see `store_timelines`)."""
+    strategy.timeline_inline = []
+    strategy.shared_timeline = shared
+    strategy.apply_contacts = apply_contacts
+
+
+def _append_strategy_versions(
+    db: Session,
+    *,
+    owner_type: str,
+    timelines: Dict[int, List[Dict[str, Any]]],
+    prompt: Optional[str],
+    apply_contacts: bool,
+) -> List[models.Strategy]:
+    """Add the next strategy version for each owner and move their head to it."""
+    owner_ids = list(timelines)
+    heads: Dict[int, models.StrategyHead] = {}
+    for start in range(0, len(owner_ids), 500):
+        for head in db.query(models.StrategyHead).filter(
+            models.StrategyHead.owner_type == owner_type,
+            models.StrategyHead.owner_id.in_(owner_ids[start:start + 500]),
+        ):
+            heads[head.owner_id] = head
+    shared_rows = store_timelines(db, list(timelines.values()))
+
+    strategies: List[models.Strategy] = []
+    for owner_id, shared in zip(owner_ids, shared_rows):
+        head = heads.get(owner_id)
+        if head is None:
+            head = models.StrategyHead(owner_type=owner_type, owner_id=owner_id, version=0)
+            db.add(head)
+        strategy = models.Strategy(
+            user_id=owner_id if owner_type == "user" else None,
+            group_id=owner_id if owner_type == "group" else None,
+            version=head.version + 1,
+            prompt=prompt,
+        )
+        set_strategy_timeline(strategy, shared, apply_contacts=apply_contacts)
+        db.add(strategy)
+        head.strategy = strategy
+        head.version = strategy.version
+        strategies.append(strategy)
+    return strategies
+
+
 def create_or_update_strategy_for_owner(
     db: Session,
     *,
@@ -210,29 +554,46 @@ def create_or_update_strategy_for_owner(
     owner_type: str,
     timeline: List[Dict[str, Any]],
     prompt: Optional[str] = None,
+    apply_contacts: bool = False,
 ) -> models.Strategy:
-    existing = get_latest_strategy_for_owner(db, owner_id=owner_id, owner_type=owner_type)
-
-    if existing:
-        existing.timeline = timeline
-        existing.prompt = prompt
-        db.add(existing)
-        db.commit()
-        db.refresh(existing)
-        return existing
-
-    strategy = models.Strategy(
-        user_id=owner_id if owner_type == "user" else None,
-        group_id=owner_id if owner_type == "group" else None,
-        timeline=timeline,
+    """Save `timeline` as the owner's next strategy version.
+
+    Earlier versions are kept; unchanged content is shared with them through
+    `strategy_timelines`, so a new version costs one small row.
+    """
+    strategy = _append_strategy_versions(
+        db,
+        owner_type=owner_type,
+        timelines={owner_id: timeline},
         prompt=prompt,
-    )
-    db.add(strategy)
+        apply_contacts=apply_contacts,
+    )[0]
     db.commit()
     db.refresh(strategy)
     return strategy
 
 
+def bulk_save_strategies(
+    db: Session,
+    *,
+    owner_type: str,
+    timelines: Dict[int, List[Dict[str, Any]]],
+    prompt: Optional[str] = None,
+    apply_contacts: bool = False,
+) -> None:
+    """Save a new strategy version for many owners in one transaction.
+
+    Owners given the same timeline share one stored copy; pass
+    `apply_contacts=True` when the timeline omits per-owner contact details.
+    """
+    if not timelines:
+        return
+    _append_strategy_versions(
+        db, owner_type=owner_type, timelines=timelines, prompt=prompt, apply_contacts=apply_contacts
+    )
+    db.commit()
+
+
 def mark_strategy_executed(db: Session, strategy: models.Strategy) -> models.Strategy:
     strategy.executed = True
     db.add(strategy)
@@ -334,3 +695,61 @@ def compute_collections_analytics(users: Iterable[models.User]) -> Dict[str, Any
         "total_remaining": total_remaining,
         "timeline_data": timeline_data,
     }
+
+
+def compute_group_analytics(db: Session, *, today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Per-group totals, status mix and average overdue days in one grouped query.
+
+    Mirrors the user-level analytics: remaining falls back to
+    `amount_owed - total_paid`, and overdue days are averaged over members
+    that owe something and are past their due date.
+    """
+    today = today or date.today()
+    user = models.User
+
+    owed = cast(func.json_extract(user.details, "$.amount_owed"), Float)
+    paid = func.coalesce(cast(func.json_extract(user.details, "$.total_paid"), Float), 0.0)
+    remaining = func.coalesce(
+        cast(func.json_extract(user.details, "$.remaining_amount"), Float),
+        func.max(0.0, func.coalesce(owed, 0.0) - paid),
+    )
+    overdue_days = func.julianday(today.isoformat()) - func.julianday(
+        func.substr(func.json_extract(user.details, "$.due_date"), 1, 10)
+    )
+    statuses = ["pending", "ongoing", "finished", "archived"]
+    members = dynamic_groups.memberships()
+
+    rows = (
+        db.query(
+            models.Group.id,
+            models.Group.name,
+            models.Group.status,
+            func.count(user.id),
+            func.coalesce(func.sum(owed), 0.0),
+            func.coalesce(func.sum(paid), 0.0),
+            func.coalesce(func.sum(remaining), 0.0),
+            func.avg(case((owed > 0, case((overdue_days > 0, overdue_days))))),
+            *[func.count(case((user.status == s, 1))) for s in statuses],
+        )
+        .outerjoin(members, members.c.group_id == models.Group.id)
+        .outerjoin(user, user.id == members.c.user_id)
+        .group_by(models.Group.id)
+        .order_by(models.Group.id)
+        .all()
+    )
+
+    results: List[Dict[str, Any]] = []
+    for row in rows:
+        group_id, name, status, members, total_owed, collected, total_remaining, avg_overdue = row[:8]
+        results.append({
+            "group_id": group_id,
+            "name": name,
+            "status": status,
+            "member_count": members,
+            "total_amount_owed": float(total_owed),
+            "total_amount_collected": float(collected),
+            "total_remaining": float(total_remaining),
+            "counts_by_status": dict(zip(statuses, row[8:])),
+            "avg_overdue_days": float(avg_overdue or 0.0),
+        })
+    return results
@@ -0,0 +1,401 @@
+"""Local evaluation of due decision blocks.
+
+A decision block lists `decision_outputs`, each with a free-text
+`condition` ("If partial payment received", "If no response", "If balance
+over 5000"). Conditions are compiled once into rules over a few per-owner
+features (balance, payments since the execution started, replies in the
+communication log, days overdue). All decisions due in a scheduler tick are then evaluated together:
+features are loaded for every owner with a couple of queries, and each rule
+is a NumPy mask over the whole batch. The first output whose condition holds
+wins.
+
+Conditions the rules do not understand never match. When no output matches
+and one of them was not understood, the decision is a tie; a tie-breaker
+(e.g. `llm_tie_breaker`, enabled with `DECISION_LLM_TIE_BREAK=1`) may then
+pick the output. Otherwise the decision has no outcome and the strategy
+simply continues with its next column.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select, true
+from sqlalchemy.orm import Session
+
+from . import communication_log, llm_client, models
+
+if TYPE_CHECKING:
+    from .strategy_scheduler import DueBlock
+
+
+# Owners per IN (...) query.
+CHUNK_SIZE = 5000
+
+LLM_DEADLINE_SECONDS = float(os.getenv("DECISION_LLM_DEADLINE", "5"))
+
+_AMOUNT = r"[₹$]?\s*([\d,]+(?:\.\d+)?)\s*(k)?"
+_ABOVE = r"(?:over|above|more than|greater than|exceeds?|at least|>=?)"
+_BELOW = r"(?:under|below|less than|at most|<=?)"
+
+# (rule kind, pattern), tried in order; negated forms come before positive ones.
+_RULES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("always", re.compile(r"\b(otherwise|default|else|any other|fallback|always)\b")),
+    ("paid_in_full", re.compile(
+        r"\b(paid in full|full(y)? paid|full payment|settled|cleared|no (remaining )?balance)\b"
+    )),
+    ("partial_payment", re.compile(r"\bpartial(ly)?\s+(payment|paid|pay)\b")),
+    ("no_payment", re.compile(
+        r"\b(no|without( a| any)?) payments?\b"
+        r"|\b(not|never|hasn't|has not|didn't|did not) (yet )?(paid|pay|made (a|any) payment)\b"
+    )),
+    ("no_response", re.compile(
+        r"\bno (response|reply|contact|answer|engagement)\b"
+        r"|\b(not|never|hasn't|has not|didn't|did not) "
+        r"(respond|responded|reply|replied|answer|answered|contact(ed)?|engage[d]?)\b"
+        r"|\b(ignor|unresponsive)"
+    )),
+    ("payment", re.compile(r"\b(payment (received|made)|paid|made a payment|any payment|payment)\b")),
+    ("responded", re.compile(
+        r"\b(respond(ed|s)?|repl(y|ied|ies)|contacted us|reached out|answered|engaged|response)\b"
+    )),
+]
+_BALANCE = re.compile(rf"\b(balance|remaining|amount|owe[sd]?|outstanding)\b.*?\b({_ABOVE}|{_BELOW})\s*{_AMOUNT}")
+_OVERDUE = re.compile(rf"({_ABOVE}|{_BELOW})\s*(\d+)\s*days?\s*(overdue|late|past due)")
+
+
+@dataclass(frozen=True)
+class Rule:
+    kind: str
+    threshold: float = 0.0
+
+
+@dataclass
+class DecisionFeatures:
+    remaining: np.ndarray  # float64, NaN when unknown
+    paid_since: np.ndarray  # float64, payments dated on/after the execution started
+    responses: np.ndarray  # int64, inbound communication log events since the execution started
+    days_overdue: np.ndarray  # float64, NaN without a due date
+
+
+@dataclass
+class Decision:
+    output: Optional[int]  # index into decision_outputs, None if nothing applied
+    source: str  # "rule", "tie_breaker" or "none"
+    condition: Optional[str] = None
+    next_timing: Optional[str] = None
+    action: Optional[str] = None
+
+
+TieBreaker = Callable[[List[Tuple[Dict[str, Any], Dict[str, Any]]]], List[Optional[int]]]
+
+
+@lru_cache(maxsize=4096)
+def compile_condition(condition: str) -> Optional[Rule]:
+    """The rule a condition describes, or None if it is not understood."""
+    text = (condition or "").strip().lower()
+    match = _BALANCE.search(text)
+    if match:
+        amount = float(match.group(3).replace(",", "")) * (1000 if match.group(4) else 1)
+        return Rule("balance_above" if re.fullmatch(_ABOVE, match.group(2)) else "balance_below", amount)
+    match = _OVERDUE.search(text)
+    if match:
+        days = float(match.group(2))
+        return Rule("overdue_above" if re.fullmatch(_ABOVE, match.group(1)) else "overdue_below", days)
+    for kind, pattern in _RULES:
+        if pattern.search(text):
+            return Rule(kind)
+    return None
+
+
+def _mask(rule: Rule, f: DecisionFeatures) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        if rule.kind == "always":
+            return np.ones(len(f.remaining), dtype=bool)
+        if rule.kind == "paid_in_full":
+            return f.remaining <= 0
+        if rule.kind == "partial_payment":
+            return (f.paid_since > 0) & (f.remaining > 0)
+        if rule.kind == "payment":
+            return f.paid_since > 0
+        if rule.kind == "no_payment":
+            return f.paid_since <= 0
+        if rule.kind == "responded":
+            return f.responses > 0
+        if rule.kind == "no_response":
+            return (f.responses == 0) & (f.paid_since <= 0)
+        if rule.kind == "balance_above":
+            return f.remaining > rule.threshold
+        if rule.kind == "balance_below":
+            return f.remaining < rule.threshold
+        if rule.kind == "overdue_above":
+            return f.days_overdue > rule.threshold
+        if rule.kind == "overdue_below":
+            return f.days_overdue < rule.threshold
+    raise ValueError(f"Unknown rule kind {rule.kind!r}")
+
+
+def _user_chunks(user_ids: np.ndarray):
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        yield user_ids[start:start + CHUNK_SIZE].tolist()
+
+
+def load_features(
+    db: Session,
+    owner_ids: np.ndarray,
+    since: np.ndarray,
+    *,
+    today: np.datetime64,
+) -> DecisionFeatures:
+    """Features per row for user owners `owner_ids` (int64) from `since` (datetime64[D]).
+
+    Rows whose owner is not a user (pass -1) get unknown balances and no
+    payments.
+    """
+    n = len(owner_ids)
+    users = np.unique(owner_ids[owner_ids >= 0])
+    remaining = np.full(len(users), np.nan)
+    days_overdue = np.full(len(users), np.nan)
+    paid = np.zeros(len(users))
+    responses = np.zeros(len(users), dtype="int64")
+
+    if len(users):
+        field = lambda path: func.json_extract(models.User.details, path)  # noqa: E731
+        frames = [
+            pd.DataFrame.from_records(
+                db.execute(
+                    select(
+                        models.User.id,
+                        field("$.amount_owed"),
+                        field("$.total_paid"),
+                        field("$.remaining_amount"),
+                        field("$.due_date"),
+                    ).where(models.User.id.in_(chunk))
+                ).all(),
+                columns=["id", "amount_owed", "total_paid", "remaining_amount", "due_date"],
+            )
+            for chunk in _user_chunks(users)
+        ]
+        df = pd.concat(frames, ignore_index=True)
+        idx = np.searchsorted(users, df["id"].to_numpy(dtype="int64"))
+
+        def numeric(name: str) -> np.ndarray:
+            return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype="float64")
+
+        owed = numeric("amount_owed")
+        derived = np.maximum(0.0, owed - np.nan_to_num(numeric("total_paid"), nan=0.0))
+        stated = numeric("remaining_amount")
+        remaining[idx] = np.where(np.isnan(stated), derived, stated)
+        due = pd.to_datetime(
+            df["due_date"].astype("string").str.slice(0, 10), format="%Y-%m-%d", errors="coerce"
+        ).to_numpy().astype("datetime64[D]")
+        overdue = (today - due).astype("float64")
+        overdue[np.isnat(due)] = np.nan
+        days_overdue[idx] = overdue
+
+        # Each owner's own window starts at the earliest `since` among their rows.
+        owner_since = np.full(len(users), np.datetime64("9999-12-31", "D"))
+        user_rows = owner_ids >= 0
+        np.minimum.at(owner_since, np.searchsorted(users, owner_ids[user_rows]), since[user_rows])
+        responses = communication_log.count_responses(db, "user", users, owner_since)
+
+        # Payments on or after the earliest `since` in the batch, filtered per owner below.
+        earliest = str(since[owner_ids >= 0].min())
+        payments = func.json_each(models.User.details, "$.payment_history").table_valued("value")
+        amount = func.json_extract(payments.c.value, "$.amount")
+        paid_on = func.json_extract(payments.c.value, "$.date")
+        rows = [
+            row
+            for chunk in _user_chunks(users)
+            for row in db.execute(
+                select(models.User.id, amount, paid_on)
+                .select_from(models.User)
+                .join(payments, true())
+                .where(models.User.id.in_(chunk), paid_on >= earliest)
+            )
+        ]
+        if rows:
+            pay = pd.DataFrame.from_records(rows, columns=["id", "amount", "date"])
+            pay_idx = np.searchsorted(users, pay["id"].to_numpy(dtype="int64"))
+            pay_amount = pd.to_numeric(pay["amount"], errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+            pay_date = pd.to_datetime(
+                pay["date"].astype("string").str.slice(0, 10), format="%Y-%m-%d", errors="coerce"
+            ).to_numpy().astype("datetime64[D]")
+            counted = ~np.isnat(pay_date) & (pay_date >= owner_since[pay_idx])
+            paid = np.bincount(pay_idx[counted], weights=pay_amount[counted], minlength=len(users))
+
+    is_user = owner_ids >= 0
+    if not len(users):
+        return DecisionFeatures(
+            remaining=np.full(n, np.nan),
+            paid_since=np.zeros(n),
+            responses=np.zeros(n, dtype="int64"),
+            days_overdue=np.full(n, np.nan),
+        )
+    row_idx = np.clip(np.searchsorted(users, np.where(is_user, owner_ids, 0)), 0, len(users) - 1)
+    return DecisionFeatures(
+        remaining=np.where(is_user, remaining[row_idx], np.nan),
+        paid_since=np.where(is_user, paid[row_idx], 0.0),
+        responses=np.where(is_user, responses[row_idx], 0),
+        days_overdue=np.where(is_user, days_overdue[row_idx], np.nan),
+    )
+
+
+def evaluate(blocks: Sequence[Dict[str, Any]], features: DecisionFeatures) -> Tuple[np.ndarray, np.ndarray]:
+    """Chosen output index per decision block (-1 if none) and a mask of ties."""
+    chosen = np.full(len(blocks), -1, dtype="int64")
+    ties = np.zeros(len(blocks), dtype=bool)
+
+    groups: Dict[Tuple[str, ...], List[int]] = {}
+    for row, block in enumerate(blocks):
+        conditions = tuple((o or {}).get("condition") or "" for o in block.get("decision_outputs") or [])
+        groups.setdefault(conditions, []).append(row)
+
+    masks: Dict[Rule, np.ndarray] = {}
+    for conditions, rows in groups.items():
+        if not conditions:
+            continue
+        idx = np.asarray(rows, dtype="int64")
+        rules = [compile_condition(c) for c in conditions]
+        matrix = np.zeros((len(rules), len(idx)), dtype=bool)
+        for k, rule in enumerate(rules):
+            if rule is not None:
+                if rule not in masks:
+                    masks[rule] = _mask(rule, features)
+                matrix[k] = masks[rule][idx]
+        matched = matrix.any(axis=0)
+        chosen[idx] = np.where(matched, matrix.argmax(axis=0), -1)
+        if any(rule is None for rule in rules):
+            ties[idx] = ~matched
+    return chosen, ties
+
+
+def decide(
+    db: Session,
+    due: Sequence["DueBlock"],
+    *,
+    now: datetime,
+    tie_breaker: Optional[TieBreaker] = None,
+) -> List[Decision]:
+    """Evaluate every due decision block in one vectorized pass."""
+    if not due:
+        return []
+    owner_ids = np.fromiter(
+        (d.owner_id if d.owner_type == "user" else -1 for d in due), dtype="int64", count=len(due)
+    )
+    since = np.array([d.started_at.date() for d in due], dtype="datetime64[D]")
+    with db.no_autoflush:
+        features = load_features(db, owner_ids, since, today=np.datetime64(now.date(), "D"))
+    blocks = [d.block for d in due]
+    chosen, ties = evaluate(blocks, features)
+
+    sources = np.where(chosen >= 0, "rule", "none").astype(object)
+    tied = np.flatnonzero(ties)
+    if tie_breaker is not None and len(tied):
+        contexts = [
+            (
+                blocks[i],
+                {
+                    "remaining_amount": _number(features.remaining[i]),
+                    "paid_since_start": _number(features.paid_since[i]),
+                    "responses_since_start": int(features.responses[i]),
+                    "days_overdue": _number(features.days_overdue[i]),
+                },
+            )
+            for i in tied
+        ]
+        for i, pick in zip(tied, tie_breaker(contexts)):
+            outputs = blocks[i].get("decision_outputs") or []
+            if pick is not None and 0 <= pick < len(outputs):
+                chosen[i], sources[i] = pick, "tie_breaker"
+
+    decisions = []
+    for i, block in enumerate(blocks):
+        if chosen[i] < 0:
+            decisions.append(Decision(output=None, source="none"))
+            continue
+        output = (block.get("decision_outputs") or [])[chosen[i]] or {}
+        decisions.append(
+            Decision(
+                output=int(chosen[i]),
+                source=str(sources[i]),
+                condition=output.get("condition"),
+                next_timing=output.get("next_timing"),
+                action=output.get("action"),
+            )
+        )
+    return decisions
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def tie_breaker_enabled() -> bool:
+    return os.getenv("DECISION_LLM_TIE_BREAK", "").lower() in {"1", "true", "yes"} and bool(
+        os.getenv("OPENAI_API_KEY")
+    )
+
+
+async def llm_choose(block: Dict[str, Any], facts: Dict[str, Any]) -> Optional[int]:
+    """Ask the model which of a decision block's outputs applies."""
+    outputs = block.get("decision_outputs") or []
+    options = "\n".join(f"{i}: {(o or {}).get('condition')}" for i, o in enumerate(outputs))
+    payload = {
+        "model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        "messages": [
+            {
+                "role": "system",
+                "content": (
+                    "You decide the next step of a debt collection strategy. "
+                    'Reply ONLY with a JSON object {"choice": <option number or null>}.'
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"Decision: {block.get('decision_prompt') or ''}\n"
+                    f"Debtor facts: {json.dumps(facts)}\n"
+                    f"Options:\n{options}"
+                ),
+            },
+        ],
+        "temperature": 0,
+        "max_tokens": 20,
+        "response_format": {"type": "json_object"},
+    }
+    try:
+        data = await llm_client.post_chat_completion(
+            payload, api_key=os.getenv("OPENAI_API_KEY"), deadline=LLM_DEADLINE_SECONDS
+        )
+        choice = json.loads(data["choices"][0]["message"]["content"]).get("choice")
+    except Exception:
+        return None
+    return choice if isinstance(choice, int) else None
+
+
+def llm_tie_breaker(loop: asyncio.AbstractEventLoop, *, concurrency: int = 8) -> TieBreaker:
+    """A tie-breaker for code running in a worker thread that asks the model on `loop`."""
+
+    def run(contexts: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[Optional[int]]:
+        async def all_choices() -> List[Optional[int]]:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(block: Dict[str, Any], facts: Dict[str, Any]) -> Optional[int]:
+                async with semaphore:
+                    return await llm_choose(block, facts)
+
+            return await asyncio.gather(*(one(block, facts) for block, facts in contexts))
+
+        return asyncio.run_coroutine_threadsafe(all_choices(), loop).result()
+
+    return run
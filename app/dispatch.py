@@ -0,0 +1,489 @@
+"""Delivery of action blocks through per-channel adapters.
+
+Due action blocks are written to `outbox_messages` in the same transaction
+that advances their strategy execution (see `enqueue`), so a message is
+queued exactly when its column runs and survives restarts. The
+`Dispatcher` then drains the outbox with one loop per channel:
+
+- a loop claims up to the adapter's `batch_size` due messages with a single
+  `UPDATE ... RETURNING` (so several processes never claim the same row) and
+  hands them to the adapter's `send_batch`;
+- at most `concurrency` batches are in flight per channel, and a loop only
+  claims the next batch once a slot is free. A slow channel therefore backs
+  up in the outbox, not in memory, and never holds up the other channels;
+- failed messages are retried with exponential backoff and jitter up to
+  `DISPATCH_MAX_ATTEMPTS` (default 5), then marked failed. Messages left
+  `sending` by a crashed process are reclaimed after `DISPATCH_LEASE`
+  seconds.
+
+Every attempt's outcome is appended to the communication log.
+
+Adapters come from `DISPATCH_SINK` (and `DISPATCH_SINK_<CHANNEL>` per
+channel): `memory` (default, keeps messages in process), `file:<dir>`
+(appends one JSON line per message to `<dir>/<channel>.ndjson`) or
+`webhook:<url>` (POSTs each batch as JSON). Tests install their own with
+`set_adapter`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import httpx
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import communication_log, contact_routes, llm_client, models, strategy_scheduler
+from .database import SessionLocal
+from .strategy_scheduler import DueBlock
+
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ("email", "sms", "call")
+
+# Block source -> channel, and the contact route each channel uses.
+_SOURCE_CHANNELS = {"email": "email", "sms": "sms", "call": "call", "phone": "call"}
+_CHANNEL_ROUTES = {"email": "email", "sms": "sms", "call": "phone"}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+MAX_ATTEMPTS = int(_env_float("DISPATCH_MAX_ATTEMPTS", 5))
+BACKOFF_SECONDS = _env_float("DISPATCH_BACKOFF", 30)
+MAX_BACKOFF_SECONDS = _env_float("DISPATCH_MAX_BACKOFF", 3600)
+LEASE_SECONDS = _env_float("DISPATCH_LEASE", 300)
+
+
+@dataclass
+class Outbound:
+    """A claimed message as handed to an adapter."""
+
+    id: int
+    channel: str
+    recipient: str
+    content: Optional[str]
+    tone: Optional[str]
+    timing: Optional[str]
+    owner_type: str
+    owner_id: int
+    attempts: int
+
+
+@dataclass
+class SendResult:
+    ok: bool
+    error: Optional[str] = None
+    retryable: bool = True
+
+
+class ChannelAdapter:
+    """Sends batches of messages on one channel."""
+
+    batch_size = 100
+    concurrency = 4  # batches in flight
+    timeout = 30.0  # seconds per batch
+
+    async def send_batch(self, messages: List[Outbound]) -> List[SendResult]:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        """Release anything the adapter holds open; called on shutdown."""
+
+
+class MemorySink(ChannelAdapter):
+    """Keeps sent messages in `sent`; optionally slow or failing, for tests and benchmarks."""
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        fail: Optional[Callable[[Outbound], Optional[str]]] = None,
+    ):
+        self.latency = latency
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.fail = fail
+        self.sent: List[Outbound] = []
+
+    async def send_batch(self, messages: List[Outbound]) -> List[SendResult]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        results = []
+        for message in messages:
+            error = self.fail(message) if self.fail else None
+            if error:
+                results.append(SendResult(ok=False, error=error))
+            else:
+                self.sent.append(message)
+                results.append(SendResult(ok=True))
+        return results
+
+
+class FileSink(ChannelAdapter):
+    """Appends each message as a JSON line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, messages: List[Outbound]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for message in messages:
+                fh.write(json.dumps(asdict(message)) + "\n")
+
+    async def send_batch(self, messages: List[Outbound]) -> List[SendResult]:
+        await asyncio.to_thread(self._write, messages)
+        return [SendResult(ok=True) for _ in messages]
+
+
+class WebhookSink(ChannelAdapter):
+    """POSTs `{"channel", "messages": [...]}` to a delivery service.
+
+    Batches share one pooled client, sized to the adapter's concurrency.
+    `client_options` go to `httpx.AsyncClient` (e.g. a mock transport in tests).
+    """
+
+    def __init__(self, url: str, channel: str, **client_options: Any):
+        self.url = url
+        self.channel = channel
+        self.client_options = client_options
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the event loop that opened them, as in llm_client.get_client.
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            if self._client is not None:
+                llm_client.close_replaced(self._client, self._client_loop)
+            options = {"timeout": self.timeout, "limits": httpx.Limits(max_connections=self.concurrency)}
+            self._client = httpx.AsyncClient(**{**options, **self.client_options})
+            self._client_loop = loop
+        return self._client
+
+    async def send_batch(self, messages: List[Outbound]) -> List[SendResult]:
+        resp = await self._get_client().post(
+            self.url, json={"channel": self.channel, "messages": [asdict(m) for m in messages]}
+        )
+        if resp.is_success:
+            return [SendResult(ok=True) for _ in messages]
+        error = f"HTTP {resp.status_code}"
+        # Client errors will not succeed on retry.
+        retryable = resp.status_code >= 500 or resp.status_code == 429
+        return [SendResult(ok=False, error=error, retryable=retryable) for _ in messages]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client, self._client_loop = None, None
+
+
+def _adapter_from_env(channel: str) -> ChannelAdapter:
+    spec = os.getenv(f"DISPATCH_SINK_{channel.upper()}") or os.getenv("DISPATCH_SINK", "memory")
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileSink(os.path.join(target or "outbox", f"{channel}.ndjson"))
+    if kind == "webhook" and target:
+        return WebhookSink(target, channel)
+    return MemorySink()
+
+
+_adapters: Dict[str, ChannelAdapter] = {}
+
+
+def get_adapter(channel: str) -> ChannelAdapter:
+    if channel not in _adapters:
+        _adapters[channel] = _adapter_from_env(channel)
+    return _adapters[channel]
+
+
+async def shutdown() -> None:
+    """Close the configured adapters; the next send creates them again."""
+    for adapter in list(_adapters.values()):
+        await adapter.aclose()
+    _adapters.clear()
+
+
+def set_adapter(channel: str, adapter: Optional[ChannelAdapter]) -> None:
+    """Install `adapter` for `channel`; None goes back to the configured one."""
+    if adapter is None:
+        _adapters.pop(channel, None)
+    else:
+        _adapters[channel] = adapter
+
+
+def enqueue(db: Session, due: Sequence[DueBlock], *, now: Optional[datetime] = None) -> int:
+    """Queue due action blocks; usable as the scheduler's `on_due`.
+
+    Blocks without a `contact_method_detail` go to the owner's contact for
+    the channel, read from `contact_routes`. Messages with no channel or
+    recipient are stored as `undeliverable` so they show up instead of
+    disappearing.
+    """
+    if not due:
+        return 0
+    now = now or strategy_scheduler.get_clock().now()
+    routes = contact_routes.load(db, (d.owner_id for d in due if d.owner_type == "user"))
+
+    rows = []
+    for d in due:
+        block = d.block
+        channel = _SOURCE_CHANNELS.get((block.get("source") or "").lower())
+        recipient = block.get("contact_method_detail")
+        if not recipient and channel and d.owner_type == "user":
+            recipient = routes.get(d.owner_id, {}).get(_CHANNEL_ROUTES[channel])
+        rows.append(
+            {
+                "execution_id": d.execution_id,
+                "strategy_id": d.strategy_id,
+                "owner_type": d.owner_type,
+                "owner_id": d.owner_id,
+                "channel": channel or (block.get("source") or "unknown"),
+                "recipient": recipient,
+                "tone": block.get("tone"),
+                "content": block.get("content"),
+                "timing": d.timing,
+                "status": "pending" if channel and recipient else "undeliverable",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+        )
+    db.execute(insert(models.OutboxMessage), rows)
+    return len(rows)
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before retry number `attempts`, with full jitter."""
+    return random.uniform(0.5, 1.0) * min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempts - 1))
+
+
+@dataclass
+class ChannelStats:
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    batches: int = 0
+    in_flight: int = 0
+    send_seconds: float = 0.0  # wall time with at least one batch in flight
+    _busy_since: Optional[float] = None
+
+    def batch_started(self) -> None:
+        if self.in_flight == 0:
+            self._busy_since = time.perf_counter()
+        self.in_flight += 1
+
+    def batch_finished(self) -> None:
+        self.in_flight -= 1
+        self.batches += 1
+        if self.in_flight == 0 and self._busy_since is not None:
+            self.send_seconds += time.perf_counter() - self._busy_since
+            self._busy_since = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+            "in_flight": self.in_flight,
+            "messages_per_second": round(self.sent / self.send_seconds, 1) if self.send_seconds else None,
+        }
+
+
+class Dispatcher:
+    """Drains the outbox, one independent loop per channel."""
+
+    def __init__(
+        self,
+        *,
+        session_factory: Callable[[], Session] = SessionLocal,
+        clock: Optional[Callable[[], datetime]] = None,
+    ):
+        self.session_factory = session_factory
+        # The scheduler's clock, so simulated time drives retries too.
+        self.clock = clock or (lambda: strategy_scheduler.get_clock().now())
+        self.stats: Dict[str, ChannelStats] = {}
+
+    def _claim(self, channel: str, limit: int) -> List[Outbound]:
+        outbox = models.OutboxMessage
+        now = self.clock()
+        due = or_(
+            and_(outbox.status == "pending", outbox.next_attempt_at <= now),
+            and_(outbox.status == "sending", outbox.claimed_at < now - timedelta(seconds=LEASE_SECONDS)),
+        )
+        ids = (
+            select(outbox.id)
+            .where(outbox.channel == channel, due)
+            .order_by(outbox.next_attempt_at, outbox.id)
+            .limit(limit)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(outbox)
+            .where(outbox.id.in_(ids))
+            .values(status="sending", claimed_at=now, attempts=outbox.attempts + 1)
+            .returning(
+                outbox.id,
+                outbox.channel,
+                outbox.recipient,
+                outbox.content,
+                outbox.tone,
+                outbox.timing,
+                outbox.owner_type,
+                outbox.owner_id,
+                outbox.attempts,
+            )
+        )
+        db = self.session_factory()
+        try:
+            claimed = [Outbound(*row) for row in db.execute(stmt)]
+            db.commit()
+        finally:
+            db.close()
+        return sorted(claimed, key=lambda m: m.id)
+
+    def _record(self, channel: str, messages: List[Outbound], results: List[SendResult]) -> None:
+        now = self.clock()
+        stats = self.stats[channel]
+        updates = []
+        events = []
+        for message, result in zip(messages, results):
+            if result.ok:
+                updates.append({"id": message.id, "status": "sent", "sent_at": now, "last_error": None})
+                stats.sent += 1
+                outcome = "sent"
+            elif result.retryable and message.attempts < MAX_ATTEMPTS:
+                retry_at = now + timedelta(seconds=backoff(message.attempts))
+                updates.append(
+                    {"id": message.id, "status": "pending", "next_attempt_at": retry_at, "last_error": result.error}
+                )
+                stats.retried += 1
+                outcome = "retrying"
+            else:
+                updates.append({"id": message.id, "status": "failed", "last_error": result.error})
+                stats.failed += 1
+                outcome = "failed"
+            events.append(
+                {
+                    "owner_type": message.owner_type,
+                    "owner_id": message.owner_id,
+                    "direction": "outbound",
+                    "channel": channel,
+                    "outcome": outcome,
+                    "detail": result.error,
+                    "message_id": message.id,
+                    "occurred_at": now,
+                }
+            )
+        db = self.session_factory()
+        try:
+            # Grouped by the columns they set, so each group is one executemany.
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for row in updates:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            for rows in groups.values():
+                db.execute(update(models.OutboxMessage), rows)
+            communication_log.record(db, events, now=now)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _send(
+        self, channel: str, adapter: ChannelAdapter, batch: List[Outbound], slots: asyncio.Semaphore
+    ) -> None:
+        stats = self.stats[channel]
+        stats.batch_started()
+        try:
+            try:
+                results = await asyncio.wait_for(adapter.send_batch(batch), timeout=adapter.timeout)
+                if len(results) != len(batch):
+                    raise ValueError(f"adapter returned {len(results)} results for {len(batch)} messages")
+            except Exception as exc:
+                results = [SendResult(ok=False, error=f"{type(exc).__name__}: {exc}") for _ in batch]
+            await asyncio.to_thread(self._record, channel, batch, results)
+        finally:
+            stats.batch_finished()
+            slots.release()
+
+    async def run_channel(self, channel: str, *, stop_when_idle: bool = False, poll_interval: float = 1.0) -> None:
+        """Claim and send `channel`'s due messages until idle (or forever)."""
+        adapter = get_adapter(channel)
+        self.stats.setdefault(channel, ChannelStats())
+        slots = asyncio.Semaphore(adapter.concurrency)
+        in_flight: set = set()
+        try:
+            while True:
+                # Backpressure: claim nothing until a batch slot is free.
+                await slots.acquire()
+                try:
+                    batch = await asyncio.to_thread(self._claim, channel, adapter.batch_size)
+                except Exception:
+                    slots.release()
+                    if stop_when_idle:
+                        raise
+                    logger.exception("Outbox claim failed for %s", channel)
+                    await asyncio.sleep(poll_interval)
+                    continue
+                if batch:
+                    task = asyncio.create_task(self._send(channel, adapter, batch, slots))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                    continue
+                slots.release()
+                if in_flight:
+                    # Finished batches may have scheduled retries or freed rows.
+                    await asyncio.wait(set(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                elif stop_when_idle:
+                    return
+                else:
+                    await asyncio.sleep(poll_interval)
+        finally:
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def drain(self, channels: Sequence[str] = CHANNELS) -> Dict[str, Dict[str, Any]]:
+        """Send everything currently due on `channels`, each channel independently."""
+        await asyncio.gather(*(self.run_channel(channel, stop_when_idle=True) for channel in channels))
+        return self.metrics()
+
+    async def run_forever(self, channels: Sequence[str] = CHANNELS, poll_interval: float = 1.0) -> None:
+        await asyncio.gather(*(self.run_channel(c, poll_interval=poll_interval) for c in channels))
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {channel: stats.metrics() for channel, stats in self.stats.items()}
+
+
+dispatcher = Dispatcher()
+
+
+def outbox_counts(db: Session) -> Dict[str, Dict[str, int]]:
+    """Message counts per channel and status."""
+    outbox = models.OutboxMessage
+    counts: Dict[str, Dict[str, int]] = {}
+    for channel, status, count in db.query(outbox.channel, outbox.status, func.count(outbox.id)).group_by(
+        outbox.channel, outbox.status
+    ):
+        counts.setdefault(channel, {})[status] = count
+    return counts
+
+
+def interval_from_env() -> float:
+    """Outbox poll interval in seconds from DISPATCH_INTERVAL; 0 disables the dispatcher."""
+    return max(_env_float("DISPATCH_INTERVAL", 0), 0)
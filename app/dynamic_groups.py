@@ -0,0 +1,229 @@
+"""Rule-based groups whose members are the users matching a saved rule.
+
+A rule is `{"all": [...], "any": [...]}`. Every condition in `all` must
+hold, and at least one in `any` if it is given. Each condition is
+`{"field", "op", "value"}`. `field` is `status`, one of the derived fields
+`remaining`, `days_overdue` or `preferred_contact`, or any top-level key of
+`details`. `op` is one of eq, ne, gt, gte, lt, lte, in, not_in or exists.
+
+Rules compile to a SQL condition on `users`, so membership is materialized
+in `dynamic_group_members` with set-based `DELETE` and `INSERT ... SELECT`
+statements. Membership is refreshed incrementally. `refresh_users` runs from
+`user_changes` for the users a committing session changed (ingestion,
+payments, status updates) and for rows touched by bulk updates. Rules on
+`days_overdue` also change with the calendar. `refresh` re-evaluates such
+groups in full once a day.
+
+A rule-based group is a `groups` row, so it can be used wherever a group id
+is accepted. Code that needs a group's members uses `members_clause` and
+`memberships` rather than `users.group_id`.
+"""
+
+from __future__ import annotations
+
+import re
+from datetime import date
+from typing import Any, Collection, Dict, Iterable, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Float, and_, case, cast, delete, func, insert, literal, or_, select, true, union_all
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from . import models
+
+OPS = ("eq", "ne", "gt", "gte", "lt", "lte", "in", "not_in", "exists")
+DERIVED_FIELDS = ("remaining", "days_overdue", "preferred_contact")
+
+# Users re-evaluated per statement.
+CHUNK_SIZE = 5000
+
+_DETAILS_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _details(key: str):
+    return func.json_extract(models.User.details, f"$.{key}")
+
+
+def _field(name: str, today: date) -> ColumnElement:
+    user = models.User
+    if name == "status":
+        return user.status
+    if name == "remaining":
+        owed = func.coalesce(cast(_details("amount_owed"), Float), 0.0)
+        paid = func.coalesce(cast(_details("total_paid"), Float), 0.0)
+        return func.coalesce(cast(_details("remaining_amount"), Float), func.max(0.0, owed - paid))
+    if name == "days_overdue":
+        return func.julianday(today.isoformat()) - func.julianday(func.substr(_details("due_date"), 1, 10))
+    if name == "preferred_contact":
+        methods = func.json_each(user.details, "$.contact_methods").table_valued("value")
+        preferred = func.json_extract(methods.c.value, "$.is_preferred")
+        return (
+            select(func.json_extract(methods.c.value, "$.method"))
+            .where(or_(preferred == 1, preferred == true()))
+            .limit(1)
+            .scalar_subquery()
+        )
+    if not _DETAILS_KEY.match(name or ""):
+        raise ValueError(f"Unknown field {name!r}")
+    return _details(name)
+
+
+def _condition(cond: Dict[str, Any], today: date) -> ColumnElement:
+    field, op, value = cond.get("field"), cond.get("op") or "eq", cond.get("value")
+    if op not in OPS:
+        raise ValueError(f"Unknown op {op!r}; expected one of {', '.join(OPS)}")
+    expr = _field(field, today)
+    if op == "exists":
+        return expr.is_not(None) if value is None or value else expr.is_(None)
+    if op in ("gt", "gte", "lt", "lte"):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{field} {op} needs a number, got {value!r}")
+        number = cast(expr, Float)
+        return {"gt": number > value, "gte": number >= value, "lt": number < value, "lte": number <= value}[op]
+    values = value if op in ("in", "not_in") else [value]
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"{field} {op} needs a non-empty list")
+    # Strings compare case-insensitively ("Phone" matches "phone").
+    texts = [v.lower() for v in values if isinstance(v, str)]
+    others = [v for v in values if not isinstance(v, str)]
+    parts = []
+    if texts:
+        parts.append(func.lower(expr).in_(texts))
+    if others:
+        parts.append(expr.in_(others))
+    matched = or_(*parts)
+    return matched if op in ("eq", "in") else and_(expr.is_not(None), ~matched)
+
+
+def compile_rule(rule: Dict[str, Any], today: date) -> ColumnElement:
+    """SQL condition on `users` for `rule`; raises ValueError if it is invalid."""
+    if not isinstance(rule, dict):
+        raise ValueError("A rule must be an object with 'all' and/or 'any' conditions")
+    all_of = [_condition(c, today) for c in rule.get("all") or []]
+    any_of = [_condition(c, today) for c in rule.get("any") or []]
+    if not all_of and not any_of:
+        raise ValueError("A rule needs at least one condition")
+    return and_(*all_of, or_(*any_of)) if any_of else and_(*all_of)
+
+
+def uses_calendar(rule: Dict[str, Any]) -> bool:
+    """Whether members can change from one day to the next without any write."""
+    return any(c.get("field") == "days_overdue" for c in (rule.get("all") or []) + (rule.get("any") or []))
+
+
+def is_dynamic(db: Session, group_id: int) -> bool:
+    group = db.get(models.Group, group_id)
+    return group is not None and group.rule is not None
+
+
+def members_clause(db: Session, group_id: int) -> ColumnElement:
+    """SQL condition on `users` selecting the members of any group."""
+    user, member = models.User, models.DynamicGroupMember
+    if is_dynamic(db, group_id):
+        return user.id.in_(select(member.user_id).where(member.group_id == group_id))
+    return user.group_id == group_id
+
+
+def memberships():
+    """(group_id, user_id) for every membership, static and rule-based."""
+    user, member = models.User, models.DynamicGroupMember
+    return union_all(
+        select(user.group_id.label("group_id"), user.id.label("user_id")).where(user.group_id.is_not(None)),
+        select(member.group_id, member.user_id),
+    ).subquery("memberships")
+
+
+def member_counts(db: Session, group_ids: Iterable[int]) -> Dict[int, int]:
+    ids = list(group_ids)
+    if not ids:
+        return {}
+    m = memberships()
+    query = select(m.c.group_id, func.count()).where(m.c.group_id.in_(ids)).group_by(m.c.group_id)
+    return dict(db.execute(query).all())
+
+
+def refresh_group(db: Session, group: models.Group, *, today: Optional[date] = None) -> int:
+    """Re-evaluate the whole group; the caller commits. Returns the member count."""
+    today = today or date.today()
+    user, member = models.User, models.DynamicGroupMember
+    clause = compile_rule(group.rule, today)
+    db.execute(delete(member).where(member.group_id == group.id))
+    db.execute(
+        insert(member).from_select(["group_id", "user_id"], select(literal(group.id), user.id).where(clause))
+    )
+    group.refreshed_on = today
+    return db.execute(select(func.count()).where(member.group_id == group.id)).scalar_one()
+
+
+def refresh(db: Session, *, today: Optional[date] = None, full: bool = False) -> Dict[str, int]:
+    """Refresh rule-based groups that depend on the date and were not refreshed today (all with `full`)."""
+    today = today or date.today()
+    refreshed = 0
+    for group in db.query(models.Group).filter(models.Group.rule.is_not(None)):
+        if full or group.refreshed_on is None or (group.refreshed_on < today and uses_calendar(group.rule)):
+            refresh_group(db, group, today=today)
+            refreshed += 1
+    db.commit()
+    return {"groups": refreshed}
+
+
+def _matches_by_group(group_id: ColumnElement, rules: Sequence[Tuple[int, Dict[str, Any]]], today: date):
+    """1 if the user row matches the rule of the group whose id is `group_id` (a column), else 0."""
+    return case(
+        {gid: case((compile_rule(rule, today), 1), else_=0) for gid, rule in rules},
+        value=group_id,
+        else_=0,
+    )
+
+
+def _columns_read(rule: Dict[str, Any]) -> Set[str]:
+    """The `users` columns a rule's conditions read."""
+    fields = [c.get("field") for c in (rule.get("all") or []) + (rule.get("any") or [])]
+    return {"status" if field == "status" else "details" for field in fields}
+
+
+def refresh_users(
+    db: Session,
+    user_filter: ColumnElement,
+    *,
+    today: Optional[date] = None,
+    columns: Optional[Collection[str]] = None,
+) -> None:
+    """Re-evaluate the users matching `user_filter` against every rule; the caller commits.
+
+    All rules are evaluated in one INSERT and one DELETE, whatever the number
+    of rule-based groups. With `columns`, rules that read none of them are
+    skipped. Matching users are inserted before non-matching members are
+    deleted, so `user_filter` may itself select a rule-based group's members.
+    """
+    today = today or date.today()
+    rules = db.execute(select(models.Group.id, models.Group.rule).where(models.Group.rule.is_not(None))).all()
+    if columns is not None:
+        rules = [(gid, rule) for gid, rule in rules if _columns_read(rule) & set(columns)]
+    if not rules:
+        return
+    group, user, member = models.Group, models.User, models.DynamicGroupMember
+    group_ids = [gid for gid, _ in rules]
+    db.execute(
+        insert(member)
+        .prefix_with("OR IGNORE")
+        .from_select(
+            ["group_id", "user_id"],
+            select(group.id, user.id)
+            .join(group, group.id.in_(group_ids))
+            .where(user_filter, _matches_by_group(group.id, rules, today) == 1),
+        )
+    )
+    still_matches = (
+        select(_matches_by_group(member.group_id, rules, today))
+        .where(user.id == member.user_id)
+        .correlate(member)
+        .scalar_subquery()
+    )
+    db.execute(
+        delete(member).where(
+            member.group_id.in_(group_ids),
+            member.user_id.in_(select(user.id).where(user_filter)),
+            still_matches == 0,
+        )
+    )
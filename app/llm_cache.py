@@ -0,0 +1,169 @@
+"""Response cache for LLM calls.
+
+Entries are keyed on everything that determines the model's answer: model,
+system prompt, normalized user prompt and the exact context fields that were
+put into the prompt. Values live in an in-memory LRU with a TTL and can be
+persisted to a small SQLite file so they survive restarts. Expired rows are
+deleted from the file when it is opened and on every write.
+
+Configuration (environment variables):
+- `LLM_CACHE_ENABLED` (default `1`)
+- `LLM_CACHE_MAX_ENTRIES` (default `2048`)
+- `LLM_CACHE_TTL` seconds (default `86400`)
+- `LLM_CACHE_PATH`: SQLite file for on-disk persistence (disabled if unset)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def normalize_prompt(prompt: Optional[str]) -> str:
+    return " ".join((prompt or "").lower().split())
+
+
+def make_key(
+    kind: str,
+    *,
+    model: str,
+    system_prompt: str,
+    user_prompt: Optional[str],
+    context: Dict[str, Any],
+) -> str:
+    material = json.dumps(
+        {
+            "kind": kind,
+            "model": model,
+            "system": system_prompt,
+            "prompt": normalize_prompt(user_prompt),
+            "context": {k: v for k, v in context.items() if v is not None},
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Thread-safe LRU + TTL cache with optional SQLite persistence."""
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 2048,
+        ttl_seconds: float = 86400.0,
+        path: Optional[str] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0, "expired": 0}
+        self._disk: Optional[sqlite3.Connection] = None
+        if path:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at ON llm_cache (expires_at)")
+            self._purge_expired(time.time())
+            self._disk.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._store(key, value, row[1])
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._store(key, value, expires_at)
+            if self._disk is not None:
+                self._purge_expired(now)
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                self._disk.commit()
+
+    def _purge_expired(self, now: float) -> None:
+        # Reads skip expired rows; deleting them here keeps the file from growing without bound.
+        self._disk.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM llm_cache")
+                self._disk.commit()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._disk is not None,
+                "hit_rate": (self._stats["hits"] / lookups) if lookups else 0.0,
+            }
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def cache_enabled() -> bool:
+    return os.getenv("LLM_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048")),
+                ttl_seconds=float(os.getenv("LLM_CACHE_TTL", "86400")),
+                path=os.getenv("LLM_CACHE_PATH") or None,
+            )
+        return _cache
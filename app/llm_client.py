@@ -0,0 +1,506 @@
+"""Shared HTTP client for the OpenAI-compatible chat completions API.
+
+One `httpx.AsyncClient` is kept for the lifetime of the application so calls
+reuse pooled keep-alive connections instead of paying a TCP+TLS handshake per
+request. It is opened and closed by the FastAPI lifespan hook in `main.py`
+and created lazily when code runs outside of it (scripts, tests).
+
+Configuration (environment variables):
+- `LLM_MAX_CONNECTIONS` (default 100), `LLM_MAX_KEEPALIVE_CONNECTIONS` (20),
+  `LLM_KEEPALIVE_EXPIRY` seconds (30)
+- `LLM_CONNECT_TIMEOUT` (5) and `LLM_READ_TIMEOUT` (30) seconds
+- `LLM_HTTP2=1` to negotiate HTTP/2 (needs `pip install httpx[http2]`)
+
+Calls fail fast instead of waiting out the HTTP timeout: a circuit breaker
+opens after repeated failures (`LLM_BREAKER_FAILURES`, default 5) and lets a
+probe through after `LLM_BREAKER_RESET` seconds (30), and callers can pass a
+`deadline` budget per call. With `LLM_HEDGE=1`, a request slower than the
+recent p95 latency (`LLM_HEDGE_PERCENTILE`) is raced against a second copy
+once `LLM_HEDGE_MIN_SAMPLES` (20) latencies have been seen.
+
+`stream_chat_completion` reads a `stream: true` response as server-sent
+events and yields the content deltas as they arrive.
+
+Bulk jobs can bound their request and token rate by installing a
+`RateLimiter` with `rate_limited(...)`; every call made in that context waits
+for its share of the budget.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Set
+
+import httpx
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _http2_requested() -> bool:
+    if os.getenv("LLM_HTTP2", "").lower() not in {"1", "true", "yes"}:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def create_client(**overrides: Any) -> httpx.AsyncClient:
+    """Build a client configured from the environment."""
+    options: Dict[str, Any] = {
+        "limits": httpx.Limits(
+            max_connections=int(_env_float("LLM_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(_env_float("LLM_MAX_KEEPALIVE_CONNECTIONS", 20)),
+            keepalive_expiry=_env_float("LLM_KEEPALIVE_EXPIRY", 30.0),
+        ),
+        "timeout": httpx.Timeout(
+            _env_float("LLM_READ_TIMEOUT", 30.0),
+            connect=_env_float("LLM_CONNECT_TIMEOUT", 5.0),
+        ),
+        "http2": _http2_requested(),
+    }
+    options.update(overrides)
+    return httpx.AsyncClient(**options)
+
+
+async def startup() -> None:
+    global _client, _client_loop
+    if _client is None or _client.is_closed:
+        _client = create_client()
+        _client_loop = asyncio.get_running_loop()
+
+
+async def shutdown() -> None:
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client, _client_loop = None, None
+
+
+def set_client(client: Optional[httpx.AsyncClient]) -> None:
+    """Install a specific client (e.g. one with a mock transport in tests)."""
+    global _client, _client_loop
+    _client = client
+    _client_loop = None
+
+
+# Closes of replaced clients still running on this loop; keeps the tasks referenced until done.
+_closing: Set["asyncio.Task[None]"] = set()
+
+
+async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+    # Connections whose transports died with their loop cannot close cleanly.
+    with suppress(Exception):
+        await client.aclose()
+
+
+def close_replaced(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Close a client created on another event loop, on that loop while it still runs."""
+    if client.is_closed:
+        return
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(_aclose_quietly(client), loop)
+        return
+    task = asyncio.get_running_loop().create_task(_aclose_quietly(client))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating one for the running loop if needed.
+
+    Pooled connections belong to the event loop that opened them, so a client
+    created lazily on another loop (e.g. a previous TestClient request) is
+    closed and replaced rather than reused.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or (_client_loop is not None and _client_loop is not loop):
+        if _client is not None:
+            close_replaced(_client, _client_loop)
+        _client = create_client()
+        _client_loop = loop
+    return _client
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so the budget is handed out in FIFO order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budget for LLM calls."""
+
+    def __init__(
+        self,
+        *,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, tokens: int) -> None:
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(tokens)
+
+
+_rate_limiter: ContextVar[Optional[RateLimiter]] = ContextVar("llm_rate_limiter", default=None)
+
+
+@contextmanager
+def rate_limited(limiter: Optional[RateLimiter]) -> Iterator[None]:
+    """Apply `limiter` to LLM calls made in this context (and tasks created in it)."""
+    token = _rate_limiter.set(limiter)
+    try:
+        yield
+    finally:
+        _rate_limiter.reset(token)
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Rough prompt + completion token budget (~4 characters per token)."""
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in payload.get("messages", []))
+    return prompt_chars // 4 + int(payload.get("max_tokens") or 0)
+
+
+def chat_completions_url() -> str:
+    base_url = os.getenv("OPENAI_API_BASE_URL", "https://api.openai.com/v1")
+    return f"{base_url.rstrip('/')}/chat/completions"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The caller's deadline ran out before the API answered."""
+
+
+# Status codes that mean the endpoint itself is unhealthy (not a bad request).
+_UPSTREAM_FAILURE_STATUSES = {408, 429}
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for the chat completions endpoint.
+
+    After `failure_threshold` failures in a row the circuit opens and calls
+    fail immediately for `reset_timeout` seconds. Then one probe call is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, *, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._stats = {"opened": 0, "short_circuited": 0, "failures": 0, "successes": 0}
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self._stats["short_circuited"] += 1
+                return False
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self._stats["short_circuited"] += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self._stats["successes"] += 1
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release(self) -> None:
+        """Forget a call that was abandoned (cancelled) before it had an outcome."""
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._stats["failures"] += 1
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self._stats["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def metrics(self) -> Dict[str, Any]:
+        retry_in = 0.0
+        if self.state == "open":
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            **self._stats,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            "retry_in": round(retry_in, 3),
+        }
+
+
+class LatencyTracker:
+    """Recent successful call latencies, used to pick the hedging delay."""
+
+    def __init__(self, size: int = 200) -> None:
+        self._samples: "deque[float]" = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+breaker = CircuitBreaker(
+    failure_threshold=int(_env_float("LLM_BREAKER_FAILURES", 5)),
+    reset_timeout=_env_float("LLM_BREAKER_RESET", 30.0),
+)
+latencies = LatencyTracker()
+_stats = {"deadline_exceeded": 0, "hedged": 0, "hedge_wins": 0}
+
+
+def _hedge_delay() -> Optional[float]:
+    """Seconds to wait before sending a hedge request, or None to not hedge."""
+    if os.getenv("LLM_HEDGE", "").lower() not in {"1", "true", "yes"}:
+        return None
+    if len(latencies) < int(_env_float("LLM_HEDGE_MIN_SAMPLES", 20)):
+        return None
+    return latencies.percentile(_env_float("LLM_HEDGE_PERCENTILE", 95.0))
+
+
+def metrics() -> Dict[str, Any]:
+    p50, p95 = latencies.percentile(50), latencies.percentile(95)
+    return {
+        **_stats,
+        "breaker": breaker.metrics(),
+        "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        "hedge_delay_ms": round(_hedge_delay() * 1000, 1) if _hedge_delay() is not None else None,
+    }
+
+
+def _is_upstream_failure(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status in _UPSTREAM_FAILURE_STATUSES
+    return True
+
+
+async def _post_once(payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    started = time.monotonic()
+    resp = await get_client().post(chat_completions_url(), json=payload, headers=headers)
+    resp.raise_for_status()
+    data = resp.json()
+    latencies.record(time.monotonic() - started)
+    return data
+
+
+async def _post_hedged(payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Send the request; if it is slower than the hedge delay, race a second copy."""
+    hedge_after = _hedge_delay()
+    if hedge_after is None:
+        return await _post_once(payload, headers)
+
+    first = asyncio.ensure_future(_post_once(payload, headers))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after)
+        if done:
+            return first.result()
+        _stats["hedged"] += 1
+        hedge = asyncio.ensure_future(_post_once(payload, headers))
+        pending.add(hedge)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        assert error is not None
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _admit(payload: Dict[str, Any]) -> None:
+    """Pass the circuit breaker, then wait for this call's share of the rate limit.
+
+    The breaker is asked first, so an open circuit fails without queueing on
+    the limiter. A call cancelled while it waits (e.g. by a caller's
+    `wait_for`) gives back the half-open probe slot it may hold.
+    """
+    if not breaker.allow():
+        raise CircuitOpenError("LLM circuit breaker is open")
+    limiter = _rate_limiter.get()
+    if limiter is None:
+        return
+    try:
+        await limiter.acquire(estimate_tokens(payload))
+    except BaseException:
+        breaker.release()
+        raise
+
+
+async def post_chat_completion(
+    payload: Dict[str, Any],
+    *,
+    api_key: str,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """POST a chat completion request and return the decoded JSON response.
+
+    Raises `CircuitOpenError` right away while the breaker is open and
+    `DeadlineExceeded` if no answer arrives within `deadline` seconds, so
+    callers can fall back without waiting for the HTTP timeout.
+    """
+    await _admit(payload)
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    try:
+        if deadline is None:
+            data = await _post_hedged(payload, headers)
+        else:
+            data = await asyncio.wait_for(_post_hedged(payload, headers), deadline)
+    except asyncio.TimeoutError as exc:
+        _stats["deadline_exceeded"] += 1
+        breaker.record_failure()
+        raise DeadlineExceeded(f"No LLM response within {deadline}s") from exc
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception as exc:
+        if _is_upstream_failure(exc):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return data
+
+
+async def stream_chat_completion(
+    payload: Dict[str, Any],
+    *,
+    api_key: str,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """POST a streaming chat completion request and yield content deltas as they arrive.
+
+    `deadline` bounds the wait for the response to start; once tokens are
+    flowing the read timeout of the shared client applies.
+    """
+    await _admit(payload)
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    client = get_client()
+    request = client.build_request(
+        "POST", chat_completions_url(), json={**payload, "stream": True}, headers=headers
+    )
+    try:
+        if deadline is None:
+            resp = await client.send(request, stream=True)
+        else:
+            resp = await asyncio.wait_for(client.send(request, stream=True), deadline)
+    except asyncio.TimeoutError as exc:
+        _stats["deadline_exceeded"] += 1
+        breaker.record_failure()
+        raise DeadlineExceeded(f"No LLM response within {deadline}s") from exc
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+
+    outcome: Optional[bool] = None  # None: the consumer stopped reading early
+    try:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            for choice in json.loads(data).get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+        outcome = True
+    except Exception as exc:
+        outcome = not _is_upstream_failure(exc)
+        raise
+    finally:
+        await resp.aclose()
+        if outcome is None:
+            breaker.release()
+        elif outcome:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
@@ -0,0 +1,55 @@
+"""Schema upgrades for databases created by an older version of the app.
+
+`create_all` only creates missing tables; a column added to a table that
+already exists is added here, with the model's default, before anything
+reads it, and the indexes the model declares on those tables are created
+if missing. Each step is skipped once the column is present, so `upgrade`
+is safe to run on every startup.
+"""
+from __future__ import annotations
+
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from . import models
+
+# (table, column, column definition), in the order they were introduced
+COLUMNS = [
+    ("users", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("groups", "rule", "JSON"),
+    ("groups", "refreshed_on", "DATE"),
+    ("strategies", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("strategies", "timeline_hash", "VARCHAR(64) REFERENCES strategy_timelines (hash)"),
+    ("strategies", "apply_contacts", "BOOLEAN NOT NULL DEFAULT 0"),
+]
+
+# Number an owner's existing strategies 1, 2, ... by id, as if each had been saved as a new version.
+NUMBER_STRATEGY_VERSIONS = """
+UPDATE strategies SET version = numbered.version
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id, group_id ORDER BY id) AS version FROM strategies
+) AS numbered
+WHERE numbered.id = strategies.id
+"""
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """Add the missing columns and indexes in one transaction; returns the columns as "table.column"."""
+    added: List[str] = []
+    with engine.begin() as conn:
+        existing = {}
+        for table, column, definition in COLUMNS:
+            if table not in existing:
+                existing[table] = {c["name"] for c in inspect(conn).get_columns(table)}
+            if column in existing[table]:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+            added.append(f"{table}.{column}")
+        if "strategies.version" in added:
+            conn.execute(text(NUMBER_STRATEGY_VERSIONS))
+        for table in existing:
+            for index in models.Base.metadata.tables[table].indexes:
+                index.create(conn, checkfirst=True)
+    return added
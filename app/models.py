@@ -6,12 +6,16 @@ from typing import Optional
 from sqlalchemy import (
     Boolean,
     Column,
+    Date,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     JSON,
     String,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
 
@@ -39,6 +43,11 @@ class Group(Base):
         nullable=False,
     )
 
+    # Set for a rule-based (dynamic) group: members are the users matching
+    # the rule, materialized in `dynamic_group_members`, not `users.group_id`.
+    rule = Column(JSON, nullable=True)
+    refreshed_on = Column(Date, nullable=True)  # day of the last full refresh
+
     users = relationship("User", back_populates="group")
 
 
@@ -58,12 +67,40 @@ class User(Base):
         nullable=False,
     )
 
-    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True, index=True)
+
+    # Optimistic concurrency token: every UPDATE is issued as
+    # ``... WHERE id = :id AND version = :seen`` so concurrent writers that
+    # read the same row cannot silently overwrite each other's changes.
+    version = Column(Integer, nullable=False, default=1)
 
     group = relationship("Group", back_populates="users")
     strategies = relationship("Strategy", back_populates="user")
     documents = relationship("UserDocument", back_populates="user")
 
+    __mapper_args__ = {"version_id_col": version}
+
+
+class DynamicGroupMember(Base):
+    """A user currently matching a rule-based group's rule."""
+
+    __tablename__ = "dynamic_group_members"
+
+    group_id = Column(Integer, ForeignKey("groups.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, index=True)
+
+
+class ContactRoute(Base):
+    """The contact to use for a user on one channel, precomputed from `details.contact_methods`."""
+
+    __tablename__ = "contact_routes"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    channel = Column(String, primary_key=True)  # email | phone | sms
+    value = Column(String, nullable=False)  # preferred contact, else the first one
+    fallback = Column(String, nullable=True)  # next distinct contact for the channel
+    preferred = Column(Boolean, default=False, nullable=False)  # `value` is marked is_preferred
+
 
 class UserDocument(Base):
     __tablename__ = "user_documents"
@@ -79,15 +116,36 @@ class UserDocument(Base):
 
 
 class Strategy(Base):
+    """One version of an owner's strategy.
+
+    Rows are append-only: saving a strategy adds the owner's next `version`
+    and moves their `StrategyHead` to it, so earlier versions stay readable.
+    """
+
     __tablename__ = "strategies"
+    __table_args__ = (
+        Index("ix_strategies_user_version", "user_id", "version", unique=True),
+        Index("ix_strategies_group_version", "group_id", "version", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    version = Column(Integer, nullable=False, default=1)
 
-    # Stored as JSON; see spec for structure
-    timeline = Column(JSON, nullable=False, default=list)
+    # The timeline normally lives in `strategy_timelines`, shared by every
+    # strategy with the same content and referenced by hash. The inline
+    # column only holds private copies (rows written before sharing existed
+    # or assigned through the `timeline` setter). Read and write through the
+    # `timeline` property; crud.set_strategy_timeline stores a shared copy.
+    timeline_inline = Column("timeline", JSON, nullable=False, default=list)
+    timeline_hash = Column(
+        String(64), ForeignKey("strategy_timelines.hash"), nullable=True, index=True
+    )
+    # True if the shared timeline omits the owner's contact details, which
+    # are then applied when the strategy is read.
+    apply_contacts = Column(Boolean, default=False, nullable=False)
 
     prompt = Column(String, nullable=True)
 
@@ -98,6 +156,22 @@ class Strategy(Base):
 
     user = relationship("User", back_populates="strategies")
     group = relationship("Group")
+    shared_timeline = relationship("StrategyTimeline", lazy="selectin")
+
+    @property
+    def timeline(self) -> list:
+        if self.timeline_hash is not None and self.shared_timeline is not None:
+            return self.shared_timeline.timeline
+        return self.timeline_inline
+
+    @timeline.setter
+    def timeline(self, value: list) -> None:
+        # Writing through the attribute gives the owner a private copy; the
+        # shared row other strategies point to is never modified.
+        self.timeline_inline = value
+        self.timeline_hash = None
+        self.shared_timeline = None
+        self.apply_contacts = False
 
     def owner_type(self) -> str:
         if self.user_id is not None:
@@ -105,3 +179,270 @@ class Strategy(Base):
         if self.group_id is not None:
             return "group"
         return "unknown"
+
+
+class StrategyHead(Base):
+    """Pointer to the latest strategy version of each owner."""
+
+    __tablename__ = "strategy_heads"
+
+    owner_type = Column(String, primary_key=True)  # user | group
+    owner_id = Column(Integer, primary_key=True)
+    strategy_id = Column(Integer, ForeignKey("strategies.id"), nullable=False)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    strategy = relationship("Strategy")
+
+
+class StrategyExecution(Base):
+    """Progress of an executed strategy through its timeline columns.
+
+    Only the next due column is tracked; `(status, next_due_at)` is indexed
+    so the scheduler reads due executions without scanning the rest.
+    """
+
+    __tablename__ = "strategy_executions"
+    __table_args__ = (
+        Index("ix_strategy_executions_due", "status", "next_due_at"),
+        Index("ix_strategy_executions_owner", "owner_type", "owner_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    strategy_id = Column(Integer, ForeignKey("strategies.id"), nullable=False)
+    owner_type = Column(String, nullable=False)
+    owner_id = Column(Integer, nullable=False)
+
+    # Day 1 of the timeline; "execution" (the day it started) or "due_date".
+    anchor = Column(String, default="execution", nullable=False)
+    anchor_date = Column(Date, nullable=False)
+
+    # active -> completed | cancelled
+    status = Column(String, default="active", nullable=False)
+    next_step = Column(Integer, default=0, nullable=False)  # position in the compiled schedule
+    next_due_at = Column(DateTime, nullable=True)
+    current_timing = Column(String, nullable=True)  # last column processed
+    columns_done = Column(Integer, default=0, nullable=False)
+    columns_expired = Column(Integer, default=0, nullable=False)
+    # Outcome of the latest decision block: output, condition, action, next_timing, source.
+    last_decision = Column(JSON, nullable=True)
+
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+    strategy = relationship("Strategy")
+
+
+class OutboxMessage(Base):
+    """An outbound message from an action block, queued for its channel adapter."""
+
+    __tablename__ = "outbox_messages"
+    __table_args__ = (Index("ix_outbox_messages_claim", "channel", "status", "next_attempt_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    execution_id = Column(Integer, ForeignKey("strategy_executions.id"), nullable=True, index=True)
+    strategy_id = Column(Integer, ForeignKey("strategies.id"), nullable=True)
+    owner_type = Column(String, nullable=False)
+    owner_id = Column(Integer, nullable=False)
+
+    channel = Column(String, nullable=False)  # email | sms | call
+    recipient = Column(String, nullable=True)
+    tone = Column(String, nullable=True)
+    content = Column(String, nullable=True)
+    timing = Column(String, nullable=True)
+
+    # pending -> sending -> sent | failed; undeliverable (no channel or recipient)
+    status = Column(String, default="pending", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    claimed_at = Column(DateTime, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CommunicationSummary(Base):
+    """Running totals and recent events of an owner's communication log.
+
+    The log itself lives in monthly partition tables (see
+    `app.communication_log`); this row is updated with every batch written
+    so readers never scan them for the common questions.
+    """
+
+    __tablename__ = "communication_summaries"
+
+    owner_type = Column(String, primary_key=True)  # user | group
+    owner_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, default=0, nullable=False)  # outbound events
+    responses = Column(Integer, default=0, nullable=False)  # inbound events
+    last_attempt_at = Column(DateTime, nullable=True)
+    last_response_at = Column(DateTime, nullable=True)
+    last_channel = Column(String, nullable=True)
+    # Newest events first, at most communication_log.RECENT_EVENTS.
+    recent = Column(JSON, default=list, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class WorklistEntry(Base):
+    """A debtor on the collectors' worklist, ranked by `score`.
+
+    The index on `score` is the worklist's priority queue: re-scoring a user
+    is one indexed upsert, and the top of the list is read without sorting.
+    A claim hides the entry from other collectors until it expires.
+    """
+
+    __tablename__ = "worklist_entries"
+    __table_args__ = (Index("ix_worklist_entries_score", "score"),)
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    score = Column(Float, nullable=False)
+    remaining = Column(Float, nullable=False)
+    days_overdue = Column(Integer, nullable=True)
+    days_since_payment = Column(Integer, nullable=True)  # None if never paid
+    stage = Column(Integer, default=0, nullable=False)  # columns done in the active strategy execution
+
+    claimed_by = Column(String, nullable=True)
+    claim_expires_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StrategyTimeline(Base):
+    """An immutable timeline stored once and keyed by the hash of its content."""
+
+    __tablename__ = "strategy_timelines"
+
+    hash = Column(String(64), primary_key=True)  # sha256 of the canonical JSON
+    timeline = Column(JSON, nullable=False)
+    size = Column(Integer, nullable=False)  # bytes of the canonical JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ReconciliationBatch(Base):
+    __tablename__ = "reconciliation_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    total_lines = Column(Integer, default=0, nullable=False)
+    auto_posted = Column(Integer, default=0, nullable=False)
+    queued = Column(Integer, default=0, nullable=False)
+
+    items = relationship("ReconciliationItem", back_populates="batch")
+
+
+class ReconciliationItem(Base):
+    """A bank statement line that could not be posted automatically."""
+
+    __tablename__ = "reconciliation_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("reconciliation_batches.id"), nullable=False, index=True)
+    line_number = Column(Integer, nullable=False)
+
+    payer_name = Column(String, nullable=True)
+    amount = Column(Float, nullable=False)
+    date = Column(String, nullable=True)
+    reference = Column(String, nullable=True)
+
+    # Best candidate found by the matcher, if any
+    suggested_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    installment_number = Column(Integer, nullable=True)
+    score = Column(Float, default=0.0, nullable=False)
+    reason = Column(String, nullable=True)
+
+    # review -> resolved | rejected
+    status = Column(String, default="review", nullable=False, index=True)
+    resolved_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    resolved_at = Column(DateTime, nullable=True)
+
+    batch = relationship("ReconciliationBatch", back_populates="items")
+
+
+class StrategyBatchJob(Base):
+    """Progress record for a bulk strategy generation run."""
+
+    __tablename__ = "strategy_batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # queued -> running -> completed | failed
+    status = Column(String, default="queued", nullable=False)
+    owner_type = Column(String, default="user", nullable=False)
+    owner_ids = Column(JSON, nullable=False, default=list)
+    prompt = Column(String, nullable=True)
+
+    total = Column(Integer, default=0, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    ai_generated = Column(Integer, default=0, nullable=False)
+    cached = Column(Integer, default=0, nullable=False)
+    fallback = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class StrategySegment(Base):
+    """A debtor profile that shares one generated strategy.
+
+    `key` encodes the profile (amount band, days-overdue band, preferred
+    channel, service). `version` is bumped whenever the segment's timeline is
+    regenerated so members still on an older version can be found.
+    """
+
+    __tablename__ = "strategy_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True, nullable=False)
+    amount_band = Column(String, nullable=False)
+    overdue_band = Column(String, nullable=False)
+    preferred_contact = Column(String, nullable=False)
+    service = Column(String, nullable=False)
+    member_count = Column(Integer, default=0, nullable=False)
+
+    # Timeline without per-user contact details; applied on assignment.
+    timeline = Column(JSON, nullable=True)
+    prompt = Column(String, nullable=True)
+    source = Column(String, nullable=True)  # ai | cache | default
+    version = Column(Integer, default=0, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SegmentMembership(Base):
+    """Current segment of a user and what was last computed and assigned."""
+
+    __tablename__ = "segment_memberships"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    segment_id = Column(Integer, ForeignKey("strategy_segments.id"), nullable=False, index=True)
+    # `users.version` the features were computed from; a newer row is re-segmented.
+    user_version = Column(Integer, nullable=False)
+    # Day the days-overdue band changes by itself (None if it never does).
+    band_expires_on = Column(Date, nullable=True, index=True)
+    # Segment version whose timeline the user's strategy was built from.
+    assigned_version = Column(Integer, nullable=True)
+
+
+class StrategyTemplate(Base):
+    """One immutable version of a named strategy template."""
+
+    __tablename__ = "strategy_templates"
+    __table_args__ = (UniqueConstraint("name", "version"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True, nullable=False)
+    version = Column(Integer, nullable=False)
+    description = Column(String, nullable=True)
+
+    # Timeline as submitted, with placeholders such as "{amount}".
+    timeline = Column(JSON, nullable=False)
+    # Validated, contact-enriched JSON text that `strategy_templates.render` fills in.
+    compiled = Column(String, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,252 @@
+"""Columnar snapshots of the user portfolio for vectorized analytics.
+
+Pulling a handful of scalar fields out of `users.details` with SQLite's
+`json_extract` and holding them as NumPy arrays lets reports run as a single
+vectorized pass instead of decoding every JSON blob and parsing every
+`due_date` string in Python.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import dynamic_groups, models
+
+
+DEFAULT_AGING_EDGES = (30, 60, 90)
+
+# Reports may be served from a snapshot up to this many seconds old.
+SNAPSHOT_TTL_SECONDS = float(os.getenv("PORTFOLIO_SNAPSHOT_TTL", "60"))
+
+_snapshot_lock = threading.Lock()
+_cached_snapshot: Optional["PortfolioSnapshot"] = None
+_cached_at = 0.0
+
+
+@dataclass
+class PortfolioSnapshot:
+    ids: np.ndarray  # int64
+    status: np.ndarray  # object (str)
+    # Group memberships, static and rule-based, as parallel arrays: the
+    # member's position in the arrays here and the group id. A user in
+    # several groups appears once per group.
+    member_rows: np.ndarray  # int64
+    member_groups: np.ndarray  # int64
+    due: np.ndarray  # datetime64[D], NaT when missing/unparseable
+    amount_owed: np.ndarray  # float64
+    total_paid: np.ndarray  # float64
+    remaining: np.ndarray  # float64
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _json_field(path: str):
+    return func.json_extract(models.User.details, path)
+
+
+def load_snapshot(db: Session, *, chunk_size: int = 100000) -> PortfolioSnapshot:
+    """Load the columns needed for portfolio analytics in chunks."""
+    stmt = select(
+        models.User.id,
+        models.User.status,
+        models.User.group_id,
+        _json_field("$.due_date"),
+        _json_field("$.amount_owed"),
+        _json_field("$.total_paid"),
+        _json_field("$.remaining_amount"),
+    ).execution_options(yield_per=chunk_size)
+
+    frames: List[pd.DataFrame] = []
+    columns = ["id", "status", "group_id", "due_date", "amount_owed", "total_paid", "remaining_amount"]
+    for rows in db.execute(stmt).partitions(chunk_size):
+        frames.append(pd.DataFrame.from_records(rows, columns=columns))
+
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=columns)
+    m = dynamic_groups.memberships()
+    memberships = pd.DataFrame.from_records(
+        db.execute(select(m.c.group_id, m.c.user_id)).all(), columns=["group_id", "user_id"]
+    )
+    return snapshot_from_frame(df, memberships=memberships)
+
+
+def get_snapshot(db: Session, *, max_age: Optional[float] = None) -> PortfolioSnapshot:
+    """Return a cached snapshot if it is fresh enough, otherwise reload it."""
+    global _cached_snapshot, _cached_at
+    max_age = SNAPSHOT_TTL_SECONDS if max_age is None else max_age
+    with _snapshot_lock:
+        if _cached_snapshot is not None and time.monotonic() - _cached_at <= max_age:
+            return _cached_snapshot
+    snapshot = load_snapshot(db)
+    with _snapshot_lock:
+        _cached_snapshot, _cached_at = snapshot, time.monotonic()
+    return snapshot
+
+
+def invalidate_snapshot() -> None:
+    global _cached_snapshot
+    with _snapshot_lock:
+        _cached_snapshot = None
+
+
+def _member_rows(ids: np.ndarray, memberships: pd.DataFrame) -> tuple:
+    """Positions in `ids` and group ids of the memberships whose user is in `ids`."""
+    groups = memberships["group_id"].to_numpy(dtype="int64")
+    users = memberships["user_id"].to_numpy(dtype="int64")
+    if not len(ids):
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+    order = np.argsort(ids, kind="stable")
+    rows = order[np.minimum(np.searchsorted(ids, users, sorter=order), len(ids) - 1)]
+    found = ids[rows] == users
+    return rows[found], groups[found]
+
+
+def snapshot_from_frame(df: pd.DataFrame, *, memberships: Optional[pd.DataFrame] = None) -> PortfolioSnapshot:
+    """Build a snapshot from a frame with the `load_snapshot` columns.
+
+    `memberships` has `group_id` and `user_id` columns; without it only the
+    frame's own `group_id` is used.
+    """
+
+    def numeric(name: str) -> np.ndarray:
+        return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype="float64")
+
+    amount_owed = numeric("amount_owed")
+    total_paid = np.nan_to_num(numeric("total_paid"), nan=0.0)
+    remaining = numeric("remaining_amount")
+    derived = np.maximum(0.0, np.nan_to_num(amount_owed, nan=0.0) - total_paid)
+    remaining = np.where(np.isnan(remaining), derived, remaining)
+
+    due_text = df["due_date"].astype("string").str.slice(0, 10)
+    due = pd.to_datetime(due_text, format="%Y-%m-%d", errors="coerce").to_numpy().astype("datetime64[D]")
+
+    ids = df["id"].to_numpy(dtype="int64")
+    if memberships is None:
+        memberships = pd.DataFrame(
+            {"group_id": pd.to_numeric(df["group_id"], errors="coerce"), "user_id": ids}
+        ).dropna()
+    member_rows, member_groups = _member_rows(ids, memberships)
+
+    return PortfolioSnapshot(
+        ids=ids,
+        status=df["status"].to_numpy(dtype=object),
+        member_rows=member_rows,
+        member_groups=member_groups,
+        due=due,
+        amount_owed=amount_owed,
+        total_paid=total_paid,
+        remaining=remaining,
+    )
+
+
+def days_overdue(snapshot: PortfolioSnapshot, today: Optional[date] = None) -> np.ndarray:
+    """Days past due per user (negative if not yet due, NaN without a due date)."""
+    today64 = np.datetime64(today or date.today(), "D")
+    days = (today64 - snapshot.due).astype("float64")
+    days[np.isnat(snapshot.due)] = np.nan
+    return days
+
+
+def bucket_labels(edges: Sequence[int]) -> List[str]:
+    labels: List[str] = []
+    lower = 0
+    for edge in edges:
+        labels.append(f"{lower}-{edge}")
+        lower = edge + 1
+    labels.append(f"{edges[-1] + 1}+")
+    return labels
+
+
+def _bucket_totals(counts: np.ndarray, balances: np.ndarray) -> Dict[str, Any]:
+    return {"counts": counts.astype(int).tolist(), "balances": np.round(balances, 2).tolist()}
+
+
+def compute_aging_report(
+    snapshot: PortfolioSnapshot,
+    *,
+    edges: Sequence[int] = DEFAULT_AGING_EDGES,
+    today: Optional[date] = None,
+) -> Dict[str, Any]:
+    """Counts and open balances per aging bucket, overall, by status and by group.
+
+    A user counts toward every group they belong to, statically or through
+    a rule, as in the group analytics; `group_id` None holds users in no
+    group. Only users with an open balance are aged. Balances not yet due fall in the
+    first bucket; open balances without a usable due date are reported
+    separately as `undated`.
+    """
+    edges = list(edges)
+    if not edges or any(e <= 0 for e in edges) or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise ValueError("Bucket edges must be positive and strictly increasing")
+
+    today = today or date.today()
+    n_buckets = len(edges) + 1
+
+    open_mask = snapshot.remaining > 0
+    days = days_overdue(snapshot, today)
+    dated = open_mask & ~np.isnan(days)
+    undated = open_mask & np.isnan(days)
+
+    d_days = np.clip(days[dated], 0, None)
+    d_balance = snapshot.remaining[dated]
+    bucket = np.searchsorted(np.asarray(edges, dtype="float64"), d_days, side="left")
+
+    total_counts = np.bincount(bucket, minlength=n_buckets)
+    total_balances = np.bincount(bucket, weights=d_balance, minlength=n_buckets)
+
+    def grouped(keys: np.ndarray, rows: Optional[np.ndarray] = None) -> tuple:
+        # `rows` picks the aged users behind each key; by default one key per aged user.
+        row_bucket, row_balance = (bucket, d_balance) if rows is None else (bucket[rows], d_balance[rows])
+        labels, inverse = np.unique(keys, return_inverse=True)
+        flat = inverse * n_buckets + row_bucket
+        size = len(labels) * n_buckets
+        counts = np.bincount(flat, minlength=size).reshape(len(labels), n_buckets)
+        balances = np.bincount(flat, weights=row_balance, minlength=size).reshape(len(labels), n_buckets)
+        return labels, counts, balances
+
+    status_labels, status_counts, status_balances = grouped(snapshot.status[dated].astype(str))
+
+    # Position of each aged user in `bucket`, -1 for users not aged.
+    aged_row = np.full(len(snapshot), -1, dtype="int64")
+    aged_row[dated] = np.arange(int(dated.sum()))
+    member_aged = aged_row[snapshot.member_rows]
+    ungrouped = dated.copy()
+    ungrouped[snapshot.member_rows] = False
+    group_labels, group_counts, group_balances = grouped(
+        np.concatenate([snapshot.member_groups[member_aged >= 0], np.full(int(ungrouped.sum()), -1)]),
+        np.concatenate([member_aged[member_aged >= 0], aged_row[ungrouped]]),
+    )
+
+    return {
+        "as_of": today,
+        "buckets": bucket_labels(edges),
+        "total": _bucket_totals(total_counts, total_balances),
+        "by_status": {
+            str(label): _bucket_totals(status_counts[i], status_balances[i])
+            for i, label in enumerate(status_labels)
+        },
+        "by_group": [
+            {
+                "group_id": int(label) if label >= 0 else None,
+                **_bucket_totals(group_counts[i], group_balances[i]),
+            }
+            for i, label in enumerate(group_labels)
+        ],
+        "undated": {
+            "count": int(undated.sum()),
+            "balance": round(float(snapshot.remaining[undated].sum()), 2),
+        },
+    }
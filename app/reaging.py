@@ -0,0 +1,221 @@
+"""Nightly re-aging of the whole portfolio.
+
+`details["days_overdue"]` and `details["status"]` ("pending", "overdue" or
+"paid"), and the user's status, are otherwise only recomputed when someone
+touches the user. `run` brings every user up to date in one pass. It pages
+through `users` by id, `CHUNK_SIZE` rows at a time, so memory stays bounded
+whatever the portfolio size. Each chunk is loaded as columns and evaluated
+with NumPy. Only the rows that changed are written back, with one
+executemany per chunk.
+
+Status transitions:
+
+- pending -> ongoing once the due date has passed with money still owed;
+- pending or ongoing -> finished once nothing is left to pay;
+- finished -> archived once it has been settled for `ARCHIVE_AFTER_DAYS`.
+  The settlement date is the latest payment, or the due date if there is no
+  payment.
+
+Each chunk is re-scored on the `worklist` from the same columns. Rule-based
+groups are re-evaluated for the users that changed, and groups that depend
+on the date are refreshed at the end. With `REAGING_INTERVAL` set (seconds),
+`main.py` runs `run_forever` in the background.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from . import dynamic_groups, models, portfolio, worklist
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+CHUNK_SIZE = 100000
+
+PENDING, ONGOING = models.StatusEnum.PENDING, models.StatusEnum.ONGOING
+FINISHED, ARCHIVED = models.StatusEnum.FINISHED, models.StatusEnum.ARCHIVED
+
+COLUMNS = worklist.COLUMNS + ["version", "stored_days_overdue", "stored_flag", "last_received"]
+
+
+def _loader(last_id: int, chunk_size: int):
+    user = models.User
+    received = func.json_each(user.details, "$.payment_received").table_valued("value")
+    last_received = select(
+        func.max(func.substr(func.json_extract(received.c.value, "$.date"), 1, 10))
+    ).scalar_subquery()
+    return (
+        worklist.loader(user.id > last_id)
+        .add_columns(
+            user.version,
+            func.json_extract(user.details, "$.days_overdue"),
+            func.json_extract(user.details, "$.status"),
+            last_received,
+        )
+        .order_by(user.id)
+        .limit(chunk_size)
+    )
+
+
+def _dates(values: pd.Series) -> np.ndarray:
+    return pd.to_datetime(values, format="%Y-%m-%d", errors="coerce").to_numpy().astype("datetime64[D]")
+
+
+def _latest(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Element-wise later date, ignoring NaT."""
+    return np.where(np.isnat(a), b, np.where(np.isnat(b), a, np.maximum(a, b)))
+
+
+def age(df: pd.DataFrame, today: date, *, archive_after_days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, np.ndarray]:
+    """New status, overdue days and flag for each row of a frame of `COLUMNS`."""
+    snapshot = portfolio.snapshot_from_frame(df)
+    today64 = np.datetime64(today, "D")
+    days = portfolio.days_overdue(snapshot, today)
+
+    # Without amount_owed or remaining_amount there is no balance to settle.
+    known = (df["amount_owed"].notna() | df["remaining_amount"].notna()).to_numpy()
+    settled = known & (snapshot.remaining <= 0)
+    settled_on = _latest(_dates(df["last_payment"]), _dates(df["last_received"]))
+    settled_on = np.where(np.isnat(settled_on), snapshot.due, settled_on)
+    settled_days = (today64 - settled_on).astype("float64")
+    settled_days[np.isnat(settled_on)] = np.nan
+
+    status = snapshot.status
+    new_status = status.copy()
+    new_status[np.isin(status, [PENDING, ONGOING]) & settled] = FINISHED
+    new_status[(status == PENDING) & ~settled & (days > 0)] = ONGOING
+    new_status[(new_status == FINISHED) & settled & (settled_days >= archive_after_days)] = ARCHIVED
+
+    overdue_days = np.where(np.isnan(days), np.nan, np.maximum(days, 0.0))
+    flag = np.where(settled, "paid", np.where(days > 0, "overdue", "pending")).astype(object)
+    stored_days = pd.to_numeric(df["stored_days_overdue"], errors="coerce").to_numpy(dtype="float64")
+    changed = (
+        (new_status != status)
+        | (df["stored_flag"].to_numpy(dtype=object) != flag)
+        | (~np.isnan(overdue_days) & (stored_days != overdue_days))
+    )
+    return {"status": new_status, "days_overdue": overdue_days, "flag": flag, "changed": changed}
+
+
+def _update_statement(rows: str):
+    """One UPDATE for a chunk; `rows` is a JSON array of {user_id, seen, days, flag, new_status}.
+
+    Returns the ids of the users actually updated.
+    """
+    users = models.User.__table__
+    row = func.json_each(rows).table_valued("value")
+
+    def field(key: str):
+        return func.json_extract(row.c.value, f"$.{key}")
+
+    days, flag = field("days"), field("flag")
+    details = case(
+        (days.is_(None), func.json_set(users.c.details, "$.status", flag)),
+        else_=func.json_set(users.c.details, "$.days_overdue", days, "$.status", flag),
+    )
+    # Same optimistic version check as ORM writes; a user changed meanwhile is re-aged next run.
+    return (
+        update(users)
+        .where(users.c.id == field("user_id"), users.c.version == field("seen"))
+        .values(details=details, status=field("new_status"), version=users.c.version + 1)
+        .returning(users.c.id)
+    )
+
+
+def run(
+    db: Session,
+    *,
+    today: Optional[date] = None,
+    chunk_size: int = CHUNK_SIZE,
+    archive_after_days: int = ARCHIVE_AFTER_DAYS,
+) -> Dict[str, int]:
+    """Re-age every user, committing once per chunk; returns counts of what changed."""
+    today, now = today or date.today(), datetime.utcnow()
+    stats = {"users": 0, "updated": 0, "ongoing": 0, "finished": 0, "archived": 0, "worklist_removed": 0}
+    last_id = 0
+    while True:
+        rows = db.execute(_loader(last_id, chunk_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+        aged = age(df, today, archive_after_days=archive_after_days)
+        stats["users"] += len(df)
+
+        idx, skipped = np.flatnonzero(aged["changed"]), []
+        if len(idx):
+            ids = df["id"].to_numpy(dtype="int64")[idx]
+            payload = json.dumps([
+                {
+                    "user_id": uid,
+                    "seen": int(seen),
+                    "days": None if np.isnan(days) else int(days),
+                    "flag": flag,
+                    "new_status": new_status,
+                }
+                for uid, seen, days, flag, new_status in zip(
+                    ids.tolist(),
+                    df["version"].to_numpy()[idx].tolist(),
+                    aged["days_overdue"][idx].tolist(),
+                    aged["flag"][idx].tolist(),
+                    aged["status"][idx].tolist(),
+                )
+            ])
+            updated = np.isin(ids, np.fromiter(db.execute(_update_statement(payload)).scalars(), dtype="int64"))
+            # Rows the version check skipped were changed meanwhile: leave them out of the stats,
+            # groups and worklist, since their writer's commit refreshed those.
+            skipped, idx = idx[~updated], idx[updated]
+            stats["updated"] += len(idx)
+            updated_ids = ids[updated].tolist()
+            for start in range(0, len(updated_ids), dynamic_groups.CHUNK_SIZE):
+                chunk = updated_ids[start:start + dynamic_groups.CHUNK_SIZE]
+                dynamic_groups.refresh_users(db, models.User.id.in_(chunk), today=today)
+            moved = aged["status"][idx][aged["status"][idx] != df["status"].to_numpy(dtype=object)[idx]]
+            for status in (ONGOING, FINISHED, ARCHIVED):
+                stats[status] += int((moved == status).sum())
+        df["status"] = aged["status"]
+        df = df.drop(index=df.index[skipped])
+        stats["worklist_removed"] += worklist.refresh_frame(db, df, today=today, now=now)
+        db.commit()
+
+    stats["groups"] = dynamic_groups.refresh(db, today=today)["groups"]
+    portfolio.invalidate_snapshot()
+    return stats
+
+
+def _run_once() -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        return run(db)
+    finally:
+        db.close()
+
+
+async def run_forever(interval: float) -> None:
+    """Re-age the portfolio every `interval` seconds."""
+    while True:
+        try:
+            stats = await asyncio.to_thread(_run_once)
+            logger.info("Portfolio re-aging: %s", stats)
+        except Exception:
+            logger.exception("Portfolio re-aging failed")
+        await asyncio.sleep(interval)
+
+
+def interval_from_env() -> float:
+    try:
+        return float(os.getenv("REAGING_INTERVAL", "0"))
+    except ValueError:
+        return 0.0
@@ -0,0 +1,457 @@
+"""Bank statement reconciliation: match remittance lines to debtors.
+
+A statement is matched against an in-memory index of open debtors built in a
+single pass over the users table. Lookups are hash based (normalized name,
+amount in cents) with a fuzzy name fallback restricted to small candidate
+blocks, so the cost per statement line stays roughly constant as the
+portfolio grows.
+"""
+
+from __future__ import annotations
+
+import random
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from difflib import SequenceMatcher
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from . import crud, models, schemas
+
+
+AUTO_POST_THRESHOLD = 0.85
+DATE_WINDOW_DAYS = 60
+FUZZY_MIN_RATIO = 0.82
+MAX_FUZZY_CANDIDATES = 200
+
+NAME_WEIGHT = 0.6
+AMOUNT_WEIGHT = 0.3
+DATE_WEIGHT = 0.1
+
+_NON_ALNUM = re.compile(r"[^a-z0-9 ]+")
+
+_COLUMN_ALIASES = {
+    "name": ["name", "payer", "payer_name", "payername", "remitter", "beneficiary", "description"],
+    "amount": ["amount", "credit", "paid", "value"],
+    "date": ["date", "value_date", "valuedate", "transaction_date", "transactiondate", "posted_date"],
+    "reference": ["reference", "ref", "narration", "memo"],
+}
+
+
+class UserNotFoundError(ValueError):
+    """The user a review item is being resolved against does not exist."""
+
+
+def normalize_name(value: Any) -> str:
+    """Lowercase, strip punctuation and sort tokens so 'SMITH, John' == 'john smith'."""
+    text = _NON_ALNUM.sub(" ", str(value or "").lower())
+    return " ".join(sorted(text.split()))
+
+
+def _to_cents(amount: float) -> int:
+    return int(round(float(amount) * 100))
+
+
+@dataclass
+class StatementLine:
+    line_number: int
+    payer_name: str
+    amount: float
+    date: Optional[str] = None
+    reference: Optional[str] = None
+
+
+@dataclass
+class Debtor:
+    user_id: int
+    name_key: str
+    remaining: float
+    due_date: Optional[date]
+    next_installment: int
+    expected_amounts: Set[int] = field(default_factory=set)
+    tokens: frozenset = frozenset()
+
+
+@dataclass
+class Match:
+    line: StatementLine
+    debtor: Optional[Debtor] = None
+    score: float = 0.0
+    reason: str = "no candidate"
+    ambiguous: bool = False
+
+
+def _open_balance(details: Dict[str, Any]) -> float:
+    remaining = details.get("remaining_amount")
+    if isinstance(remaining, (int, float)):
+        return float(remaining)
+    amount_owed = details.get("amount_owed")
+    if not isinstance(amount_owed, (int, float)):
+        return 0.0
+    total_paid = details.get("total_paid", 0)
+    if not isinstance(total_paid, (int, float)):
+        total_paid = 0
+    return max(0.0, float(amount_owed) - float(total_paid))
+
+
+class DebtorIndex:
+    """Hash indexes over open debtors, keyed by normalized name, amount and name token."""
+
+    def __init__(self) -> None:
+        self.by_name: Dict[str, List[Debtor]] = defaultdict(list)
+        self.by_amount: Dict[int, List[Debtor]] = defaultdict(list)
+        self.by_token: Dict[str, List[Debtor]] = defaultdict(list)
+
+    @classmethod
+    def from_db(cls, db: Session, *, chunk_size: int = 10000) -> "DebtorIndex":
+        index = cls()
+        rows = (
+            db.query(models.User.id, models.User.name, models.User.details)
+            .filter(models.User.status != models.StatusEnum.ARCHIVED)
+            .execution_options(yield_per=chunk_size)
+        )
+        for user_id, name, details in rows:
+            index.add(user_id, name, details or {})
+        return index
+
+    def add(self, user_id: int, name: str, details: Dict[str, Any]) -> Optional[Debtor]:
+        remaining = _open_balance(details)
+        if remaining <= 0:
+            return None
+
+        history = details.get("payment_history") or []
+        installments = [
+            p.get("installment_number")
+            for p in history
+            if isinstance(p, dict) and isinstance(p.get("installment_number"), int)
+        ]
+
+        expected = {_to_cents(remaining)}
+        amount_owed = details.get("amount_owed")
+        if isinstance(amount_owed, (int, float)) and not history:
+            expected.add(_to_cents(amount_owed))
+        for p in history:
+            if isinstance(p, dict) and isinstance(p.get("amount"), (int, float)):
+                expected.add(_to_cents(p["amount"]))
+
+        name_key = normalize_name(name)
+        debtor = Debtor(
+            user_id=user_id,
+            name_key=name_key,
+            remaining=remaining,
+            due_date=crud._parse_due_date(details.get("due_date")),
+            next_installment=(max(installments) if installments else len(history)) + 1,
+            expected_amounts=expected,
+            tokens=frozenset(name_key.split()),
+        )
+        self.by_name[debtor.name_key].append(debtor)
+        for cents in expected:
+            self.by_amount[cents].append(debtor)
+        for token in debtor.tokens:
+            self.by_token[token].append(debtor)
+        return debtor
+
+    def record_payment(self, debtor: Debtor, amount: float) -> None:
+        """Reflect an auto-posted line so later lines see the reduced balance."""
+        debtor.remaining = max(0.0, debtor.remaining - amount)
+        debtor.next_installment += 1
+        debtor.expected_amounts.add(_to_cents(amount))
+        if debtor.remaining > 0:
+            debtor.expected_amounts.add(_to_cents(debtor.remaining))
+
+    def _fuzzy_candidates(self, tokens: frozenset, cents: int, min_shared: int) -> List[Debtor]:
+        # Debtors expecting this exact amount form the tightest block; fall
+        # back to the rarest shared name tokens otherwise. A candidate sharing
+        # `min_shared` of the known tokens must appear in at least one of the
+        # `len(known) - min_shared + 1` rarest token lists, so only those are read.
+        same_amount = self.by_amount.get(cents, ())
+        pool: Dict[int, Debtor] = {}
+        if len(same_amount) <= MAX_FUZZY_CANDIDATES:
+            pool = {d.user_id: d for d in same_amount}
+        known = sorted(
+            (t for t in tokens if t in self.by_token),
+            key=lambda t: len(self.by_token[t]),
+        )
+        for token in known[:max(1, len(known) - min_shared + 1)]:
+            if len(pool) >= MAX_FUZZY_CANDIDATES:
+                break
+            for d in self.by_token[token][:MAX_FUZZY_CANDIDATES]:
+                pool.setdefault(d.user_id, d)
+        return list(pool.values())
+
+    def _score(self, line: StatementLine, debtor: Debtor, name_score: float, window: int) -> tuple:
+        reasons = ["exact name" if name_score >= 1.0 else f"fuzzy name {name_score:.2f}"]
+
+        if _to_cents(line.amount) in debtor.expected_amounts:
+            amount_score = 1.0
+            reasons.append("expected amount")
+        elif line.amount <= debtor.remaining + 0.01:
+            amount_score = 0.5
+            reasons.append("partial amount")
+        else:
+            amount_score = 0.0
+            reasons.append("amount exceeds balance")
+
+        line_date = crud._parse_due_date(line.date)
+        if debtor.due_date is None or line_date is None:
+            date_score = 0.5
+        elif abs((line_date - debtor.due_date).days) <= window:
+            date_score = 1.0
+            reasons.append("within date window")
+        else:
+            date_score = 0.0
+            reasons.append("outside date window")
+
+        score = NAME_WEIGHT * name_score + AMOUNT_WEIGHT * amount_score + DATE_WEIGHT * date_score
+        return score, ", ".join(reasons)
+
+    def match(self, line: StatementLine, *, date_window_days: int = DATE_WINDOW_DAYS) -> Match:
+        name_key = normalize_name(line.payer_name)
+        scored: List[tuple] = []
+
+        exact = [d for d in self.by_name.get(name_key, ()) if d.remaining > 0]
+        if exact:
+            for d in exact:
+                scored.append((*self._score(line, d, 1.0, date_window_days), d))
+        elif name_key:
+            # SequenceMatcher caches analysis of seq2, so reuse one matcher per
+            # line and reject most candidates with the cheap upper bounds.
+            matcher = SequenceMatcher(None, autojunk=False)
+            matcher.set_seq2(name_key)
+            tokens = frozenset(name_key.split())
+            min_shared = len(tokens) - 1
+            for d in self._fuzzy_candidates(tokens, _to_cents(line.amount), min_shared):
+                # A typo rarely touches more than one name token.
+                if d.remaining <= 0 or len(tokens & d.tokens) < min_shared:
+                    continue
+                matcher.set_seq1(d.name_key)
+                if matcher.real_quick_ratio() < FUZZY_MIN_RATIO or matcher.quick_ratio() < FUZZY_MIN_RATIO:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= FUZZY_MIN_RATIO:
+                    scored.append((*self._score(line, d, ratio, date_window_days), d))
+
+        if not scored:
+            return Match(line=line)
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        score, reason, debtor = scored[0]
+        ambiguous = len(scored) > 1 and scored[1][0] >= score - 0.05
+        if ambiguous:
+            reason = f"{reason}; ambiguous between {len(scored)} debtors"
+        return Match(line=line, debtor=debtor, score=score, reason=reason, ambiguous=ambiguous)
+
+
+def parse_statement_csv(file_bytes: bytes) -> List[StatementLine]:
+    """Parse a bank statement export into credit lines.
+
+    Column names are matched case-insensitively against common aliases
+    (e.g. Payer/Description, Amount/Credit, Date/Value Date, Reference/Narration).
+    Debit or zero lines are skipped.
+    """
+    try:
+        df = pd.read_csv(BytesIO(file_bytes), dtype=str, keep_default_na=False)
+    except Exception as exc:
+        raise ValueError(f"Failed to read statement CSV: {exc}")
+
+    columns = {c.strip().lower().replace(" ", "_"): c for c in df.columns}
+    resolved: Dict[str, Optional[str]] = {}
+    for key, aliases in _COLUMN_ALIASES.items():
+        resolved[key] = next((columns[a] for a in aliases if a in columns), None)
+    if not resolved["name"] or not resolved["amount"]:
+        raise ValueError("Statement CSV must contain payer name and amount columns")
+
+    amounts = pd.to_numeric(
+        df[resolved["amount"]].str.replace(",", "", regex=False).str.strip(),
+        errors="coerce",
+    )
+    if resolved["date"]:
+        dates = pd.to_datetime(df[resolved["date"]], errors="coerce").dt.strftime("%Y-%m-%d")
+    else:
+        dates = pd.Series([None] * len(df))
+    names = df[resolved["name"]].astype(str)
+    refs = df[resolved["reference"]].astype(str) if resolved["reference"] else pd.Series([""] * len(df))
+
+    lines: List[StatementLine] = []
+    for i, (name, amount, when, ref) in enumerate(zip(names, amounts, dates, refs), start=1):
+        if pd.isna(amount) or amount <= 0:
+            continue
+        lines.append(
+            StatementLine(
+                line_number=i,
+                payer_name=name.strip(),
+                amount=float(amount),
+                date=when if isinstance(when, str) else None,
+                reference=ref.strip() or None,
+            )
+        )
+    return lines
+
+
+def _notes(batch_id: int, line_number: int, reference: Optional[str], suffix: str = "") -> str:
+    notes = f"Reconciled from statement batch {batch_id}, line {line_number}{suffix}"
+    if reference:
+        notes += f" (ref {reference})"
+    return notes
+
+
+def _review_row(batch_id: int, match: Match, installment: Optional[int], reason: str) -> Dict[str, Any]:
+    line = match.line
+    return {
+        "batch_id": batch_id,
+        "line_number": line.line_number,
+        "payer_name": line.payer_name,
+        "amount": line.amount,
+        "date": line.date,
+        "reference": line.reference,
+        "suggested_user_id": match.debtor.user_id if match.debtor else None,
+        "installment_number": installment,
+        "score": round(match.score, 4),
+        "reason": reason,
+        "status": "review",
+    }
+
+
+def reconcile_statement(
+    db: Session,
+    lines: List[StatementLine],
+    *,
+    filename: Optional[str] = None,
+    auto_post_threshold: float = AUTO_POST_THRESHOLD,
+    date_window_days: int = DATE_WINDOW_DAYS,
+    chunk_size: int = 5000,
+    max_retries: int = crud.PAYMENT_MAX_RETRIES,
+) -> models.ReconciliationBatch:
+    """Match statement lines to debtors, auto-post confident ones, queue the rest.
+
+    The batch, its review items and the posted payments are written in one
+    transaction, so the batch counts always describe what was posted. A
+    matched user that no longer exists sends the line to review instead. If
+    a debtor changes concurrently, the transaction is rolled back and the
+    postings re-applied to the fresh rows.
+    """
+    index = DebtorIndex.from_db(db)
+
+    postings: List[Tuple[Match, int]] = []  # confident match, installment number
+    reviews: List[Match] = []
+    for line in lines:
+        match = index.match(line, date_window_days=date_window_days)
+        if match.debtor and not match.ambiguous and match.score >= auto_post_threshold:
+            postings.append((match, match.debtor.next_installment))
+            index.record_payment(match.debtor, line.amount)
+        else:
+            reviews.append(match)
+
+    today = date.today().isoformat()
+    for attempt in range(max_retries):
+        try:
+            batch = models.ReconciliationBatch(filename=filename, total_lines=len(lines))
+            db.add(batch)
+            db.flush()
+
+            to_post: Dict[int, List[schemas.PaymentCreate]] = defaultdict(list)
+            for match, installment in postings:
+                line = match.line
+                to_post[match.debtor.user_id].append(
+                    schemas.PaymentCreate(
+                        amount=line.amount,
+                        date=line.date or today,
+                        installment_number=installment,
+                        notes=_notes(batch.id, line.line_number, line.reference),
+                    )
+                )
+            missing = set(crud.stage_payments_batch(db, to_post))
+
+            queued = [
+                _review_row(batch.id, m, m.debtor.next_installment if m.debtor else None, m.reason) for m in reviews
+            ]
+            for match, installment in postings:
+                if match.debtor.user_id in missing:
+                    reason = f"{match.reason}; matched user {match.debtor.user_id} no longer exists"
+                    queued.append(_review_row(batch.id, match, installment, reason))
+            queued.sort(key=lambda row: row["line_number"])
+            for start in range(0, len(queued), chunk_size):
+                db.bulk_insert_mappings(models.ReconciliationItem, queued[start:start + chunk_size])
+
+            batch.auto_posted = sum(len(p) for user_id, p in to_post.items() if user_id not in missing)
+            batch.queued = len(queued)
+            db.commit()
+        except (StaleDataError, OperationalError):
+            # A debtor changed meanwhile (or the SQLite write lock was held); start over on fresh rows.
+            db.rollback()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+            continue
+        db.refresh(batch)
+        return batch
+
+    raise crud.ConcurrentUpdateError(f"Could not post statement payments after {max_retries} attempts")
+
+
+def _claim_item(db: Session, item: models.ReconciliationItem, status: str, **values: Any) -> None:
+    """Move `item` out of review with one conditional UPDATE; the caller commits.
+
+    Only one of several concurrent resolvers or rejecters sees the row still
+    in review, so a line is never posted twice.
+    """
+    claimed = db.execute(
+        update(models.ReconciliationItem)
+        .where(models.ReconciliationItem.id == item.id, models.ReconciliationItem.status == "review")
+        .values(status=status, resolved_at=datetime.utcnow(), **values)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        db.refresh(item)
+        raise ValueError(f"Reconciliation item {item.id} is already {item.status}")
+
+
+def resolve_item(
+    db: Session,
+    item: models.ReconciliationItem,
+    *,
+    user_id: int,
+    installment_number: Optional[int] = None,
+    max_retries: int = crud.PAYMENT_MAX_RETRIES,
+) -> models.User:
+    """Post a reviewed statement line to the chosen user through the payments path.
+
+    The item is claimed and the payment posted in the same transaction.
+    """
+    payment = schemas.PaymentCreate(
+        amount=item.amount,
+        date=item.date or date.today().isoformat(),
+        installment_number=installment_number or item.installment_number,
+        notes=_notes(item.batch_id, item.line_number, item.reference, " (manual review)"),
+    )
+    for attempt in range(max_retries):
+        try:
+            _claim_item(db, item, "resolved", resolved_user_id=user_id)
+            user = crud.get_user(db, user_id)
+            if not user:
+                db.rollback()
+                raise UserNotFoundError(f"User {user_id} not found")
+            crud.apply_payment(user, payment)
+            db.commit()
+        except (StaleDataError, OperationalError):
+            db.rollback()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+            continue
+        db.refresh(user)
+        return user
+
+    raise crud.ConcurrentUpdateError(f"Could not apply payment to user {user_id} after {max_retries} attempts")
+
+
+def reject_item(db: Session, item: models.ReconciliationItem) -> models.ReconciliationItem:
+    _claim_item(db, item, "rejected")
+    db.commit()
+    db.refresh(item)
+    return item
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from . import communication_log, schemas
+from .database import get_db
+
+router = APIRouter(prefix="/communications", tags=["communications"])
+
+
+@router.post("/", response_model=schemas.CommunicationRecordResponse)
+async def record_events(body: List[schemas.CommunicationEventCreate], db: Session = Depends(get_db)):
+    """Append contact attempts or responses (e.g. replies from a provider webhook) in one batch."""
+    recorded = communication_log.record(db, [event.dict() for event in body])
+    db.commit()
+    return schemas.CommunicationRecordResponse(recorded=recorded)
+
+
+@router.post("/retention", response_model=schemas.CommunicationRetentionResponse)
+async def apply_retention(
+    keep_months: int = Query(communication_log.RETENTION_MONTHS, ge=1),
+    db: Session = Depends(get_db),
+):
+    """Drop monthly partitions older than `keep_months`."""
+    dropped = communication_log.drop_expired(db, keep_months=keep_months)
+    return schemas.CommunicationRetentionResponse(dropped=dropped, partitions=communication_log.event_counts(db))
+
+
+@router.get("/{owner_id}", response_model=schemas.CommunicationHistory)
+async def get_history(
+    owner_id: int,
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    limit: int = Query(50, ge=1, le=1000),
+    since: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """An owner's communication summary and newest events."""
+    summary = communication_log.get_summary(db, owner_type, owner_id)
+    events = communication_log.history(db, owner_type, owner_id, limit=limit, since=since)
+    if summary is None and not events:
+        raise HTTPException(status_code=404, detail="No communications for this owner")
+    return schemas.CommunicationHistory(summary=summary, events=events)
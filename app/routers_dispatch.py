@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from . import dispatch, schemas
+from .database import get_db
+
+router = APIRouter(prefix="/dispatch", tags=["dispatch"])
+
+
+@router.get("/outbox", response_model=Dict[str, Dict[str, int]])
+async def outbox_counts(db: Session = Depends(get_db)):
+    """Outbox message counts by channel and status."""
+    return dispatch.outbox_counts(db)
+
+
+@router.post("/drain", response_model=schemas.DispatchDrainResponse)
+async def drain_outbox(channel: Optional[List[str]] = Query(None)):
+    """Send every due outbox message now, each channel independently."""
+    channels = channel or list(dispatch.CHANNELS)
+    await dispatch.dispatcher.drain(channels)
+    return schemas.DispatchDrainResponse(channels=dispatch.dispatcher.metrics())
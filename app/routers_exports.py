@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional
+
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import SessionLocal
+from .routers_strategies import _apply_contact_metadata
+
+router = APIRouter(prefix="/exports", tags=["exports"])
+
+ExportFormat = Literal["csv", "ndjson"]
+
+# Rows fetched per round-trip and bytes buffered before a chunk is flushed.
+YIELD_PER = 1000
+CHUNK_BYTES = 64 * 1024
+
+DEFAULT_USER_FIELDS = ["amount_owed", "due_date"]
+PAYMENT_COLUMNS = ["user_id", "user_name", "amount", "date", "installment_number", "notes", "added_at"]
+STRATEGY_COLUMNS = [
+    "strategy_id",
+    "owner_type",
+    "owner_id",
+    "version",
+    "executed",
+    "prompt",
+    "created_at",
+    "updated_at",
+    "timeline",
+]
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """True if the client's Accept-Encoding allows gzip (q > 0)."""
+    header = request.headers.get("accept-encoding", "")
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in {"gzip", "*"}:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _stream_rows(produce: Callable[[Session], Iterator[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    # The request-scoped session may be closed before the body is streamed,
+    # so the generator owns a session for exactly as long as it runs.
+    db = SessionLocal()
+    try:
+        yield from produce(db)
+    finally:
+        db.close()
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+def _encode(rows: Iterator[Dict[str, Any]], columns: List[str], fmt: ExportFormat) -> Iterator[bytes]:
+    buf = io.StringIO()
+    if fmt == "csv":
+        writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: _csv_value(v) for k, v in row.items()})
+            if buf.tell() >= CHUNK_BYTES:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+    else:
+        for row in rows:
+            buf.write(json.dumps(row, default=str))
+            buf.write("\n")
+            if buf.tell() >= CHUNK_BYTES:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def _export_response(
+    request: Request,
+    name: str,
+    rows: Iterator[Dict[str, Any]],
+    columns: List[str],
+    fmt: ExportFormat,
+) -> StreamingResponse:
+    body = _encode(rows, columns, fmt)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{name}.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if _accepts_gzip(request):
+        body = _gzip(body)
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+@router.get("/users")
+def export_users(
+    request: Request,
+    format: ExportFormat = Query("csv"),
+    fields: List[str] = Query(DEFAULT_USER_FIELDS),
+    status: Optional[schemas.StatusLiteral] = Query(None),
+):
+    """Stream users with the chosen `details` keys as CSV or NDJSON."""
+
+    def produce(db: Session) -> Iterator[Dict[str, Any]]:
+        stmt = select(
+            models.User.id, models.User.name, models.User.status, models.User.group_id, models.User.details
+        ).order_by(models.User.id)
+        if status:
+            stmt = stmt.where(models.User.status == status)
+        for user_id, name, user_status, group_id, details in db.execute(
+            stmt.execution_options(yield_per=YIELD_PER)
+        ):
+            details = details or {}
+            row = {"id": user_id, "name": name, "status": user_status, "group_id": group_id}
+            for key in fields:
+                row[key] = details.get(key)
+            yield row
+
+    columns = ["id", "name", "status", "group_id", *fields]
+    return _export_response(request, "users", _stream_rows(produce), columns, format)
+
+
+@router.get("/payments")
+def export_payments(
+    request: Request,
+    format: ExportFormat = Query("csv"),
+):
+    """Stream one row per recorded payment across all users."""
+
+    def produce(db: Session) -> Iterator[Dict[str, Any]]:
+        stmt = (
+            select(models.User.id, models.User.name, models.User.details)
+            .where(func.json_array_length(models.User.details, "$.payment_history") > 0)
+            .order_by(models.User.id)
+            .execution_options(yield_per=YIELD_PER)
+        )
+        for user_id, name, details in db.execute(stmt):
+            for payment in (details or {}).get("payment_history") or []:
+                if not isinstance(payment, dict):
+                    continue
+                yield {
+                    "user_id": user_id,
+                    "user_name": name,
+                    **{k: payment.get(k) for k in PAYMENT_COLUMNS[2:]},
+                }
+
+    return _export_response(request, "payments", _stream_rows(produce), PAYMENT_COLUMNS, format)
+
+
+@router.get("/strategies")
+def export_strategies(
+    request: Request,
+    format: ExportFormat = Query("csv"),
+):
+    """Stream the latest strategy of every user and group owner."""
+
+    def produce(db: Session) -> Iterator[Dict[str, Any]]:
+        stmt = (
+            select(models.Strategy, models.User.details)
+            .join(models.StrategyHead, models.StrategyHead.strategy_id == models.Strategy.id)
+            .outerjoin(models.User, models.User.id == models.Strategy.user_id)
+            .order_by(models.Strategy.id)
+            .execution_options(yield_per=YIELD_PER)
+        )
+        for strategy, details in db.execute(stmt):
+            owner_type = strategy.owner_type()
+            timeline = strategy.timeline
+            if strategy.apply_contacts:
+                timeline = _apply_contact_metadata(timeline, details or {})
+            yield {
+                "strategy_id": strategy.id,
+                "owner_type": owner_type,
+                "owner_id": strategy.user_id if owner_type == "user" else strategy.group_id,
+                "version": strategy.version,
+                "executed": strategy.executed,
+                "prompt": strategy.prompt,
+                "created_at": strategy.created_at,
+                "updated_at": strategy.updated_at,
+                "timeline": timeline,
+            }
+
+    return _export_response(request, "strategies", _stream_rows(produce), STRATEGY_COLUMNS, format)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import re
 from datetime import datetime
 from io import BytesIO
 from typing import Optional
@@ -209,32 +210,14 @@ def _extract_users_from_csv(file_bytes: bytes) -> list[tuple[str, dict]]:
                 # Could be "phone", "phone2", "email", "email2", etc.
                 preferred_contact = preferred_val
                 
-                # Mark the preferred contact method
-                if preferred_val.startswith("phone"):
-                    # Extract number if it's phone2, phone3, etc.
-                    if preferred_val == "phone" or preferred_val == "phone1":
-                        # Mark first phone as preferred
-                        for cm in contact_methods:
-                            if cm["method"] == "phone" and cm["label"] == "Phone 1":
-                                cm["is_preferred"] = True
-                                break
-                    elif preferred_val == "phone2":
-                        for cm in contact_methods:
-                            if cm["method"] == "phone" and cm["label"] == "Phone 2":
-                                cm["is_preferred"] = True
-                                break
-                elif preferred_val.startswith("email"):
-                    if preferred_val == "email" or preferred_val == "email1":
-                        for cm in contact_methods:
-                            if cm["method"] == "email" and cm["label"] == "Email 1":
-                                cm["is_preferred"] = True
-                                break
-                    elif preferred_val == "email2":
-                        for cm in contact_methods:
-                            if cm["method"] == "email" and cm["label"] == "Email 2":
-                                cm["is_preferred"] = True
-                                break
-                
+                # Mark the preferred contact method: "phone"/"phone1" is "Phone 1", "email2" is "Email 2"
+                match = re.fullmatch(r"(phone|email)(\d*)", preferred_val)
+                if match:
+                    label = f"{match.group(1).title()} {match.group(2) or 1}"
+                    by_label = {cm["label"]: cm for cm in contact_methods}
+                    if label in by_label:
+                        by_label[label]["is_preferred"] = True
+
                 # Set preferred contact type (phone/email/sms)
                 if preferred_val.startswith("phone"):
                     details["preferred_contact"] = "phone"
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from fastapi import APIRouter
+
+from . import dispatch, llm_cache, llm_client
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/")
+def get_metrics() -> Dict[str, Any]:
+    """Operational counters for in-process components."""
+    return {
+        "llm_cache": llm_cache.get_cache().metrics(),
+        "llm_client": llm_client.metrics(),
+        "dispatch": dispatch.dispatcher.metrics(),
+    }
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from sqlalchemy.orm import Session
+
+from . import crud, models, reconciliation, schemas
+from .database import get_db
+
+router = APIRouter(prefix="/reconciliation", tags=["reconciliation"])
+
+
+def _get_item(db: Session, item_id: int) -> models.ReconciliationItem:
+    item = db.query(models.ReconciliationItem).filter(models.ReconciliationItem.id == item_id).first()
+    if not item:
+        raise HTTPException(status_code=404, detail="Reconciliation item not found")
+    return item
+
+
+@router.post("/statements", response_model=schemas.ReconciliationBatchRead)
+def upload_statement(
+    file: UploadFile = File(...),
+    auto_post_threshold: float = Query(reconciliation.AUTO_POST_THRESHOLD, ge=0.0, le=1.0),
+    date_window_days: int = Query(reconciliation.DATE_WINDOW_DAYS, ge=0),
+    db: Session = Depends(get_db),
+):
+    """Reconcile a bank statement CSV against open debtors.
+
+    Confident matches are posted as payments; everything else lands in the
+    review queue (`GET /reconciliation/review-queue`). A plain `def`, so
+    parsing, matching and the database work run in the threadpool rather
+    than on the event loop.
+    """
+    content = file.file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+
+    try:
+        lines = reconciliation.parse_statement_csv(content)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    try:
+        return reconciliation.reconcile_statement(
+            db,
+            lines,
+            filename=file.filename,
+            auto_post_threshold=auto_post_threshold,
+            date_window_days=date_window_days,
+        )
+    except crud.ConcurrentUpdateError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+
+@router.get("/review-queue", response_model=List[schemas.ReconciliationItemRead])
+def list_review_queue(
+    batch_id: Optional[int] = Query(None),
+    status: str = Query("review"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    q = db.query(models.ReconciliationItem).filter(models.ReconciliationItem.status == status)
+    if batch_id is not None:
+        q = q.filter(models.ReconciliationItem.batch_id == batch_id)
+    return q.order_by(models.ReconciliationItem.id).offset(offset).limit(limit).all()
+
+
+@router.post("/review-queue/{item_id}/resolve", response_model=schemas.ReconciliationItemRead)
+def resolve_review_item(
+    item_id: int,
+    body: schemas.ReconciliationResolveRequest,
+    db: Session = Depends(get_db),
+):
+    item = _get_item(db, item_id)
+    user_id = body.user_id or item.suggested_user_id
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="No suggested match; provide user_id")
+
+    try:
+        reconciliation.resolve_item(
+            db, item, user_id=user_id, installment_number=body.installment_number
+        )
+    except reconciliation.UserNotFoundError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except crud.ConcurrentUpdateError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    db.refresh(item)
+    return item
+
+
+@router.post("/review-queue/{item_id}/reject", response_model=schemas.ReconciliationItemRead)
+def reject_review_item(
+    item_id: int,
+    db: Session = Depends(get_db),
+):
+    item = _get_item(db, item_id)
+    try:
+        return reconciliation.reject_item(db, item)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
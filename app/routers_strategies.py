@@ -1,18 +1,41 @@
 from __future__ import annotations
 
+import asyncio
+import copy
+import json
 import os
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-import httpx
-from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from . import crud, models, schemas
-from .database import get_db
+from . import (
+    contact_routes,
+    crud,
+    decision_engine,
+    dispatch,
+    llm_cache,
+    llm_client,
+    models,
+    schemas,
+    segmentation,
+    strategy_batch,
+    strategy_scheduler,
+    strategy_templates,
+    timeline_stream,
+)
+from .database import SessionLocal, get_db
 
 router = APIRouter(prefix="/strategies", tags=["strategies"])
 
+# Seconds a request waits for the model before using the deterministic fallback.
+TIMELINE_DEADLINE_SECONDS = float(os.getenv("LLM_TIMELINE_DEADLINE", "20"))
+BLOCK_CONTENT_DEADLINE_SECONDS = float(os.getenv("LLM_BLOCK_CONTENT_DEADLINE", "8"))
+
 
 def _get_owner(db: Session, owner_id: int, owner_type: str) -> models.User | models.Group:
     if owner_type == "group":
@@ -26,34 +49,9 @@ def _get_owner(db: Session, owner_id: int, owner_type: str) -> models.User | mod
     return obj
 
 
-def _get_contact_value(contact_methods: List[Dict[str, Any]], method_candidates: List[str]) -> Optional[str]:
-    """Return the preferred contact detail matching the provided method candidates."""
-    if not contact_methods:
-        return None
-    normalized = [m.lower() for m in method_candidates]
-    preferred = next(
-        (
-            cm
-            for cm in contact_methods
-            if cm.get("method", "").lower() in normalized and cm.get("is_preferred")
-        ),
-        None,
-    )
-    if preferred:
-        return preferred.get("value")
-
-    fallback = next(
-        (cm for cm in contact_methods if cm.get("method", "").lower() in normalized),
-        None,
-    )
-    if fallback:
-        return fallback.get("value")
-    return None
-
-
 def _apply_block_defaults(
     block: Dict[str, Any],
-    contact_methods: List[Dict[str, Any]],
+    routes: Dict[str, str],
     preferred_contact: Optional[str],
 ) -> Dict[str, Any]:
     normalized = dict(block or {})
@@ -64,15 +62,7 @@ def _apply_block_defaults(
         normalized.setdefault("decision_outputs", [])
         return normalized
 
-    source = (normalized.get("source") or "").lower()
-    contact_value: Optional[str] = None
-    if source == "email":
-        contact_value = _get_contact_value(contact_methods, ["email"])
-    elif source in {"call", "phone"}:
-        contact_value = _get_contact_value(contact_methods, ["phone"])
-    elif source == "sms":
-        contact_value = _get_contact_value(contact_methods, ["sms", "phone"])
-
+    contact_value = contact_routes.for_source(routes, normalized.get("source"))
     if contact_value and not normalized.get("contact_method_detail"):
         normalized["contact_method_detail"] = contact_value
 
@@ -82,8 +72,18 @@ def _apply_block_defaults(
     return normalized
 
 
-def _apply_contact_metadata(timeline: List[Dict[str, Any]], details: Dict[str, Any]) -> List[Dict[str, Any]]:
-    contact_methods = details.get("contact_methods") or []
+def _apply_contact_metadata(
+    timeline: List[Dict[str, Any]],
+    details: Dict[str, Any],
+    routes: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """Fill in each action block's contact detail and the owner's preferred contact.
+
+    `routes` are the owner's `contact_routes`; without them they are
+    computed from `details` once for the whole timeline.
+    """
+    if routes is None:
+        routes = contact_routes.from_details(details)
     preferred_contact = details.get("preferred_contact")
     enriched: List[Dict[str, Any]] = []
     for column in timeline or []:
@@ -91,7 +91,7 @@ def _apply_contact_metadata(timeline: List[Dict[str, Any]], details: Dict[str, A
             {
                 "timing": column.get("timing") or "Unscheduled",
                 "blocks": [
-                    _apply_block_defaults(block, contact_methods, preferred_contact)
+                    _apply_block_defaults(block, routes, preferred_contact)
                     for block in column.get("blocks", [])
                 ],
             }
@@ -99,6 +99,65 @@ def _apply_contact_metadata(timeline: List[Dict[str, Any]], details: Dict[str, A
     return enriched
 
 
+def _strategy_timeline(db: Session, strategy: models.Strategy) -> List[Dict[str, Any]]:
+    """The strategy's timeline as the owner sees it.
+
+    Shared timelines stored without contact details (`apply_contacts`) get
+    the owning user's contact details applied here.
+    """
+    if not (strategy.apply_contacts and strategy.user_id is not None):
+        return strategy.timeline
+    user = db.get(models.User, strategy.user_id)
+    routes = contact_routes.for_user(db, strategy.user_id)
+    return _apply_contact_metadata(strategy.timeline, (user.details if user else None) or {}, routes)
+
+
+def _keyed_columns(timeline: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Columns keyed by timing; repeated timings get a `#n` suffix."""
+    keyed: Dict[str, Dict[str, Any]] = {}
+    for column in timeline or []:
+        timing = column.get("timing") or "Unscheduled"
+        key, n = timing, 2
+        while key in keyed:
+            key, n = f"{timing}#{n}", n + 1
+        keyed[key] = column
+    return keyed
+
+
+def _diff_timelines(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Column, block and block-field level changes from `old` to `new`."""
+    old_columns, new_columns = _keyed_columns(old), _keyed_columns(new)
+    changes: List[Dict[str, Any]] = []
+    for key in [*old_columns, *(k for k in new_columns if k not in old_columns)]:
+        if key not in new_columns:
+            changes.append({"op": "removed", "path": key, "old": old_columns[key]})
+            continue
+        if key not in old_columns:
+            changes.append({"op": "added", "path": key, "new": new_columns[key]})
+            continue
+        old_blocks = old_columns[key].get("blocks") or []
+        new_blocks = new_columns[key].get("blocks") or []
+        for idx in range(max(len(old_blocks), len(new_blocks))):
+            path = f"{key}/{idx}"
+            if idx >= len(new_blocks):
+                changes.append({"op": "removed", "path": path, "old": old_blocks[idx]})
+            elif idx >= len(old_blocks):
+                changes.append({"op": "added", "path": path, "new": new_blocks[idx]})
+            else:
+                before, after = old_blocks[idx], new_blocks[idx]
+                for field in sorted(set(before) | set(after)):
+                    if before.get(field) != after.get(field):
+                        changes.append(
+                            {
+                                "op": "changed",
+                                "path": f"{path}/{field}",
+                                "old": before.get(field),
+                                "new": after.get(field),
+                            }
+                        )
+    return changes
+
+
 def _validate_timeline_schema(timeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     try:
         columns = [schemas.StrategyTimelineColumn(**column) for column in timeline]
@@ -121,7 +180,14 @@ def _build_default_timeline(details: Dict[str, Any], prompt: str) -> List[Dict[s
     amount_phrase = (
         f"₹{amount_owed:,}" if isinstance(amount_owed, (int, float)) else "your outstanding balance"
     )
+    # The plan only varies by amount, so validate it once per amount and only
+    # apply the per-user contact details on each call.
+    return _apply_contact_metadata(json.loads(_default_base_timeline(amount_phrase)), details)
 
+
+@lru_cache(maxsize=4096)
+def _default_base_timeline(amount_phrase: str) -> str:
+    """Validated default timeline for `amount_phrase`, serialized so callers get a fresh copy."""
     base_timeline = [
         {
             "timing": "Day 1-7",
@@ -208,23 +274,83 @@ def _build_default_timeline(details: Dict[str, Any], prompt: str) -> List[Dict[s
         },
     ]
 
-    return _prepare_timeline(base_timeline, details)
+    return json.dumps(_validate_timeline_schema(base_timeline))
 
 
 async def _generate_timeline_with_ai(
     details: Dict[str, Any],
     prompt: str,
+    *,
+    use_cache: bool = True,
 ) -> List[Dict[str, Any]]:
     """Call OpenAI API to generate a strategy timeline.
 
     If `OPENAI_API_KEY` is not present or the API call fails,
     it falls back to a deterministic local strategy.
+
+    Model output is cached (see `llm_cache`) keyed on the prompt and the
+    context fields sent to the model; contact details are not part of the
+    prompt and are applied per user after the lookup.
+    """
+    timeline, _ = await _generate_timeline(details, prompt, use_cache=use_cache)
+    return timeline
+
+
+async def _generate_timeline(
+    details: Dict[str, Any],
+    prompt: str,
+    *,
+    use_cache: bool = True,
+) -> Tuple[List[Dict[str, Any]], str]:
+    """Like `_generate_timeline_with_ai`, also returning where the timeline came from.
+
+    The source is "ai", "cache" or "default" (deterministic fallback).
     """
     api_key = os.getenv("OPENAI_API_KEY")
 
     if not api_key:
-        return _build_default_timeline(details, prompt)
+        return _build_default_timeline(details, prompt), "default"
+
+    payload, cache_key = _build_timeline_request(details, prompt, use_cache=use_cache)
+    if cache_key is not None:
+        cached = llm_cache.get_cache().get(cache_key)
+        if cached is not None:
+            return _prepare_timeline(cached, details), "cache"
+
+    try:
+        data = await llm_client.post_chat_completion(
+            payload, api_key=api_key, deadline=TIMELINE_DEADLINE_SECONDS
+        )
+    except Exception:
+        # On any error, fall back to deterministic plan
+        return _build_default_timeline(details, prompt), "default"
 
+    # Parse OpenAI response
+    try:
+        content = data["choices"][0]["message"]["content"]
+    except Exception:
+        return _build_default_timeline(details, prompt), "default"
+
+    timeline = _parse_timeline_content(content)
+    if timeline is None:
+        return _build_default_timeline(details, prompt), "default"
+    try:
+        prepared = _prepare_timeline(timeline, details)
+    except HTTPException:
+        # Invalid structure from AI; fall back
+        return _build_default_timeline(details, prompt), "default"
+    if cache_key is not None:
+        llm_cache.get_cache().set(cache_key, timeline)
+    return prepared, "ai"
+
+
+def _build_timeline_request(
+    details: Dict[str, Any],
+    prompt: str,
+    *,
+    use_cache: bool = True,
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Chat completion payload for a timeline, plus its cache key (None when not caching)."""
     # Prepare context from details
     amount_owed = details.get("amount_owed")
     due_date = details.get("due_date")
@@ -264,8 +390,22 @@ async def _generate_timeline_with_ai(
     )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    base_url = os.getenv("OPENAI_API_BASE_URL", "https://api.openai.com/v1")
-    url = f"{base_url.rstrip('/')}/chat/completions"
+
+    cache_key: Optional[str] = None
+    if use_cache and llm_cache.cache_enabled():
+        cache_key = llm_cache.make_key(
+            "timeline",
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=prompt,
+            context={
+                "customer_name": customer_name,
+                "amount_owed": amount_owed,
+                "due_date": due_date,
+                "preferred_contact": preferred_contact,
+                "service": service,
+            },
+        )
 
     payload: Dict[str, Any] = {
         "model": model,
@@ -277,42 +417,17 @@ async def _generate_timeline_with_ai(
         "max_tokens": 2000,
         "response_format": {"type": "json_object"},
     }
+    return payload, cache_key
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(url, json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-    except Exception:
-        # On any error, fall back to deterministic plan
-        return _build_default_timeline(details, prompt)
-
-    # Parse OpenAI response
-    try:
-        content = data["choices"][0]["message"]["content"]
-    except Exception:
-        return _build_default_timeline(details, prompt)
-
-    import json
 
+def _parse_timeline_content(content: Any) -> Optional[List[Dict[str, Any]]]:
+    """The raw `timeline` list from a model response, or None if it has none."""
     try:
         parsed = json.loads(content)
-        timeline = parsed.get("timeline")
-        if isinstance(timeline, list):
-            try:
-                return _prepare_timeline(timeline, details)
-            except HTTPException:
-                # Invalid structure from AI; fall back
-                return _build_default_timeline(details, prompt)
     except Exception:
-        return _build_default_timeline(details, prompt)
-
-    return _build_default_timeline(details, prompt)
+        return None
+    timeline = parsed.get("timeline") if isinstance(parsed, dict) else None
+    return timeline if isinstance(timeline, list) else None
 
 
 def _build_default_action_content(
@@ -365,6 +480,8 @@ async def _generate_action_content_with_ai(
     details: Dict[str, Any],
     block: Dict[str, Any],
     user_prompt: Optional[str],
+    *,
+    use_cache: bool = True,
 ) -> str:
     """Generate AI content for a single action block using OpenAI (small model).
 
@@ -415,8 +532,6 @@ async def _generate_action_content_with_ai(
     )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    base_url = os.getenv("OPENAI_API_BASE_URL", "https://api.openai.com/v1")
-    url = f"{base_url.rstrip('/')}/chat/completions"
 
     payload: Dict[str, Any] = {
         "model": model,
@@ -427,23 +542,342 @@ async def _generate_action_content_with_ai(
         "temperature": 0.4,
         "max_tokens": 300,
     }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+
+    cache_key: Optional[str] = None
+    if use_cache and llm_cache.cache_enabled():
+        cache_key = llm_cache.make_key(
+            "block_content",
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=planner_prompt,
+            context={
+                "customer_name": customer_name,
+                "amount_owed": amount_owed,
+                "due_date": due_date,
+                "preferred_contact": preferred_contact,
+                "source": source,
+                "tone": tone,
+            },
+        )
+        cached = llm_cache.get_cache().get(cache_key)
+        if cached is not None:
+            return cached
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(url, json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-        content = data["choices"][0]["message"]["content"]
-        return (content or "").strip()
+        data = await llm_client.post_chat_completion(
+            payload, api_key=api_key, deadline=BLOCK_CONTENT_DEADLINE_SECONDS
+        )
+        content = (data["choices"][0]["message"]["content"] or "").strip()
+        if cache_key is not None and content:
+            llm_cache.get_cache().set(cache_key, content)
+        return content
     except Exception:
         # On any error, fall back to deterministic content
         return _build_default_action_content(details, block, user_prompt)
 
 
+# Upper bound on model calls in flight while filling one timeline.
+TIMELINE_CONTENT_CONCURRENCY = 8
+
+
+async def _fill_action_blocks(
+    details: Dict[str, Any],
+    timeline: List[Dict[str, Any]],
+    user_prompt: Optional[str],
+    *,
+    only_empty: bool = False,
+    use_cache: bool = True,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Fill `content` on every action block of `timeline` concurrently.
+
+    Message content depends only on the owner, the prompt and the block's
+    channel and tone, so blocks sharing a (source, tone) pair are generated
+    once and the calls for distinct pairs run in parallel.
+    """
+    targets: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for column in timeline:
+        for block in column.get("blocks") or []:
+            if (block.get("block_type") or "action") != "action":
+                continue
+            if only_empty and (block.get("content") or "").strip():
+                continue
+            key = ((block.get("source") or "email").lower(), (block.get("tone") or "friendly").lower())
+            targets.setdefault(key, []).append(block)
+
+    semaphore = asyncio.Semaphore(TIMELINE_CONTENT_CONCURRENCY)
+
+    async def generate(blocks: List[Dict[str, Any]]) -> str:
+        async with semaphore:
+            return await _generate_action_content_with_ai(details, blocks[0], user_prompt, use_cache=use_cache)
+
+    contents = await asyncio.gather(*(generate(blocks) for blocks in targets.values()))
+    generated = 0
+    for blocks, content in zip(targets.values(), contents):
+        for block in blocks:
+            block["content"] = content
+            generated += 1
+    return timeline, generated
+
+
+@router.post("/batch/ai-generate", response_model=schemas.StrategyBatchJobRead, status_code=202)
+async def batch_ai_generate(
+    body: schemas.StrategyBatchRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    """Generate strategies for many owners in a background job.
+
+    Owners come from `owner_ids` or from the status/group filters. Poll
+    `GET /strategies/batch/{job_id}` for progress.
+    """
+    owner_ids = strategy_batch.resolve_owner_ids(db, body)
+    if not owner_ids:
+        raise HTTPException(status_code=400, detail="No owners matched the batch request")
+
+    job = strategy_batch.create_job(db, body=body, owner_ids=owner_ids)
+    background_tasks.add_task(
+        strategy_batch.run_job,
+        job.id,
+        generate=_generate_timeline,
+        fallback=_build_default_timeline,
+        concurrency=body.concurrency,
+        requests_per_minute=body.requests_per_minute,
+        tokens_per_minute=body.tokens_per_minute,
+        chunk_size=body.chunk_size,
+        owner_timeout_seconds=body.owner_timeout_seconds,
+        use_cache=body.use_cache,
+    )
+    return job
+
+
+@router.get("/batch/{job_id}", response_model=schemas.StrategyBatchJobRead)
+async def get_batch_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+):
+    job = db.get(models.StrategyBatchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
+@router.post("/templates", response_model=schemas.StrategyTemplateRead, status_code=201)
+async def create_template(
+    body: schemas.StrategyTemplateCreate,
+    db: Session = Depends(get_db),
+):
+    """Save a new version of a named template (version 1 for a new name)."""
+    try:
+        return strategy_templates.save_template(
+            db, name=body.name, timeline=body.timeline, description=body.description
+        )
+    except strategy_templates.TemplateError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.get("/templates", response_model=List[schemas.StrategyTemplateRead])
+async def list_templates(
+    name: Optional[str] = Query(None, description="List every version of this template"),
+    db: Session = Depends(get_db),
+):
+    """Latest version of every template, or all versions of `name`."""
+    q = db.query(models.StrategyTemplate)
+    if name is not None:
+        return q.filter(models.StrategyTemplate.name == name).order_by(models.StrategyTemplate.version).all()
+    latest = db.query(func.max(models.StrategyTemplate.id)).group_by(models.StrategyTemplate.name)
+    return q.filter(models.StrategyTemplate.id.in_(latest)).order_by(models.StrategyTemplate.name).all()
+
+
+@router.post("/templates/apply", response_model=schemas.TemplateApplyResponse)
+def apply_template(
+    body: schemas.TemplateApplyRequest,
+    db: Session = Depends(get_db),
+):
+    """Stamp a template onto many owners in one transaction, without the LLM.
+
+    A plain `def`, so the bulk writes run in the threadpool rather than on
+    the event loop.
+    """
+    if body.template_id is None and not body.name:
+        raise HTTPException(status_code=400, detail="Provide template_id or name")
+    template = strategy_templates.get_template(
+        db, template_id=body.template_id, name=body.name, version=body.version
+    )
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+
+    owner_ids = strategy_batch.resolve_owner_ids(db, body)
+    stats = strategy_templates.apply_template(
+        db,
+        template,
+        owner_type=body.owner_type,
+        owner_ids=owner_ids,
+        prompt=body.prompt,
+    )
+    return schemas.TemplateApplyResponse(
+        template_id=template.id, name=template.name, version=template.version, **stats
+    )
+
+
+@router.get("/templates/{template_id}", response_model=schemas.StrategyTemplateRead)
+async def get_template(
+    template_id: int,
+    db: Session = Depends(get_db),
+):
+    template = strategy_templates.get_template(db, template_id=template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
+
+
+@router.get("/segments", response_model=List[schemas.StrategySegmentRead])
+async def list_segments(
+    include_empty: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    """Segment definitions with member counts and their shared timelines."""
+    q = db.query(models.StrategySegment)
+    if not include_empty:
+        q = q.filter(models.StrategySegment.member_count > 0)
+    return q.order_by(models.StrategySegment.member_count.desc(), models.StrategySegment.id).all()
+
+
+@router.post("/segments/refresh", response_model=schemas.SegmentRefreshResponse)
+async def refresh_segments(
+    body: schemas.SegmentRefreshRequest = Body(default_factory=schemas.SegmentRefreshRequest),
+    db: Session = Depends(get_db),
+):
+    """Re-segment users and give every member its segment's strategy.
+
+    One timeline is generated per segment rather than per user; members get
+    it with their own contact details applied.
+    """
+    stats = await segmentation.refresh(
+        db,
+        generate=_generate_timeline,
+        prompt=body.prompt,
+        regenerate=body.regenerate,
+        full=body.full,
+        use_cache=body.use_cache,
+    )
+    return schemas.SegmentRefreshResponse(**stats)
+
+
+def enqueue_due(db: Session, due: List[strategy_scheduler.DueBlock]) -> None:
+    """Scheduler `on_due` hook: queue due action blocks in the outbox."""
+    dispatch.enqueue(db, due, now=strategy_scheduler.get_clock().now())
+
+
+@router.post("/scheduler/tick", response_model=schemas.SchedulerTickResponse)
+async def scheduler_tick(db: Session = Depends(get_db)):
+    """Run every executed strategy's columns that are due now and queue their messages."""
+    now = strategy_scheduler.get_clock().now()
+    tie_breaker = None
+    if decision_engine.tie_breaker_enabled():
+        tie_breaker = decision_engine.llm_tie_breaker(asyncio.get_running_loop())
+    # In a worker thread, so an LLM tie-breaker can run on this event loop.
+    stats = await asyncio.to_thread(
+        strategy_scheduler.tick, db, now=now, on_due=enqueue_due, tie_breaker=tie_breaker
+    )
+    return schemas.SchedulerTickResponse(now=now, **stats)
+
+
+@router.get("/{owner_id}/execution", response_model=Optional[schemas.StrategyExecutionRead])
+async def get_strategy_execution(
+    owner_id: int,
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    db: Session = Depends(get_db),
+):
+    """The owner's most recent strategy execution."""
+    execution = models.StrategyExecution
+    return (
+        db.query(execution)
+        .filter(execution.owner_type == owner_type, execution.owner_id == owner_id)
+        .order_by(execution.id.desc())
+        .first()
+    )
+
+
+@router.get("/{owner_id}/versions", response_model=List[schemas.StrategyVersionRead])
+async def list_strategy_versions(
+    owner_id: int,
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    db: Session = Depends(get_db),
+):
+    """Every saved version of the owner's strategy, newest first."""
+    head = db.get(models.StrategyHead, (owner_type, owner_id))
+    return [
+        schemas.StrategyVersionRead(
+            id=s.id,
+            version=s.version,
+            prompt=s.prompt,
+            executed=s.executed,
+            timeline_hash=s.timeline_hash,
+            created_at=s.created_at,
+            latest=head is not None and head.strategy_id == s.id,
+        )
+        for s in crud.list_strategy_versions(db, owner_id=owner_id, owner_type=owner_type)
+    ]
+
+
+@router.get("/{owner_id}/versions/diff", response_model=schemas.StrategyVersionDiff)
+async def diff_strategy_versions(
+    owner_id: int,
+    from_version: Optional[int] = Query(None, alias="from"),
+    to_version: Optional[int] = Query(None, alias="to"),
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    db: Session = Depends(get_db),
+):
+    """Changes between two versions; defaults to the latest against the one before it."""
+    if to_version is None:
+        head = db.get(models.StrategyHead, (owner_type, owner_id))
+        if head is None:
+            raise HTTPException(status_code=404, detail="Strategy not found")
+        to_version = head.version
+    if from_version is None:
+        from_version = to_version - 1
+
+    versions = {}
+    for version in (from_version, to_version):
+        strategy = crud.get_strategy_version(db, owner_id=owner_id, owner_type=owner_type, version=version)
+        if strategy is None:
+            raise HTTPException(status_code=404, detail=f"Strategy version {version} not found")
+        versions[version] = strategy
+
+    old, new = versions[from_version], versions[to_version]
+    same_content = old.timeline_hash is not None and old.timeline_hash == new.timeline_hash
+    if same_content and old.apply_contacts == new.apply_contacts:
+        changes: List[Dict[str, Any]] = []
+    else:
+        changes = _diff_timelines(_strategy_timeline(db, old), _strategy_timeline(db, new))
+    return schemas.StrategyVersionDiff(
+        from_version=from_version,
+        to_version=to_version,
+        identical=not changes,
+        changes=changes,
+    )
+
+
+@router.get("/{owner_id}/versions/{version}", response_model=schemas.StrategyRead)
+async def get_strategy_version(
+    owner_id: int,
+    version: int,
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    db: Session = Depends(get_db),
+):
+    strategy = crud.get_strategy_version(db, owner_id=owner_id, owner_type=owner_type, version=version)
+    if not strategy:
+        raise HTTPException(status_code=404, detail="Strategy version not found")
+    return schemas.StrategyRead(
+        id=strategy.id,
+        timeline=_strategy_timeline(db, strategy),
+        prompt=strategy.prompt,
+        executed=strategy.executed,
+        version=strategy.version,
+        owner_type=owner_type,
+    )
+
+
 @router.get("/{owner_id}", response_model=Optional[schemas.StrategyRead])
 async def get_strategy(
     owner_id: int,
@@ -455,9 +889,10 @@ async def get_strategy(
         return None
     return schemas.StrategyRead(
         id=strategy.id,
-        timeline=strategy.timeline,
+        timeline=_strategy_timeline(db, strategy),
         prompt=strategy.prompt,
         executed=strategy.executed,
+        version=strategy.version,
         owner_type=owner_type,
     )
 
@@ -484,6 +919,7 @@ async def create_or_update_strategy(
         timeline=strategy.timeline,
         prompt=strategy.prompt,
         executed=strategy.executed,
+        version=strategy.version,
         owner_type=body.owner_type,
     )
 
@@ -502,11 +938,11 @@ async def ai_generate_strategy(
         details = owner.details or {}
     else:
         # For groups, aggregate basic info
-        details = {"group_name": owner.name, "members": len(owner.users)}
+        details = {"group_name": owner.name, "members": crud.count_group_members(db, owner.id)}
 
     prompt = body.prompt or "Create balanced collection strategy"
 
-    timeline = await _generate_timeline_with_ai(details, prompt)
+    timeline = await _generate_timeline_with_ai(details, prompt, use_cache=body.use_cache)
 
     strategy = crud.create_or_update_strategy_for_owner(
         db,
@@ -521,10 +957,109 @@ async def ai_generate_strategy(
         timeline=strategy.timeline,
         prompt=strategy.prompt,
         executed=strategy.executed,
+        version=strategy.version,
         owner_type=owner_type,
     )
 
 
+@router.post("/{owner_id}/ai-generate/stream")
+async def ai_generate_strategy_stream(
+    owner_id: int,
+    body: schemas.AIGenerateRequest = Body(default_factory=schemas.AIGenerateRequest),
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    db: Session = Depends(get_db),
+):
+    """Streaming variant of `ai-generate` as server-sent events.
+
+    Events: `start`, then one `column` per timeline column as soon as the
+    model has finished writing it, then `strategy` with the validated and
+    saved result. If the streamed output turns out to be unusable a `reset`
+    event is sent and the default timeline's columns follow.
+    """
+    owner = _get_owner(db, owner_id, owner_type)
+
+    details: Dict[str, Any]
+    if isinstance(owner, models.User):
+        details = owner.details or {}
+    else:
+        # For groups, aggregate basic info
+        details = {"group_name": owner.name, "members": crud.count_group_members(db, owner.id)}
+
+    prompt = body.prompt or "Create balanced collection strategy"
+
+    async def events() -> AsyncIterator[bytes]:
+        yield timeline_stream.sse_event(
+            "start", {"owner_id": owner_id, "owner_type": owner_type, "prompt": prompt}
+        )
+
+        timeline: Optional[List[Dict[str, Any]]] = None
+        source = "default"
+        emitted = 0
+        api_key = os.getenv("OPENAI_API_KEY")
+        if api_key:
+            payload, cache_key = _build_timeline_request(details, prompt, use_cache=body.use_cache)
+            cached = llm_cache.get_cache().get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                timeline, source = _prepare_timeline(cached, details), "cache"
+            else:
+                parser = timeline_stream.TimelineColumnParser()
+                try:
+                    async for delta in llm_client.stream_chat_completion(
+                        payload, api_key=api_key, deadline=TIMELINE_DEADLINE_SECONDS
+                    ):
+                        for column in parser.feed(delta):
+                            try:
+                                prepared = _prepare_timeline([column], details)[0]
+                            except HTTPException:
+                                continue
+                            yield timeline_stream.sse_event("column", {"index": emitted, "column": prepared})
+                            emitted += 1
+                    raw = _parse_timeline_content(parser.text)
+                    if raw is not None:
+                        timeline, source = _prepare_timeline(raw, details), "ai"
+                        if cache_key is not None:
+                            llm_cache.get_cache().set(cache_key, raw)
+                except Exception:
+                    timeline = None
+
+        if timeline is None:
+            if emitted:
+                yield timeline_stream.sse_event("reset", {"reason": "invalid model output"})
+            timeline, source, emitted = _build_default_timeline(details, prompt), "default", 0
+        for index in range(emitted, len(timeline)):
+            yield timeline_stream.sse_event("column", {"index": index, "column": timeline[index]})
+
+        # The request-scoped session may already be closed while streaming.
+        session = SessionLocal()
+        try:
+            strategy = crud.create_or_update_strategy_for_owner(
+                session,
+                owner_id=owner_id,
+                owner_type=owner_type,
+                timeline=timeline,
+                prompt=prompt,
+            )
+            result = schemas.StrategyRead(
+                id=strategy.id,
+                timeline=strategy.timeline,
+                prompt=strategy.prompt,
+                executed=strategy.executed,
+                version=strategy.version,
+                owner_type=owner_type,
+            )
+            yield timeline_stream.sse_event("strategy", {**result.dict(), "source": source})
+        except Exception as exc:
+            yield timeline_stream.sse_event("error", {"detail": str(exc)})
+        finally:
+            session.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post(
     "/{owner_id}/ai-generate-block-content",
     response_model=schemas.BlockContentAIResponse,
@@ -547,34 +1082,100 @@ async def ai_generate_block_content(
         details: Dict[str, Any] = owner.details or {}
     else:
         # For groups, aggregate basic info
-        details = {"group_name": owner.name, "members": len(owner.users)}
+        details = {"group_name": owner.name, "members": crud.count_group_members(db, owner.id)}
 
     # Convert Pydantic model to a plain dict for easier manipulation
     block_dict = body.block.dict()
 
-    content = await _generate_action_content_with_ai(details, block_dict, body.prompt)
+    content = await _generate_action_content_with_ai(
+        details, block_dict, body.prompt, use_cache=body.use_cache
+    )
     return schemas.BlockContentAIResponse(content=content)
 
 
+@router.post(
+    "/{owner_id}/ai-generate-timeline-content",
+    response_model=schemas.TimelineContentAIResponse,
+)
+async def ai_generate_timeline_content(
+    owner_id: int,
+    body: schemas.TimelineContentAIGenerateRequest = Body(
+        default_factory=schemas.TimelineContentAIGenerateRequest
+    ),
+    owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    db: Session = Depends(get_db),
+):
+    """Generate content for every action block of a timeline in one request.
+
+    The owner is loaded once and the model calls run concurrently, so the
+    request takes about as long as a single block generation.
+    """
+    owner = _get_owner(db, owner_id, owner_type)
+
+    if isinstance(owner, models.User):
+        details: Dict[str, Any] = owner.details or {}
+    else:
+        # For groups, aggregate basic info
+        details = {"group_name": owner.name, "members": crud.count_group_members(db, owner.id)}
+
+    if body.timeline is not None:
+        timeline = [column.dict() for column in body.timeline]
+    else:
+        if body.strategy_id is not None:
+            strategy = db.get(models.Strategy, body.strategy_id)
+            strategy_owner = None
+            if strategy is not None:
+                strategy_owner = strategy.user_id if owner_type == "user" else strategy.group_id
+            if strategy_owner != owner_id:
+                raise HTTPException(status_code=404, detail="Strategy not found")
+        else:
+            strategy = crud.get_latest_strategy_for_owner(db, owner_id=owner_id, owner_type=owner_type)
+            if not strategy:
+                raise HTTPException(status_code=404, detail="Strategy not found")
+        timeline = copy.deepcopy(_strategy_timeline(db, strategy) or [])
+
+    timeline, generated = await _fill_action_blocks(
+        details,
+        timeline,
+        body.prompt,
+        only_empty=body.only_empty,
+        use_cache=body.use_cache,
+    )
+    return schemas.TimelineContentAIResponse(timeline=timeline, generated=generated)
+
+
 @router.post("/{owner_id}/execute", response_model=schemas.StrategyExecuteResponse)
 async def execute_strategy(
     owner_id: int,
     owner_type: schemas.OwnerTypeLiteral = Query("user"),
+    anchor: schemas.ExecutionAnchorLiteral = Query("execution"),
+    members: bool = Query(False),
     db: Session = Depends(get_db),
 ):
+    """Mark the latest strategy executed and schedule its timeline columns.
+
+    Day 1 of the timeline is today, or the user's due date with
+    `anchor=due_date`; any earlier execution of the owner is cancelled.
+    For a group, `members=true` also sets each member's status and starts
+    the group strategy for every member. Group execution runs in one
+    transaction of set-based statements, whatever the group's size.
+    """
     owner = _get_owner(db, owner_id, owner_type)
 
     strategy = crud.get_latest_strategy_for_owner(db, owner_id=owner_id, owner_type=owner_type)
     if not strategy:
         raise HTTPException(status_code=404, detail="No strategy found for this owner")
-
-    strategy = crud.mark_strategy_executed(db, strategy)
+    strategy_id = strategy.id
 
     # Prototype: simulate side effects by updating status based on amount owed.
     user_status: Optional[str] = None
     group_status: Optional[str] = None
+    members_updated: Optional[int] = None
+    member_executions: Optional[int] = None
 
     if isinstance(owner, models.User):
+        strategy = crud.mark_strategy_executed(db, strategy)
+        execution_id = strategy_scheduler.start_executions(db, [strategy], anchor=anchor)[0]
         details = owner.details or {}
         amount_owed = details.get("amount_owed")
         if amount_owed is not None and amount_owed > 0:
@@ -583,24 +1184,23 @@ async def execute_strategy(
             owner = crud.update_user_status(db, owner, status="finished")
         user_status = owner.status
 
-    else:  # Group
-        # Very simple: if any member owes > 0, group is ongoing; else finished
-        members = owner.users
-        any_owed = False
-        for u in members:
-            details = u.details or {}
-            if (details.get("amount_owed") or 0) > 0:
-                any_owed = True
-                break
-        if any_owed:
-            owner = crud.update_group_status(db, owner, status="ongoing")
-        else:
-            owner = crud.update_group_status(db, owner, status="finished")
-        group_status = owner.status
-
+    else:  # Group: ongoing if any member owes money, else finished
+        strategy.executed = True
+        execution_id = strategy_scheduler.start_executions(db, [strategy], anchor=anchor, commit=False)[0]
+        owner.status = "ongoing" if crud.group_has_balance(db, owner.id) else "finished"
+        if members:
+            members_updated = crud.set_member_statuses_by_balance(db, owner.id)
+            member_executions = strategy_scheduler.start_member_executions(db, strategy, owner.id, anchor=anchor)
+        group_status = owner.status  # read before the commit expires it
+        db.commit()
+
+    # The id was read before any commit, so the response reloads nothing.
     return schemas.StrategyExecuteResponse(
-        id=strategy.id,
-        executed=strategy.executed,
+        id=strategy_id,
+        executed=True,
         user_status=user_status,
         group_status=group_status,
+        execution_id=execution_id,
+        members_updated=members_updated,
+        member_executions=member_executions,
     )
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from datetime import date
 from typing import Any, Dict, List, Optional
 import os
 import shutil
@@ -8,7 +9,7 @@ from pathlib import Path
 from fastapi import APIRouter, Depends, HTTPException, Query, File, UploadFile
 from sqlalchemy.orm import Session, joinedload
 
-from . import crud, models, schemas
+from . import communication_log, crud, dynamic_groups, models, portfolio, reaging, schemas
 from .database import get_db
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -83,6 +84,7 @@ def list_entities(
             )
         )
 
+    member_counts = dynamic_groups.member_counts(db, [g.id for g in groups])
     for g in groups:
         results.append(
             schemas.EntitySummary(
@@ -90,7 +92,7 @@ def list_entities(
                 name=g.name,
                 type="group",
                 status=g.status,
-                summary_details={"members": len(g.users)},
+                summary_details={"members": member_counts.get(g.id, 0)},
             )
         )
 
@@ -116,6 +118,43 @@ def analytics(db: Session = Depends(get_db)):
     )
 
 
+@router.get("/analytics/aging", response_model=schemas.AgingReportResponse)
+def aging_report(
+    edges: List[int] = Query(list(portfolio.DEFAULT_AGING_EDGES)),
+    as_of: Optional[date] = Query(None),
+    refresh: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    """Portfolio aging: open balances bucketed by days overdue.
+
+    Bucket upper edges are configurable, e.g. `?edges=30&edges=60&edges=90`
+    gives 0-30, 31-60, 61-90 and 91+. Served from a portfolio snapshot at most
+    `PORTFOLIO_SNAPSHOT_TTL` seconds old unless `refresh=true`.
+    """
+    snapshot = portfolio.get_snapshot(db, max_age=0 if refresh else None)
+    try:
+        report = portfolio.compute_aging_report(snapshot, edges=edges, today=as_of)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return report
+
+
+@router.post("/reage", response_model=schemas.ReagingResponse)
+def reage_portfolio(
+    as_of: Optional[date] = Query(None),
+    archive_after_days: int = Query(reaging.ARCHIVE_AFTER_DAYS, ge=0),
+    db: Session = Depends(get_db),
+):
+    """Recompute every user's overdue days and flags and apply status transitions (the nightly job)."""
+    return reaging.run(db, today=as_of, archive_after_days=archive_after_days)
+
+
+@router.get("/groups/analytics", response_model=List[schemas.GroupAnalytics])
+def group_analytics(db: Session = Depends(get_db)):
+    """Totals, status mix and average overdue days for every group."""
+    return crud.compute_group_analytics(db)
+
+
 @router.post("/group", response_model=schemas.GroupRead)
 def create_group(
     body: schemas.GroupCreate,
@@ -128,6 +167,95 @@ def create_group(
     return group
 
 
+def _dynamic_group_read(db: Session, group: models.Group) -> schemas.DynamicGroupRead:
+    return schemas.DynamicGroupRead(
+        id=group.id,
+        name=group.name,
+        status=group.status,
+        rule=group.rule,
+        refreshed_on=group.refreshed_on,
+        member_count=crud.count_group_members(db, group.id),
+    )
+
+
+@router.post("/group/dynamic", response_model=schemas.DynamicGroupRead)
+def create_dynamic_group(
+    body: schemas.DynamicGroupCreate,
+    db: Session = Depends(get_db),
+):
+    """Create a group whose members are the users matching `rule`."""
+    try:
+        group = crud.create_dynamic_group(db, name=body.name, rule=body.rule.dict())
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return _dynamic_group_read(db, group)
+
+
+@router.put("/group/{group_id}/rule", response_model=schemas.DynamicGroupRead)
+def update_group_rule(
+    group_id: int,
+    body: schemas.GroupRule,
+    db: Session = Depends(get_db),
+):
+    """Replace a rule-based group's rule and re-evaluate its members."""
+    group = _get_group_or_404(db, group_id)
+    try:
+        group = crud.update_group_rule(db, group, body.dict())
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return _dynamic_group_read(db, group)
+
+
+@router.post("/groups/refresh", response_model=schemas.DynamicGroupRefreshResponse)
+def refresh_dynamic_groups(
+    full: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    """Re-evaluate rule-based groups whose members depend on the date (all of them with `full`)."""
+    return dynamic_groups.refresh(db, full=full)
+
+
+def _get_group_or_404(db: Session, group_id: int) -> models.Group:
+    group = crud.get_group(db, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group
+
+
+@router.post("/group/{group_id}/members", response_model=schemas.GroupMembershipResponse)
+def add_group_members(
+    group_id: int,
+    body: schemas.GroupMembersUpdate,
+    db: Session = Depends(get_db),
+):
+    """Add users to a group, moving them out of any other group."""
+    group = _get_group_or_404(db, group_id)
+    try:
+        added = crud.add_group_members(db, group, body.user_ids)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return schemas.GroupMembershipResponse(
+        group_id=group_id, added=added, member_count=crud.count_group_members(db, group_id)
+    )
+
+
+@router.delete("/group/{group_id}/members", response_model=schemas.GroupMembershipResponse)
+def remove_group_members(
+    group_id: int,
+    body: schemas.GroupMembersUpdate,
+    db: Session = Depends(get_db),
+):
+    """Remove users from a group; all of them must be members."""
+    group = _get_group_or_404(db, group_id)
+    try:
+        removed = crud.remove_group_members(db, group, body.user_ids)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return schemas.GroupMembershipResponse(
+        group_id=group_id, removed=removed, member_count=crud.count_group_members(db, group_id)
+    )
+
+
 @router.get("/{id}")
 def get_entity(
     id: int,
@@ -135,7 +263,8 @@ def get_entity(
 ) -> Dict[str, Any]:
     """Get user or group details by id.
 
-    Tries user first, then group. Returns a generic payload with `type`.
+    Tries user first, then group. Returns a generic payload with `type`
+    and the owner's communication summary.
     """
     # Load user with group relationship
     user = db.query(models.User).options(joinedload(models.User.group)).filter(models.User.id == id).first()
@@ -143,24 +272,33 @@ def get_entity(
         try:
             user_read = _pydantic_from_orm(schemas.UserRead, user)
             group_read = _pydantic_from_orm(schemas.GroupRead, user.group) if user.group else None
+            communication = communication_log.get_summary(db, "user", user.id)
             return {
                 "type": "user",
                 "data": _pydantic_to_dict(user_read),
                 "group": _pydantic_to_dict(group_read),
+                "communication": _pydantic_to_dict(
+                    _pydantic_from_orm(schemas.CommunicationSummaryRead, communication)
+                ),
             }
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error serializing user: {str(e)}")
 
     # Load group with users relationship
-    group = db.query(models.Group).options(joinedload(models.Group.users)).filter(models.Group.id == id).first()
+    group = db.query(models.Group).filter(models.Group.id == id).first()
     if group:
         try:
             group_read = _pydantic_from_orm(schemas.GroupRead, group)
-            members_read = [_pydantic_from_orm(schemas.UserRead, u) for u in group.users]
+            members = db.query(models.User).filter(dynamic_groups.members_clause(db, group.id)).order_by(models.User.id)
+            members_read = [_pydantic_from_orm(schemas.UserRead, u) for u in members]
+            communication = communication_log.get_summary(db, "group", group.id)
             return {
                 "type": "group",
                 "data": _pydantic_to_dict(group_read),
                 "members": [_pydantic_to_dict(m) for m in members_read],
+                "communication": _pydantic_to_dict(
+                    _pydantic_from_orm(schemas.CommunicationSummaryRead, communication)
+                ),
             }
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error serializing group: {str(e)}")
@@ -235,5 +373,7 @@ def add_payment(
         return _pydantic_from_orm(schemas.UserRead, user)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except crud.ConcurrentUpdateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding payment: {str(e)}")
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from . import models, schemas, worklist
+from .database import get_db
+
+router = APIRouter(prefix="/worklist", tags=["worklist"])
+
+
+@router.get("/top", response_model=List[schemas.WorklistEntryRead])
+def top_debtors(
+    k: int = Query(20, ge=1, le=1000),
+    include_claimed: bool = False,
+    db: Session = Depends(get_db),
+):
+    """The highest-priority debtors, unclaimed ones only unless `include_claimed`."""
+    return worklist.top(db, k, include_claimed=include_claimed)
+
+
+@router.post("/claim", response_model=List[schemas.WorklistEntryRead])
+def claim_debtors(request: schemas.WorklistClaimRequest, db: Session = Depends(get_db)):
+    """Claim the next `k` debtors for a collector; no two collectors get the same debtor."""
+    if request.k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1")
+    ttl = worklist.CLAIM_TTL_SECONDS if request.ttl_seconds is None else request.ttl_seconds
+    return worklist.claim(db, request.collector, request.k, ttl_seconds=ttl)
+
+
+@router.post("/release", response_model=schemas.WorklistReleaseResponse)
+def release_debtors(request: schemas.WorklistReleaseRequest, db: Session = Depends(get_db)):
+    """Return a collector's claimed debtors to the worklist."""
+    return schemas.WorklistReleaseResponse(released=worklist.release(db, request.collector, request.user_ids))
+
+
+@router.post("/rebuild", response_model=schemas.WorklistRebuildResponse)
+def rebuild_worklist(db: Session = Depends(get_db)):
+    """Re-score every user (run daily, since overdue days move with the calendar)."""
+    return schemas.WorklistRebuildResponse(**worklist.rebuild(db))
+
+
+@router.get("/{user_id}", response_model=schemas.WorklistEntryRead)
+def get_worklist_entry(user_id: int, db: Session = Depends(get_db)):
+    entry = db.get(models.WorklistEntry, user_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="User is not on the worklist")
+    return entry
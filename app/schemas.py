@@ -9,6 +9,7 @@ from pydantic import BaseModel, Field, ConfigDict
 StatusLiteral = Literal["pending", "ongoing", "finished", "archived"]
 OwnerTypeLiteral = Literal["user", "group"]
 BlockTypeLiteral = Literal["action", "decision"]
+ExecutionAnchorLiteral = Literal["execution", "due_date"]
 
 
 # ---- User & Group Schemas ----
@@ -57,17 +58,54 @@ class GroupCreate(BaseModel):
     user_ids: List[int] = Field(default_factory=list)
 
 
+class GroupMembersUpdate(BaseModel):
+    user_ids: List[int]
+
+
+class GroupMembershipResponse(BaseModel):
+    group_id: int
+    added: int = 0
+    removed: int = 0
+    member_count: int
+
+
 class GroupUpdateStatus(BaseModel):
     status: StatusLiteral
 
 
+class GroupRuleCondition(BaseModel):
+    field: str  # status, remaining, days_overdue, preferred_contact or a details key
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte", "in", "not_in", "exists"] = "eq"
+    value: Any = None
+
+
+class GroupRule(BaseModel):
+    all: List[GroupRuleCondition] = Field(default_factory=list)
+    any: List[GroupRuleCondition] = Field(default_factory=list)
+
+
+class DynamicGroupCreate(BaseModel):
+    name: str
+    rule: GroupRule
+
+
 class GroupRead(GroupBase):
     id: int
+    rule: Optional[Dict[str, Any]] = None  # set for rule-based groups
 
     # Support both Pydantic v1 and v2
     model_config = ConfigDict(from_attributes=True)
 
 
+class DynamicGroupRead(GroupRead):
+    member_count: int
+    refreshed_on: Optional[date] = None
+
+
+class DynamicGroupRefreshResponse(BaseModel):
+    groups: int  # rule-based groups re-evaluated in full
+
+
 # ---- Strategy Schemas ----
 
 
@@ -123,20 +161,291 @@ class StrategyCreate(StrategyBase):
 class StrategyRead(StrategyBase):
     id: int
     executed: bool
+    version: int = 1
 
     # Support both Pydantic v1 and v2
     model_config = ConfigDict(from_attributes=True)
 
 
+class StrategyVersionRead(BaseModel):
+    id: int
+    version: int
+    prompt: Optional[str] = None
+    executed: bool
+    timeline_hash: Optional[str] = None
+    created_at: Optional[datetime] = None
+    latest: bool = False
+
+
+class StrategyTimelineChange(BaseModel):
+    op: Literal["added", "removed", "changed"]
+    path: str  # "<timing>", "<timing>/<block index>" or "<timing>/<block index>/<field>"
+    old: Optional[Any] = None
+    new: Optional[Any] = None
+
+
+class StrategyVersionDiff(BaseModel):
+    from_version: int
+    to_version: int
+    identical: bool
+    changes: List[StrategyTimelineChange]
+
+
 class StrategyExecuteResponse(BaseModel):
     id: int
     executed: bool
     user_status: Optional[StatusLiteral] = None
     group_status: Optional[StatusLiteral] = None
+    execution_id: Optional[int] = None
+    members_updated: Optional[int] = None  # members whose status was set (members=true)
+    member_executions: Optional[int] = None  # per-member executions started (members=true)
+
+
+class StrategyExecutionRead(BaseModel):
+    id: int
+    strategy_id: int
+    owner_type: OwnerTypeLiteral
+    owner_id: int
+    anchor: ExecutionAnchorLiteral
+    anchor_date: date
+    status: Literal["active", "completed", "cancelled"]
+    current_timing: Optional[str] = None
+    next_due_at: Optional[datetime] = None
+    columns_done: int
+    columns_expired: int
+    last_decision: Optional[Dict[str, Any]] = None
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class SchedulerTickResponse(BaseModel):
+    now: datetime
+    executions: int  # executions advanced
+    blocks: int  # blocks that fell due
+    expired: int  # columns skipped because their window had closed
+    completed: int
+    decisions: int  # decision blocks evaluated
+    routed: int  # executions sent to a decision's next_timing column
+
+
+class CommunicationEventCreate(BaseModel):
+    owner_type: OwnerTypeLiteral = "user"
+    owner_id: int
+    direction: Literal["outbound", "inbound"] = "inbound"
+    channel: Optional[str] = None
+    outcome: Optional[str] = None  # e.g. replied, promised_payment, disputed
+    detail: Optional[str] = None
+    message_id: Optional[int] = None
+    occurred_at: Optional[datetime] = None
+
+
+class CommunicationEventRead(BaseModel):
+    id: int
+    owner_type: str
+    owner_id: int
+    direction: str
+    channel: Optional[str] = None
+    outcome: Optional[str] = None
+    detail: Optional[str] = None
+    message_id: Optional[int] = None
+    occurred_at: datetime
+
+
+class CommunicationSummaryRead(BaseModel):
+    attempts: int
+    responses: int
+    last_attempt_at: Optional[datetime] = None
+    last_response_at: Optional[datetime] = None
+    last_channel: Optional[str] = None
+    recent: List[Dict[str, Any]] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class CommunicationHistory(BaseModel):
+    summary: Optional[CommunicationSummaryRead] = None
+    events: List[CommunicationEventRead]
+
+
+class CommunicationRecordResponse(BaseModel):
+    recorded: int
+
+
+class CommunicationRetentionResponse(BaseModel):
+    dropped: List[str]
+    partitions: Dict[str, int]  # remaining partitions and their row counts
+
+
+class DispatchChannelStats(BaseModel):
+    sent: int
+    retried: int  # sends that failed and were rescheduled
+    failed: int  # messages given up on
+    batches: int
+    in_flight: int
+    messages_per_second: Optional[float] = None
+
+
+class DispatchDrainResponse(BaseModel):
+    channels: Dict[str, DispatchChannelStats]
+
+
+class ReagingResponse(BaseModel):
+    users: int
+    updated: int  # users whose overdue days, flag or status changed
+    ongoing: int  # pending users moved to ongoing
+    finished: int
+    archived: int
+    worklist_removed: int
+    groups: int  # rule-based groups refreshed
+
+
+class WorklistEntryRead(BaseModel):
+    user_id: int
+    score: float
+    remaining: float
+    days_overdue: Optional[int] = None
+    days_since_payment: Optional[int] = None
+    stage: int
+    claimed_by: Optional[str] = None
+    claim_expires_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+
+class WorklistClaimRequest(BaseModel):
+    collector: str
+    k: int = 10
+    ttl_seconds: Optional[float] = None  # defaults to worklist.CLAIM_TTL_SECONDS
+
+
+class WorklistReleaseRequest(BaseModel):
+    collector: str
+    user_ids: Optional[List[int]] = None  # all of the collector's claims when omitted
+
+
+class WorklistReleaseResponse(BaseModel):
+    released: int
+
+
+class WorklistRebuildResponse(BaseModel):
+    scored: int
+    removed: int
 
 
 class AIGenerateRequest(BaseModel):
     prompt: Optional[str] = None
+    use_cache: bool = True  # set False to bypass the LLM response cache
+
+
+class StrategyBatchRequest(BaseModel):
+    """Generate strategies for many owners; either list `owner_ids` or filter."""
+
+    prompt: Optional[str] = None
+    owner_type: OwnerTypeLiteral = "user"
+    owner_ids: Optional[List[int]] = None
+    status: Optional[StatusLiteral] = None  # filter when owner_ids is omitted
+    group_id: Optional[int] = None  # members of this group (user owners only)
+    concurrency: int = Field(8, ge=1, le=64)
+    requests_per_minute: Optional[int] = Field(None, ge=1)
+    tokens_per_minute: Optional[int] = Field(None, ge=1)
+    chunk_size: int = Field(200, ge=1, le=5000)
+    owner_timeout_seconds: float = Field(60.0, gt=0)
+    use_cache: bool = True
+
+
+class StrategyBatchJobRead(BaseModel):
+    id: int
+    status: str
+    owner_type: OwnerTypeLiteral
+    prompt: Optional[str] = None
+    total: int
+    processed: int
+    ai_generated: int
+    cached: int
+    fallback: int
+    failed: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class StrategySegmentRead(BaseModel):
+    id: int
+    key: str
+    amount_band: str
+    overdue_band: str
+    preferred_contact: str
+    service: str
+    member_count: int
+    prompt: Optional[str] = None
+    source: Optional[str] = None
+    version: int
+    timeline: Optional[List[StrategyTimelineColumn]] = None
+    updated_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class SegmentRefreshRequest(BaseModel):
+    prompt: Optional[str] = None
+    regenerate: bool = False  # regenerate every segment's timeline
+    full: bool = False  # re-segment all users, not just changed ones
+    use_cache: bool = True
+
+
+class SegmentRefreshResponse(BaseModel):
+    checked: int  # users whose segment was recomputed
+    added: int  # users segmented for the first time
+    moved: int  # users that changed segment
+    generated: int  # segment timelines (re)generated
+    llm_calls: int
+    assigned: int  # user strategies written
+    segments: int  # populated segments
+
+
+class StrategyTemplateCreate(BaseModel):
+    """A template timeline; strings may use placeholders like "{amount}"."""
+
+    name: str
+    description: Optional[str] = None
+    timeline: List[Dict[str, Any]]
+
+
+class StrategyTemplateRead(BaseModel):
+    id: int
+    name: str
+    version: int
+    description: Optional[str] = None
+    timeline: List[Dict[str, Any]]
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class TemplateApplyRequest(BaseModel):
+    """Apply a template by id, or by name (latest version unless given)."""
+
+    template_id: Optional[int] = None
+    name: Optional[str] = None
+    version: Optional[int] = None
+    owner_type: OwnerTypeLiteral = "user"
+    owner_ids: Optional[List[int]] = None
+    status: Optional[StatusLiteral] = None  # filter when owner_ids is omitted
+    group_id: Optional[int] = None  # members of this group (user owners only)
+    prompt: Optional[str] = None  # stored on the strategies; defaults to the template ref
+
+
+class TemplateApplyResponse(BaseModel):
+    template_id: int
+    name: str
+    version: int
+    applied: int
+    created: int
+    updated: int
 
 
 class BlockContentAIGenerateRequest(BaseModel):
@@ -144,6 +453,7 @@ class BlockContentAIGenerateRequest(BaseModel):
 
     block: StrategyBlock
     prompt: Optional[str] = None
+    use_cache: bool = True  # set False to bypass the LLM response cache
 
 
 class BlockContentAIResponse(BaseModel):
@@ -152,6 +462,25 @@ class BlockContentAIResponse(BaseModel):
     content: str
 
 
+class TimelineContentAIGenerateRequest(BaseModel):
+    """Request body for filling every action block of a timeline.
+
+    The timeline is taken from `timeline`, else from `strategy_id`, else from
+    the owner's latest strategy.
+    """
+
+    timeline: Optional[List[StrategyTimelineColumn]] = None
+    strategy_id: Optional[int] = None
+    prompt: Optional[str] = None
+    only_empty: bool = False  # keep blocks that already have content
+    use_cache: bool = True
+
+
+class TimelineContentAIResponse(BaseModel):
+    timeline: List[StrategyTimelineColumn]
+    generated: int  # number of action blocks whose content was filled
+
+
 # ---- Ingestion Schemas ----
 
 
@@ -185,8 +514,82 @@ class AnalyticsResponse(BaseModel):
     timeline_data: List[Dict[str, Any]] = Field(default_factory=list)  # Payment timeline
 
 
+class GroupAnalytics(BaseModel):
+    group_id: int
+    name: str
+    status: StatusLiteral
+    member_count: int
+    total_amount_owed: float = 0.0
+    total_amount_collected: float = 0.0
+    total_remaining: float = 0.0
+    counts_by_status: Dict[StatusLiteral, int] = Field(default_factory=dict)
+    avg_overdue_days: float = 0.0
+
+
+class AgingBucketTotals(BaseModel):
+    counts: List[int]
+    balances: List[float]
+
+
+class GroupAging(AgingBucketTotals):
+    group_id: Optional[int] = None  # None for users without a group
+
+
+class UndatedBalance(BaseModel):
+    count: int = 0
+    balance: float = 0.0
+
+
+class AgingReportResponse(BaseModel):
+    as_of: date
+    buckets: List[str]  # e.g. ["0-30", "31-60", "61-90", "91+"]
+    total: AgingBucketTotals
+    by_status: Dict[str, AgingBucketTotals] = Field(default_factory=dict)
+    by_group: List[GroupAging] = Field(default_factory=list)
+    undated: UndatedBalance = Field(default_factory=UndatedBalance)
+
+
 class PaymentCreate(BaseModel):
     amount: float
     date: str  # ISO date string YYYY-MM-DD
     installment_number: Optional[int] = None
     notes: Optional[str] = None
+
+
+# ---- Reconciliation Schemas ----
+
+
+class ReconciliationBatchRead(BaseModel):
+    id: int
+    filename: Optional[str] = None
+    created_at: datetime
+    total_lines: int
+    auto_posted: int
+    queued: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReconciliationItemRead(BaseModel):
+    id: int
+    batch_id: int
+    line_number: int
+    payer_name: Optional[str] = None
+    amount: float
+    date: Optional[str] = None
+    reference: Optional[str] = None
+    suggested_user_id: Optional[int] = None
+    installment_number: Optional[int] = None
+    score: float
+    reason: Optional[str] = None
+    status: str
+    resolved_user_id: Optional[int] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReconciliationResolveRequest(BaseModel):
+    """Post a queued statement line to a user; defaults to the suggested match."""
+
+    user_id: Optional[int] = None
+    installment_number: Optional[int] = None
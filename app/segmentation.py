@@ -0,0 +1,274 @@
+"""Debtor segmentation for strategy reuse.
+
+Debtors are grouped by amount band, days-overdue band, preferred channel and
+service. One timeline is generated per segment and shared by every member's
+strategy (stored once, with each member's contact details applied on read),
+so a refresh costs one model call per segment instead of one per user.
+
+Refreshes are incremental. A membership row remembers the `users.version`
+it was computed from and the day its overdue band runs out, so only users
+that changed, are new, or crossed a band boundary are re-segmented, and only
+members whose segment moved or got a new timeline get their strategy
+rewritten.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from bisect import bisect_left
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from . import crud, models, portfolio
+
+
+Timeline = List[Dict[str, Any]]
+GenerateFn = Callable[..., Awaitable[Tuple[Timeline, str]]]
+
+AMOUNT_BAND_EDGES = (5000, 20000, 100000)
+OVERDUE_BAND_EDGES = portfolio.DEFAULT_AGING_EDGES
+
+DEFAULT_PROMPT = "Create balanced collection strategy"
+
+# Users read and strategies written per transaction.
+CHUNK_SIZE = 1000
+
+
+def amount_band(details: Dict[str, Any]) -> str:
+    amount = details.get("remaining_amount")
+    if not isinstance(amount, (int, float)):
+        amount = details.get("amount_owed")
+    if not isinstance(amount, (int, float)):
+        return "unknown"
+    idx = bisect_left(AMOUNT_BAND_EDGES, amount)
+    if idx == len(AMOUNT_BAND_EDGES):
+        return f"{AMOUNT_BAND_EDGES[-1]}+"
+    lower = AMOUNT_BAND_EDGES[idx - 1] if idx else 0
+    return f"{lower}-{AMOUNT_BAND_EDGES[idx]}"
+
+
+def overdue_band(due: Optional[date], today: date) -> Tuple[str, Optional[date]]:
+    """Days-overdue band label and the first day the label no longer applies."""
+    if due is None:
+        return "unknown", None
+    days = (today - due).days
+    if days < 0:
+        return "not_due", due
+    labels = portfolio.bucket_labels(OVERDUE_BAND_EDGES)
+    idx = bisect_left(OVERDUE_BAND_EDGES, days)
+    if idx == len(OVERDUE_BAND_EDGES):
+        return labels[idx], None
+    return labels[idx], due + timedelta(days=OVERDUE_BAND_EDGES[idx] + 1)
+
+
+def segment_features(details: Dict[str, Any], today: date) -> Tuple[Dict[str, str], Optional[date]]:
+    overdue, expires_on = overdue_band(crud._parse_due_date(details.get("due_date")), today)
+    features = {
+        "amount_band": amount_band(details),
+        "overdue_band": overdue,
+        "preferred_contact": str(details.get("preferred_contact") or "any").strip().lower(),
+        "service": str(details.get("service") or "any").strip().lower(),
+    }
+    return features, expires_on
+
+
+def segment_key(features: Dict[str, str]) -> str:
+    return "|".join(
+        f"{name}={features[name]}" for name in ("amount_band", "overdue_band", "preferred_contact", "service")
+    )
+
+
+def describe(segment: models.StrategySegment) -> str:
+    overdue = {"not_due": "not yet due", "unknown": "unknown due date"}.get(
+        segment.overdue_band, f"{segment.overdue_band} days overdue"
+    )
+    parts = [f"amount band {segment.amount_band}", overdue]
+    if segment.preferred_contact != "any":
+        parts.append(f"prefers {segment.preferred_contact}")
+    if segment.service != "any":
+        parts.append(f"service {segment.service}")
+    return ", ".join(parts)
+
+
+def _profile_details(segment: models.StrategySegment) -> Dict[str, Any]:
+    """Stand-in debtor details describing the whole segment to the model."""
+    details: Dict[str, Any] = {"amount_owed": segment.amount_band}
+    if segment.preferred_contact != "any":
+        details["preferred_contact"] = segment.preferred_contact
+    if segment.service != "any":
+        details["service"] = segment.service
+    return details
+
+
+def refresh_memberships(db: Session, *, today: Optional[date] = None, full: bool = False) -> Dict[str, int]:
+    """Re-segment new, changed and band-expired users (everyone if `full`)."""
+    today = today or date.today()
+    membership = models.SegmentMembership
+
+    stmt = select(
+        models.User.id, models.User.version, models.User.details, membership.segment_id
+    ).outerjoin(membership, membership.user_id == models.User.id)
+    if not full:
+        stmt = stmt.where(
+            or_(
+                membership.user_id.is_(None),
+                membership.user_version != models.User.version,
+                membership.band_expires_on <= today,
+            )
+        )
+
+    rows: List[Tuple[int, int, str, Optional[int], Optional[date], Dict[str, str]]] = []
+    for user_id, version, details, current_segment in db.execute(stmt.execution_options(yield_per=CHUNK_SIZE)):
+        features, expires_on = segment_features(details or {}, today)
+        rows.append((user_id, version, segment_key(features), current_segment, expires_on, features))
+
+    segments = {s.key: s for s in db.query(models.StrategySegment)}
+    for _, _, key, _, _, features in rows:
+        if key not in segments:
+            segments[key] = models.StrategySegment(key=key, **features)
+            db.add(segments[key])
+    db.flush()
+
+    inserts: List[Dict[str, Any]] = []
+    updates: List[Dict[str, Any]] = []
+    moved = 0
+    for user_id, version, key, current_segment, expires_on, _ in rows:
+        mapping = {
+            "user_id": user_id,
+            "segment_id": segments[key].id,
+            "user_version": version,
+            "band_expires_on": expires_on,
+        }
+        if current_segment is None:
+            inserts.append({**mapping, "assigned_version": None})
+        else:
+            if current_segment != mapping["segment_id"]:
+                mapping["assigned_version"] = None
+                moved += 1
+            updates.append(mapping)
+
+    for start in range(0, len(inserts), CHUNK_SIZE):
+        db.bulk_insert_mappings(membership, inserts[start:start + CHUNK_SIZE])
+    for start in range(0, len(updates), CHUNK_SIZE):
+        db.bulk_update_mappings(membership, updates[start:start + CHUNK_SIZE])
+
+    counts = dict(
+        db.query(membership.segment_id, func.count(membership.user_id)).group_by(membership.segment_id)
+    )
+    for segment in segments.values():
+        segment.member_count = counts.get(segment.id, 0)
+    db.commit()
+
+    return {"checked": len(rows), "added": len(inserts), "moved": moved}
+
+
+async def generate_segment_timelines(
+    db: Session,
+    *,
+    generate: GenerateFn,
+    prompt: Optional[str] = None,
+    regenerate: bool = False,
+    use_cache: bool = True,
+    concurrency: int = 8,
+) -> Dict[str, int]:
+    """Generate a timeline for every populated segment that needs one.
+
+    A segment needs one when it has none yet, when it was made for a
+    different prompt, or when `regenerate` is set.
+    """
+    prompt = prompt or DEFAULT_PROMPT
+    pending = [
+        segment
+        for segment in db.query(models.StrategySegment).filter(models.StrategySegment.member_count > 0)
+        if regenerate or segment.timeline is None or segment.prompt != prompt
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(segment: models.StrategySegment) -> Tuple[Timeline, str]:
+        async with semaphore:
+            segment_prompt = f"{prompt}\nDebtor segment: {describe(segment)}"
+            return await generate(_profile_details(segment), segment_prompt, use_cache=use_cache)
+
+    results = await asyncio.gather(*(run(segment) for segment in pending))
+    sources: Dict[str, int] = {}
+    for segment, (timeline, source) in zip(pending, results):
+        segment.timeline = timeline
+        segment.prompt = prompt
+        segment.source = source
+        segment.version += 1
+        sources[source] = sources.get(source, 0) + 1
+    db.commit()
+    return {"generated": len(pending), "llm_calls": sources.get("ai", 0)}
+
+
+def assign_segment_strategies(db: Session) -> int:
+    """Point members whose strategy is out of date at their segment's timeline.
+
+    All members of a segment share one stored timeline; their own contact
+    details are applied when the strategy is read.
+    """
+    membership = models.SegmentMembership
+    segment = models.StrategySegment
+    stale = (
+        db.query(membership.user_id, membership.segment_id)
+        .join(segment, segment.id == membership.segment_id)
+        .filter(segment.timeline.isnot(None))
+        .filter(or_(membership.assigned_version.is_(None), membership.assigned_version != segment.version))
+        .order_by(membership.user_id)
+        .all()
+    )
+    segments = {s.id: s for s in db.query(segment).filter(segment.id.in_({sid for _, sid in stale}))}
+
+    for start in range(0, len(stale), CHUNK_SIZE):
+        chunk = dict(stale[start:start + CHUNK_SIZE])
+        by_segment: Dict[int, Dict[int, Timeline]] = {}
+        for user_id, segment_id in chunk.items():
+            by_segment.setdefault(segment_id, {})[user_id] = segments[segment_id].timeline
+        db.bulk_update_mappings(
+            membership,
+            [
+                {"user_id": user_id, "assigned_version": segments[segment_id].version}
+                for user_id, segment_id in chunk.items()
+            ],
+        )
+        for segment_id, timelines in by_segment.items():
+            crud.bulk_save_strategies(
+                db,
+                owner_type="user",
+                timelines=timelines,
+                prompt=segments[segment_id].prompt,
+                apply_contacts=True,
+            )
+        db.commit()
+
+    return len(stale)
+
+
+async def refresh(
+    db: Session,
+    *,
+    generate: GenerateFn,
+    prompt: Optional[str] = None,
+    regenerate: bool = False,
+    full: bool = False,
+    use_cache: bool = True,
+    today: Optional[date] = None,
+) -> Dict[str, int]:
+    """Re-segment, generate per-segment timelines and assign them to members.
+
+    Re-segmenting and assigning read and write every changed member, so they
+    run in a worker thread and the event loop keeps serving requests. The
+    session is used by one step at a time.
+    """
+    stats = await asyncio.to_thread(refresh_memberships, db, today=today, full=full)
+    stats.update(
+        await generate_segment_timelines(
+            db, generate=generate, prompt=prompt, regenerate=regenerate, use_cache=use_cache
+        )
+    )
+    stats["assigned"] = await asyncio.to_thread(assign_segment_strategies, db)
+    stats["segments"] = db.query(models.StrategySegment).filter(models.StrategySegment.member_count > 0).count()
+    return stats
@@ -0,0 +1,215 @@
+"""Portfolio-wide strategy generation jobs.
+
+A job generates a strategy for every owner it covers with bounded
+concurrency: a pool of workers pulls owners from a queue, each model call
+waits on the job's request/token rate limiter, and finished timelines are
+written in chunked transactions that also update the job's progress
+counters. Database work runs in worker threads, off the event loop. An
+owner whose generation raises or times out gets the deterministic fallback
+timeline so the rest of the batch keeps moving.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from sqlalchemy.orm import Session
+
+from . import crud, dynamic_groups, llm_client, models, schemas
+from .database import SessionLocal
+
+
+Timeline = List[Dict[str, Any]]
+GenerateFn = Callable[..., Awaitable[Tuple[Timeline, str]]]
+FallbackFn = Callable[[Dict[str, Any], str], Timeline]
+T = TypeVar("T")
+
+DEFAULT_PROMPT = "Create balanced collection strategy"
+
+
+def resolve_owner_ids(
+    db: Session,
+    body: Union[schemas.StrategyBatchRequest, schemas.TemplateApplyRequest],
+) -> List[int]:
+    """Owner ids covered by a bulk request, validated against the database."""
+    if body.owner_type == "group":
+        q = db.query(models.Group.id)
+        if body.owner_ids is not None:
+            q = q.filter(models.Group.id.in_(body.owner_ids))
+        if body.status:
+            q = q.filter(models.Group.status == body.status)
+        return [row[0] for row in q.order_by(models.Group.id)]
+
+    q = db.query(models.User.id)
+    if body.owner_ids is not None:
+        q = q.filter(models.User.id.in_(body.owner_ids))
+    if body.status:
+        q = q.filter(models.User.status == body.status)
+    if body.group_id is not None:
+        q = q.filter(dynamic_groups.members_clause(db, body.group_id))
+    return [row[0] for row in q.order_by(models.User.id)]
+
+
+def create_job(db: Session, *, body: schemas.StrategyBatchRequest, owner_ids: List[int]) -> models.StrategyBatchJob:
+    job = models.StrategyBatchJob(
+        owner_type=body.owner_type,
+        owner_ids=owner_ids,
+        prompt=body.prompt or DEFAULT_PROMPT,
+        total=len(owner_ids),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _load_details(db: Session, owner_type: str, owner_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    if owner_type == "group":
+        counts = dynamic_groups.member_counts(db, owner_ids)
+        return {
+            gid: {"group_name": name, "members": counts.get(gid, 0)}
+            for gid, name in db.query(models.Group.id, models.Group.name).filter(models.Group.id.in_(owner_ids))
+        }
+    return {
+        uid: details or {}
+        for uid, details in db.query(models.User.id, models.User.details).filter(models.User.id.in_(owner_ids))
+    }
+
+
+async def _in_session(fn: Callable[..., T], *args: Any) -> T:
+    """Run `fn(db, *args)` with its own session in a worker thread, off the event loop."""
+
+    def call() -> T:
+        with SessionLocal() as db:
+            return fn(db, *args)
+
+    return await asyncio.to_thread(call)
+
+
+def _start(db: Session, job_id: int) -> Optional[Tuple[str, str, List[int]]]:
+    """Mark the job running; returns its owner type, prompt and owner ids."""
+    job = db.get(models.StrategyBatchJob, job_id)
+    if job is None:
+        return None
+    job.status = "running"
+    job.started_at = datetime.utcnow()
+    db.commit()
+    return job.owner_type, job.prompt or DEFAULT_PROMPT, list(job.owner_ids or [])
+
+
+def _save(
+    db: Session,
+    job_id: int,
+    owner_type: str,
+    prompt: str,
+    timelines: Dict[int, Timeline],
+    counts: Dict[str, int],
+) -> None:
+    """Save a chunk of timelines and the job's progress in one transaction."""
+    crud.bulk_save_strategies(db, owner_type=owner_type, timelines=timelines, prompt=prompt)
+    job = db.get(models.StrategyBatchJob, job_id)
+    job.processed += len(timelines)
+    job.ai_generated = counts["ai"]
+    job.cached = counts["cache"]
+    job.fallback = counts["default"]
+    job.failed = counts["failed"]
+    db.commit()
+
+
+def _finish(db: Session, job_id: int, error: Optional[str]) -> None:
+    job = db.get(models.StrategyBatchJob, job_id)
+    job.status = "failed" if error is not None else "completed"
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    db.commit()
+
+
+async def run_job(
+    job_id: int,
+    *,
+    generate: GenerateFn,
+    fallback: FallbackFn,
+    concurrency: int = 8,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    chunk_size: int = 200,
+    owner_timeout_seconds: float = 60.0,
+    use_cache: bool = True,
+) -> None:
+    """Run a queued job to completion, recording progress on the job row.
+
+    Database reads and writes run in worker threads, each with its own
+    session, so the event loop keeps serving requests during a large job.
+    Every owner lands in exactly one of the `ai`, `cache`, `default` (the
+    generator fell back) and `failed` (it raised or timed out) counts.
+    """
+    started = await _in_session(_start, job_id)
+    if started is None:
+        return
+    owner_type, prompt, owner_ids = started
+
+    queue: "asyncio.Queue[Optional[Tuple[int, Dict[str, Any]]]]" = asyncio.Queue(maxsize=concurrency * 2)
+    buffer: Dict[int, Timeline] = {}
+    counts = {"ai": 0, "cache": 0, "default": 0, "failed": 0}
+    save_lock = asyncio.Lock()
+
+    async def flush() -> None:
+        if not buffer:
+            return
+        # Take the chunk and its counts before awaiting; the lock keeps saves in order.
+        timelines, snapshot = dict(buffer), dict(counts)
+        buffer.clear()
+        async with save_lock:
+            await _in_session(_save, job_id, owner_type, prompt, timelines, snapshot)
+
+    async def produce() -> None:
+        for start in range(0, len(owner_ids), chunk_size):
+            chunk = owner_ids[start:start + chunk_size]
+            details = await _in_session(_load_details, owner_type, chunk)
+            for owner_id in chunk:
+                if owner_id in details:
+                    await queue.put((owner_id, details[owner_id]))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            owner_id, details = item
+            try:
+                timeline, source = await asyncio.wait_for(
+                    generate(details, prompt, use_cache=use_cache), timeout=owner_timeout_seconds
+                )
+            except Exception:
+                timeline, source = fallback(details, prompt), "failed"
+            counts[source] = counts.get(source, 0) + 1
+            buffer[owner_id] = timeline
+            if len(buffer) >= chunk_size:
+                await flush()
+
+    limiter = None
+    if requests_per_minute or tokens_per_minute:
+        limiter = llm_client.RateLimiter(
+            requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute
+        )
+
+    error: Optional[str] = None
+    tasks: List["asyncio.Task[None]"] = []
+    try:
+        with llm_client.rate_limited(limiter):
+            tasks = [asyncio.create_task(produce())]
+            tasks += [asyncio.create_task(work()) for _ in range(concurrency)]
+            await asyncio.gather(*tasks)
+        await flush()
+    except Exception as exc:
+        error = str(exc)
+    finally:
+        # gather leaves the other tasks running when one fails; stop them before the job is finished.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await _in_session(_finish, job_id, error)
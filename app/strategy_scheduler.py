@@ -0,0 +1,519 @@
+"""Runs executed strategies' timeline columns when they fall due.
+
+Each column's `timing` ("Day 1-7", "Day 90+", "Week 2", "Month 3") is
+compiled to a window of days counted from an anchor date: the day the
+strategy was executed, or the user's `due_date`. Day 1 is the anchor day.
+Every block in a column is due on the window's first day; a column whose
+window has already closed when it is reached is skipped as expired.
+
+An execution only tracks its next due column, and `strategy_executions` is
+indexed on `(status, next_due_at)`, so that index acts as the scheduler's
+priority queue: a tick reads due executions in `next_due_at` order in
+batches and its cost grows with the due work, not with the number of
+active strategies. Columns with an unrecognised timing are not scheduled.
+
+Decision blocks due in a batch are evaluated together by `decision_engine`.
+The chosen output's `next_timing` becomes the execution's next column; a
+column holding a decision stops catch-up so later columns wait for it.
+Users whose executions advanced are re-scored on the `worklist`.
+
+The clock is pluggable: tests and simulations install a `SimulatedClock`
+with `set_clock` and advance it instead of waiting. With
+`SCHEDULER_INTERVAL` set (seconds), `main.py` runs `run_forever` in the
+background.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, func, insert, literal, null, select, update
+from sqlalchemy.orm import Session
+
+from . import crud, decision_engine, dynamic_groups, models, worklist
+from .database import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+Timeline = List[Dict[str, Any]]
+
+ANCHORS = ("execution", "due_date")
+
+# Executions read and advanced per transaction.
+BATCH_SIZE = 1000
+
+_TIMING = re.compile(r"^\s*(day|week|month)s?\s*(\d+)\s*(?:(?:-|–|to)\s*(\d+)|(\+))?\s*$", re.IGNORECASE)
+_UNIT_DAYS = {"day": 1, "week": 7, "month": 30}
+
+
+class SystemClock:
+    def now(self) -> datetime:
+        return datetime.utcnow()
+
+
+class SimulatedClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self, start: datetime):
+        self._now = start
+
+    def now(self) -> datetime:
+        return self._now
+
+    def advance(self, **delta: float) -> datetime:
+        self._now += timedelta(**delta)
+        return self._now
+
+
+_clock: Any = SystemClock()
+
+
+def get_clock() -> Any:
+    return _clock
+
+
+def set_clock(clock: Optional[Any]) -> None:
+    """Install `clock` (anything with `now()`); None restores the system clock."""
+    global _clock
+    _clock = clock or SystemClock()
+
+
+@dataclass
+class Window:
+    column: int  # index of the column in the timeline
+    timing: str
+    first_day: int
+    last_day: Optional[int]  # None for open-ended windows such as "Day 90+"
+
+
+@dataclass
+class DueBlock:
+    execution_id: int
+    strategy_id: int
+    owner_type: str
+    owner_id: int
+    timing: str
+    column: int
+    index: int  # position of the block in its column
+    block: Dict[str, Any]
+    started_at: datetime  # when the execution started
+
+
+DueHandler = Callable[[Session, List[DueBlock]], None]
+
+
+@lru_cache(maxsize=1024)
+def parse_timing(timing: str) -> Optional[Tuple[int, Optional[int]]]:
+    """(first day, last day or None if open-ended), or None if not a schedule."""
+    match = _TIMING.match(timing or "")
+    if not match:
+        return None
+    unit = _UNIT_DAYS[match.group(1).lower()]
+    first = int(match.group(2))
+    if first < 1:
+        return None
+    if match.group(4):
+        return (first - 1) * unit + 1, None
+    last = int(match.group(3)) if match.group(3) else first
+    if last < first:
+        return None
+    return (first - 1) * unit + 1, last * unit
+
+
+def compile_schedule(timeline: Timeline) -> List[Window]:
+    """Schedulable columns ordered by when they open (ties keep timeline order)."""
+    windows = []
+    for idx, column in enumerate(timeline or []):
+        timing = column.get("timing") or ""
+        days = parse_timing(timing)
+        if days is not None:
+            windows.append(Window(idx, timing, days[0], days[1]))
+    windows.sort(key=lambda w: w.first_day)
+    return windows
+
+
+def _opens_at(anchor_date: date, window: Window) -> datetime:
+    return datetime.combine(anchor_date + timedelta(days=window.first_day - 1), time.min)
+
+
+def _closes_at(anchor_date: date, window: Window) -> Optional[datetime]:
+    if window.last_day is None:
+        return None
+    return datetime.combine(anchor_date + timedelta(days=window.last_day), time.min)
+
+
+def _anchor_date(anchor: str, details: Dict[str, Any], today: date) -> date:
+    if anchor == "due_date":
+        due = crud._parse_due_date(details.get("due_date"))
+        if due is not None:
+            return due
+    return today
+
+
+def start_executions(
+    db: Session,
+    strategies: Sequence[models.Strategy],
+    *,
+    anchor: str = "execution",
+    now: Optional[datetime] = None,
+    commit: bool = True,
+) -> List[int]:
+    """Start executing `strategies`, replacing their owners' active executions.
+
+    Returns the new execution ids in the order of `strategies`.
+    """
+    if anchor not in ANCHORS:
+        raise ValueError(f"Unknown anchor {anchor!r}; expected one of {', '.join(ANCHORS)}")
+    if not strategies:
+        return []
+    now = now or _clock.now()
+    execution = models.StrategyExecution
+
+    details: Dict[int, Dict[str, Any]] = {}
+    if anchor == "due_date":
+        user_ids = [s.user_id for s in strategies if s.user_id is not None]
+        for start in range(0, len(user_ids), 500):
+            details.update(
+                db.query(models.User.id, models.User.details).filter(models.User.id.in_(user_ids[start:start + 500]))
+            )
+
+    by_owner_type: Dict[str, List[int]] = {}
+    rows: List[Dict[str, Any]] = []
+    schedules: Dict[Any, List[Window]] = {}
+    for strategy in strategies:
+        owner_type = strategy.owner_type()
+        owner_id = strategy.group_id if owner_type == "group" else strategy.user_id
+        by_owner_type.setdefault(owner_type, []).append(owner_id)
+
+        key = strategy.timeline_hash or ("strategy", strategy.id)
+        if key not in schedules:
+            schedules[key] = compile_schedule(strategy.timeline)
+        schedule = schedules[key]
+        anchor_date = _anchor_date(anchor, details.get(strategy.user_id) or {}, now.date())
+        rows.append(
+            {
+                "strategy_id": strategy.id,
+                "owner_type": owner_type,
+                "owner_id": owner_id,
+                "anchor": anchor,
+                "anchor_date": anchor_date,
+                "status": "active" if schedule else "completed",
+                "next_step": 0,
+                "next_due_at": _opens_at(anchor_date, schedule[0]) if schedule else None,
+                "started_at": now,
+                "updated_at": now,
+                "completed_at": None if schedule else now,
+            }
+        )
+
+    for owner_type, owner_ids in by_owner_type.items():
+        for start in range(0, len(owner_ids), 500):
+            db.execute(
+                update(execution)
+                .where(
+                    execution.status == "active",
+                    execution.owner_type == owner_type,
+                    execution.owner_id.in_(owner_ids[start:start + 500]),
+                )
+                .values(status="cancelled", next_due_at=None, updated_at=now)
+            )
+    ids = [
+        row[0]
+        for row in db.execute(insert(execution).returning(execution.id, sort_by_parameter_order=True), rows)
+    ]
+    if commit:
+        db.commit()
+    return ids
+
+
+def start_member_executions(
+    db: Session,
+    strategy: models.Strategy,
+    group_id: int,
+    *,
+    anchor: str = "execution",
+    now: Optional[datetime] = None,
+) -> int:
+    """Start a group strategy for each member of the group; the caller commits.
+
+    Members' active executions are cancelled and one execution per member
+    is inserted with `INSERT ... SELECT` over the group, so no member row is
+    loaded. Returns the number of executions started.
+    """
+    if anchor not in ANCHORS:
+        raise ValueError(f"Unknown anchor {anchor!r}; expected one of {', '.join(ANCHORS)}")
+    now = now or _clock.now()
+    execution, user = models.StrategyExecution, models.User
+    is_member = dynamic_groups.members_clause(db, group_id)
+    members = select(user.id).where(is_member)
+    db.execute(
+        update(execution)
+        .where(execution.status == "active", execution.owner_type == "user", execution.owner_id.in_(members))
+        .values(status="cancelled", next_due_at=None, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+    schedule = compile_schedule(strategy.timeline)
+    today = literal(now.date().isoformat())
+    if anchor == "due_date":
+        # Same fallback as _anchor_date: today when the due date is missing or invalid.
+        due = func.date(func.substr(func.json_extract(user.details, "$.due_date"), 1, 10))
+        anchor_date = func.coalesce(due, today)
+    else:
+        anchor_date = today
+    if schedule:
+        # Stored in the same text format SQLAlchemy uses for DateTime on SQLite.
+        first = func.datetime(anchor_date, f"+{schedule[0].first_day - 1} days").concat(".000000")
+        status, next_due_at, completed_at = "active", first, None
+    else:
+        status, next_due_at, completed_at = "completed", None, now
+    columns = {
+        "strategy_id": literal(strategy.id),
+        "owner_type": literal("user"),
+        "owner_id": user.id,
+        "anchor": literal(anchor),
+        "anchor_date": anchor_date,
+        "status": literal(status),
+        "next_step": literal(0),
+        "next_due_at": next_due_at if next_due_at is not None else null(),
+        "columns_done": literal(0),
+        "columns_expired": literal(0),
+        "started_at": literal(now, DateTime),
+        "updated_at": literal(now, DateTime),
+        "completed_at": literal(completed_at, DateTime) if completed_at else null(),
+    }
+    result = db.execute(
+        insert(execution).from_select(
+            list(columns), select(*(value.label(name) for name, value in columns.items())).where(is_member)
+        )
+    )
+    return result.rowcount
+
+
+def _advance(
+    execution: models.StrategyExecution,
+    schedule: List[Window],
+    timeline: Timeline,
+    now: datetime,
+    due: List[DueBlock],
+) -> None:
+    """Process every column of `execution` that is due at `now`."""
+    while execution.next_step < len(schedule):
+        window = schedule[execution.next_step]
+        decides = False
+        if _opens_at(execution.anchor_date, window) > now:
+            break
+        closes_at = _closes_at(execution.anchor_date, window)
+        if closes_at is not None and closes_at <= now:
+            execution.columns_expired += 1
+        else:
+            for idx, block in enumerate(timeline[window.column].get("blocks") or []):
+                due.append(
+                    DueBlock(
+                        execution_id=execution.id,
+                        strategy_id=execution.strategy_id,
+                        owner_type=execution.owner_type,
+                        owner_id=execution.owner_id,
+                        timing=window.timing,
+                        column=window.column,
+                        index=idx,
+                        block=block,
+                        started_at=execution.started_at,
+                    )
+                )
+            execution.columns_done += 1
+            execution.current_timing = window.timing
+            decides = any(b.get("block_type") == "decision" for b in timeline[window.column].get("blocks") or [])
+        execution.next_step += 1
+        if decides:
+            # Its decision may route elsewhere; later columns wait for the outcome.
+            break
+
+    if execution.next_step < len(schedule):
+        execution.next_due_at = _opens_at(execution.anchor_date, schedule[execution.next_step])
+    else:
+        execution.status = "completed"
+        execution.next_due_at = None
+        execution.completed_at = now
+
+
+def _progress(item: models.StrategyExecution, now: datetime) -> Dict[str, Any]:
+    return {
+        "id": item.id,
+        "anchor_date": item.anchor_date,
+        "status": item.status,
+        "next_step": item.next_step,
+        "next_due_at": item.next_due_at,
+        "current_timing": item.current_timing,
+        "columns_done": item.columns_done,
+        "columns_expired": item.columns_expired,
+        "last_decision": item.last_decision,
+        "completed_at": item.completed_at,
+        "updated_at": now,
+    }
+
+
+def _route(
+    execution: models.StrategyExecution,
+    schedule: List[Window],
+    decision: decision_engine.Decision,
+    due: DueBlock,
+    now: datetime,
+) -> bool:
+    """Apply a decision: record it and jump to its `next_timing` column, if any."""
+    execution.last_decision = {
+        "timing": due.timing,
+        "output": decision.output,
+        "condition": decision.condition,
+        "action": decision.action,
+        "next_timing": decision.next_timing,
+        "source": decision.source,
+        "decided_at": now.isoformat(),
+    }
+    target = (decision.next_timing or "").strip().lower()
+    step = next((i for i, w in enumerate(schedule) if w.timing.strip().lower() == target), None)
+    if step is None:
+        return False
+    window = schedule[step]
+    current = next(i for i, w in enumerate(schedule) if w.column == due.column)
+    closes_at = _closes_at(execution.anchor_date, window)
+    if step <= current:
+        # Going back restarts the timeline from that column tomorrow (not
+        # now, so a decision cannot loop on itself within one tick).
+        execution.anchor_date = now.date() + timedelta(days=1) - timedelta(days=window.first_day - 1)
+    elif closes_at is not None and closes_at <= now:
+        # A target whose window has closed opens today instead of expiring.
+        execution.anchor_date = now.date() - timedelta(days=window.first_day - 1)
+    execution.next_step = step
+    execution.next_due_at = _opens_at(execution.anchor_date, window)
+    execution.status = "active"
+    execution.completed_at = None
+    return True
+
+
+def tick(
+    db: Session,
+    *,
+    now: Optional[datetime] = None,
+    batch_size: int = BATCH_SIZE,
+    on_due: Optional[DueHandler] = None,
+    tie_breaker: Optional[decision_engine.TieBreaker] = None,
+) -> Dict[str, int]:
+    """Process every column due at `now`, `batch_size` executions per transaction.
+
+    Due decision blocks are evaluated together (see `decision_engine`) and
+    route their execution; `on_due` receives each batch's due action blocks
+    before the batch commits.
+    """
+    now = now or _clock.now()
+    execution = models.StrategyExecution
+    stats = {"executions": 0, "blocks": 0, "expired": 0, "completed": 0, "decisions": 0, "routed": 0}
+
+    while True:
+        batch = (
+            db.query(execution)
+            .filter(execution.status == "active", execution.next_due_at <= now)
+            .order_by(execution.next_due_at, execution.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        # Advanced detached and written back with one executemany UPDATE; the
+        # ORM would otherwise issue an UPDATE per row on SQLite.
+        for item in batch:
+            db.expunge(item)
+        strategies = {
+            s.id: s
+            for s in db.query(models.Strategy).filter(models.Strategy.id.in_({e.strategy_id for e in batch}))
+        }
+        schedules: Dict[Any, List[Window]] = {}
+        schedule_of: Dict[int, List[Window]] = {}
+        due: List[DueBlock] = []
+        for item in batch:
+            strategy = strategies[item.strategy_id]
+            key = strategy.timeline_hash or ("strategy", strategy.id)
+            if key not in schedules:
+                schedules[key] = compile_schedule(strategy.timeline)
+            schedule_of[item.id] = schedules[key]
+            expired = item.columns_expired
+            _advance(item, schedules[key], strategy.timeline, now, due)
+            stats["expired"] += item.columns_expired - expired
+
+        decisions = [d for d in due if d.block.get("block_type") == "decision"]
+        actions = [d for d in due if d.block.get("block_type") != "decision"]
+        if decisions:
+            by_id = {item.id: item for item in batch}
+            routed = set()
+            outcomes = decision_engine.decide(db, decisions, now=now, tie_breaker=tie_breaker)
+            for block, decision in zip(decisions, outcomes):
+                # The first decision in a column that routes wins.
+                if block.execution_id in routed:
+                    continue
+                item = by_id[block.execution_id]
+                if _route(item, schedule_of[item.id], decision, block, now):
+                    routed.add(item.id)
+            stats["decisions"] += len(decisions)
+            stats["routed"] += len(routed)
+        if on_due and actions:
+            on_due(db, actions)
+        db.execute(update(execution), [_progress(item, now) for item in batch])
+        advanced = {item.owner_id for item in batch if item.owner_type == "user"}
+        if advanced:
+            worklist.refresh_users(db, models.User.id.in_(advanced), today=now.date(), now=now)
+        stats["completed"] += sum(item.status == "completed" for item in batch)
+        db.commit()
+        stats["executions"] += len(batch)
+        stats["blocks"] += len(due)
+    return stats
+
+
+def next_due_at(db: Session) -> Optional[datetime]:
+    """When the earliest active execution falls due."""
+    execution = models.StrategyExecution
+    return db.query(func.min(execution.next_due_at)).filter(execution.status == "active").scalar()
+
+
+def _tick_once(
+    on_due: Optional[DueHandler],
+    tie_breaker: Optional[decision_engine.TieBreaker],
+) -> Tuple[Dict[str, int], Optional[datetime]]:
+    db = SessionLocal()
+    try:
+        return tick(db, on_due=on_due, tie_breaker=tie_breaker), next_due_at(db)
+    finally:
+        db.close()
+
+
+async def run_forever(interval: float, on_due: Optional[DueHandler] = None) -> None:
+    """Tick every `interval` seconds, or sooner when the next column falls due."""
+    while True:
+        try:
+            tie_breaker = None
+            if decision_engine.tie_breaker_enabled():
+                tie_breaker = decision_engine.llm_tie_breaker(asyncio.get_running_loop())
+            stats, upcoming = await asyncio.to_thread(_tick_once, on_due, tie_breaker)
+            if stats["executions"]:
+                logger.info("Strategy scheduler tick: %s", stats)
+        except Exception:
+            logger.exception("Strategy scheduler tick failed")
+            upcoming = None
+        delay = interval
+        if upcoming is not None:
+            delay = min(interval, max((upcoming - _clock.now()).total_seconds(), 0.0))
+        await asyncio.sleep(delay)
+
+
+def interval_from_env() -> float:
+    try:
+        return float(os.getenv("SCHEDULER_INTERVAL", "0"))
+    except ValueError:
+        return 0.0
@@ -0,0 +1,348 @@
+"""Versioned strategy templates stamped onto owners without the LLM.
+
+A template is a timeline whose strings may contain placeholders such as
+`{amount}` or `{due_date}`. Saving a name again creates a new version;
+versions are immutable. Each version is validated once when it is saved and
+compiled to its canonical JSON text split around the placeholders, so
+applying it to an owner is a string join: no Pydantic validation and no JSON
+encoding per owner. Owners whose rendered timelines are identical share one
+stored copy.
+
+Placeholders:
+- `{amount}`: "₹12,000" style amount owed, or "your outstanding balance"
+- `{amount_owed}`, `{remaining_amount}`, `{due_date}`, `{service}`,
+  `{preferred_contact}`, `{name}`
+- `{contact_email}`, `{contact_phone}`, `{contact_sms}`: the owner's contact
+  detail for that channel, read from `contact_routes`. Action blocks without
+  a `contact_method_detail` get the one matching their `source`
+  automatically.
+"""
+
+from __future__ import annotations
+
+import re
+from datetime import datetime
+from functools import lru_cache
+from json.encoder import encode_basestring
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import String, bindparam, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import contact_routes, crud, models, schemas
+
+
+PLACEHOLDERS = {
+    "amount",
+    "amount_owed",
+    "remaining_amount",
+    "due_date",
+    "service",
+    "preferred_contact",
+    "name",
+    "contact_email",
+    "contact_phone",
+    "contact_sms",
+}
+
+# Contact placeholder and contact route per block source.
+_SOURCE_CONTACTS = {
+    "email": ("contact_email", "email"),
+    "call": ("contact_phone", "phone"),
+    "phone": ("contact_phone", "phone"),
+    "sms": ("contact_sms", "sms"),
+}
+
+_CONTACT_PLACEHOLDERS = dict(_SOURCE_CONTACTS.values())
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_COMPILED_PLACEHOLDER = re.compile(r'"\{(\w+)\}"|\{(\w+)\}')
+
+# Owners read and strategies written per statement batch.
+CHUNK_SIZE = 5000
+
+
+class TemplateError(ValueError):
+    """A template timeline is invalid or uses unknown placeholders."""
+
+
+def _strings(value: Any) -> Iterator[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def compile_timeline(timeline: List[Dict[str, Any]]) -> str:
+    """Validate a template timeline and return its compiled JSON text."""
+    unknown = {
+        name for text in _strings(timeline) for name in _PLACEHOLDER.findall(text) if name not in PLACEHOLDERS
+    }
+    if unknown:
+        raise TemplateError(f"Unknown placeholders: {', '.join(sorted(unknown))}")
+
+    try:
+        columns = [schemas.StrategyTimelineColumn(**column).dict() for column in timeline]
+    except Exception as exc:
+        raise TemplateError(f"Invalid strategy timeline: {exc}") from exc
+
+    for column in columns:
+        for block in column["blocks"]:
+            if block.get("block_type") == "decision":
+                block["decision_sources"] = block.get("decision_sources") or []
+                block["decision_outputs"] = block.get("decision_outputs") or []
+                continue
+            contact = _SOURCE_CONTACTS.get((block.get("source") or "").lower())
+            if contact and not block.get("contact_method_detail"):
+                block["contact_method_detail"] = "{%s}" % contact[0]
+            if not block.get("preferred_contact"):
+                block["preferred_contact"] = "{preferred_contact}"
+    # Canonical form, so rendered timelines hash like `crud.canonical_timeline_json`.
+    return crud.canonical_timeline_json(columns)
+
+
+@lru_cache(maxsize=256)
+def _parts(compiled: str) -> Tuple[Tuple[str, Optional[str], bool], ...]:
+    """(literal JSON text, placeholder or None, placeholder is a whole JSON value) triples."""
+    parts: List[Tuple[str, Optional[str], bool]] = []
+    pos = 0
+    for match in _COMPILED_PLACEHOLDER.finditer(compiled):
+        whole = match.group(1) is not None
+        parts.append((compiled[pos:match.start()], match.group(1) if whole else match.group(2), whole))
+        pos = match.end()
+    parts.append((compiled[pos:], None, False))
+    return tuple(parts)
+
+
+def render(compiled: str, values: Dict[str, Any]) -> str:
+    """JSON text of the template timeline with `values` filled in."""
+    encoded: Dict[str, str] = {}
+    out: List[str] = []
+    for literal, name, whole in _parts(compiled):
+        out.append(literal)
+        if name is None:
+            continue
+        text = encoded.get(name)
+        if text is None:
+            value = values.get(name)
+            text = encoded[name] = "null" if value is None else encode_basestring(str(value))
+        if whole:
+            out.append(text)
+        elif text != "null":
+            out.append(text[1:-1])
+    return "".join(out)
+
+
+def owner_values(name: Optional[str], details: Dict[str, Any], routes: Dict[str, str]) -> Dict[str, Any]:
+    amount_owed = details.get("amount_owed")
+    values = {
+        "amount": f"₹{amount_owed:,}" if isinstance(amount_owed, (int, float)) else "your outstanding balance",
+        "amount_owed": amount_owed,
+        "remaining_amount": details.get("remaining_amount"),
+        "due_date": details.get("due_date"),
+        "service": details.get("service"),
+        "preferred_contact": details.get("preferred_contact"),
+        "name": name,
+    }
+    for placeholder, channel in _CONTACT_PLACEHOLDERS.items():
+        values[placeholder] = routes.get(channel)
+    return values
+
+
+def save_template(
+    db: Session,
+    *,
+    name: str,
+    timeline: List[Dict[str, Any]],
+    description: Optional[str] = None,
+) -> models.StrategyTemplate:
+    """Validate, compile and store `timeline` as the next version of `name`."""
+    compiled = compile_timeline(timeline)
+    latest = (
+        db.query(func.max(models.StrategyTemplate.version))
+        .filter(models.StrategyTemplate.name == name)
+        .scalar()
+    )
+    template = models.StrategyTemplate(
+        name=name,
+        version=(latest or 0) + 1,
+        description=description,
+        timeline=timeline,
+        compiled=compiled,
+    )
+    db.add(template)
+    db.commit()
+    db.refresh(template)
+    return template
+
+
+def get_template(
+    db: Session,
+    *,
+    template_id: Optional[int] = None,
+    name: Optional[str] = None,
+    version: Optional[int] = None,
+) -> Optional[models.StrategyTemplate]:
+    """A template by id, or by name at `version` (latest if omitted)."""
+    q = db.query(models.StrategyTemplate)
+    if template_id is not None:
+        return q.filter(models.StrategyTemplate.id == template_id).first()
+    q = q.filter(models.StrategyTemplate.name == name)
+    if version is not None:
+        return q.filter(models.StrategyTemplate.version == version).first()
+    return q.order_by(models.StrategyTemplate.version.desc()).first()
+
+
+OwnerRow = Tuple[int, Optional[str], Dict[str, Any], Dict[str, str]]  # id, name, details, contact routes
+
+
+def _user_rows(db: Session, owner_ids: List[int]) -> Iterator[OwnerRow]:
+    def field(path: str):
+        return func.json_extract(models.User.details, path)
+
+    stmt = select(
+        models.User.id,
+        models.User.name,
+        field("$.amount_owed"),
+        field("$.remaining_amount"),
+        field("$.due_date"),
+        field("$.service"),
+        field("$.preferred_contact"),
+    ).where(models.User.id.in_(owner_ids))
+    routes = contact_routes.load(db, owner_ids)
+    for user_id, name, amount_owed, remaining, due_date, service, preferred in db.execute(stmt):
+        details = {
+            "amount_owed": amount_owed,
+            "remaining_amount": remaining,
+            "due_date": due_date,
+            "service": service,
+            "preferred_contact": preferred,
+        }
+        yield user_id, name, details, routes.get(user_id, {})
+
+
+def _group_rows(db: Session, owner_ids: List[int]) -> Iterator[OwnerRow]:
+    for group_id, name in db.query(models.Group.id, models.Group.name).filter(models.Group.id.in_(owner_ids)):
+        yield group_id, name, {}, {}
+
+
+def apply_template(
+    db: Session,
+    template: models.StrategyTemplate,
+    *,
+    owner_type: str,
+    owner_ids: List[int],
+    prompt: Optional[str] = None,
+) -> Dict[str, int]:
+    """Stamp `template` onto every owner in one transaction.
+
+    Each owner gets a new strategy version and their head moves to it;
+    `created` counts owners that had no strategy before. Rendered timelines
+    are stored once per distinct content in `strategy_timelines`, and rows
+    are written with executemany statements, bypassing the ORM.
+    """
+    strategies = models.Strategy.__table__
+    heads = models.StrategyHead.__table__
+    owner_col = strategies.c.group_id if owner_type == "group" else strategies.c.user_id
+    rows_for = _group_rows if owner_type == "group" else _user_rows
+    prompt = prompt or f"template:{template.name}@v{template.version}"
+    now = datetime.utcnow()
+
+    # Rendered text is bound as a string so the JSON column does not re-encode it.
+    blob_stmt = (
+        sqlite_insert(models.StrategyTimeline.__table__)
+        .values(
+            hash=bindparam("hash"),
+            timeline=bindparam("rendered", type_=String),
+            size=bindparam("size"),
+            created_at=now,
+        )
+        .on_conflict_do_nothing(index_elements=["hash"])
+    )
+    insert_stmt = (
+        insert(strategies)
+        .values(
+            user_id=bindparam("user_id"),
+            group_id=bindparam("group_id"),
+            version=bindparam("version"),
+            timeline=[],
+            timeline_hash=bindparam("digest"),
+            apply_contacts=False,
+            prompt=prompt,
+            executed=False,
+            created_at=now,
+            updated_at=now,
+        )
+        .returning(strategies.c.id, strategies.c.version, owner_col, sort_by_parameter_order=True)
+    )
+    head_stmt = sqlite_insert(heads).values(
+        owner_type=owner_type,
+        owner_id=bindparam("owner_id"),
+        strategy_id=bindparam("strategy_id"),
+        version=bindparam("version"),
+        updated_at=now,
+    )
+    head_stmt = head_stmt.on_conflict_do_update(
+        index_elements=["owner_type", "owner_id"],
+        set_={
+            "strategy_id": head_stmt.excluded.strategy_id,
+            "version": head_stmt.excluded.version,
+            "updated_at": head_stmt.excluded.updated_at,
+        },
+    )
+
+    applied = created = 0
+    try:
+        for start in range(0, len(owner_ids), CHUNK_SIZE):
+            chunk = owner_ids[start:start + CHUNK_SIZE]
+            latest = dict(
+                db.execute(
+                    select(heads.c.owner_id, heads.c.version).where(
+                        heads.c.owner_type == owner_type, heads.c.owner_id.in_(chunk)
+                    )
+                ).all()
+            )
+            blobs: Dict[str, str] = {}
+            inserts: List[Dict[str, Any]] = []
+            for owner_id, name, details, routes in rows_for(db, chunk):
+                rendered = render(template.compiled, owner_values(name, details, routes))
+                digest = crud.timeline_digest(rendered)
+                blobs[digest] = rendered
+                inserts.append(
+                    {
+                        "user_id": None if owner_type == "group" else owner_id,
+                        "group_id": owner_id if owner_type == "group" else None,
+                        "version": latest.get(owner_id, 0) + 1,
+                        "digest": digest,
+                    }
+                )
+            if not inserts:
+                continue
+            db.execute(
+                blob_stmt,
+                [
+                    {"hash": digest, "rendered": text, "size": len(text.encode("utf-8"))}
+                    for digest, text in blobs.items()
+                ],
+            )
+            new_rows = db.execute(insert_stmt, inserts).all()
+            db.execute(
+                head_stmt,
+                [
+                    {"owner_id": owner_id, "strategy_id": strategy_id, "version": version}
+                    for strategy_id, version, owner_id in new_rows
+                ],
+            )
+            applied += len(inserts)
+            created += sum(1 for row in inserts if row["version"] == 1)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {"applied": applied, "created": created, "updated": applied - created}
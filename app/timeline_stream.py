@@ -0,0 +1,92 @@
+"""Incremental parsing of a streamed `{"timeline": [...]}` model response.
+
+The model writes the timeline one column object after another, so each
+column can be decoded as soon as its closing brace arrives instead of
+waiting for the whole document.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+_TIMELINE_START = re.compile(r'"timeline"\s*:\s*\[')
+
+
+class TimelineColumnParser:
+    """Feed text chunks; get back the timeline columns completed so far."""
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._pos = 0  # next character of `_buffer` to scan
+        self._in_array = False
+        self._done = False
+        self._depth = 0  # nesting depth inside the timeline array
+        self._in_string = False
+        self._escaped = False
+        self._column_start: Optional[int] = None
+        self.text = ""  # everything fed so far, for parsing the final document
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        if self._done:
+            return []
+        self._buffer += chunk
+
+        if not self._in_array:
+            match = _TIMELINE_START.search(self._buffer)
+            if not match:
+                return []
+            self._in_array = True
+            self._buffer = self._buffer[match.end():]
+            self._pos = 0
+
+        columns: List[Dict[str, Any]] = []
+        buf = self._buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._column_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:  # the timeline array itself closed
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._column_start is not None:
+                    try:
+                        column = json.loads(buf[self._column_start:i + 1])
+                    except ValueError:
+                        column = None
+                    if isinstance(column, dict):
+                        columns.append(column)
+                    self._column_start = None
+
+        # Drop text that belongs to columns already emitted.
+        keep_from = self._column_start if self._column_start is not None else len(buf)
+        self._buffer = buf[keep_from:]
+        if self._column_start is not None:
+            self._column_start = 0
+        self._pos = len(self._buffer)
+        return columns
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    """Encode one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
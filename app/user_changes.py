@@ -0,0 +1,78 @@
+"""Keeps data derived from users in step with writes to `users`.
+
+Users inserted or updated through the ORM are collected on flush and passed
+to every handler when their session commits, inside the same transaction.
+Bulk statements that bypass the ORM call `users_changed` with a condition
+selecting the rows they touched.
+
+Handlers take `(db, user_filter, columns=None)`, where `user_filter` is a SQL
+condition on `users` and `columns` names the `users` columns that changed
+(None when unknown). A handler skips work its data cannot depend on. They
+run in a fixed order. Rule-based group membership runs last, because other
+handlers may be passed a filter over a group's members.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Collection, Iterable, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from . import models
+
+Handler = Callable[..., None]  # (db, user_filter, *, columns=None)
+
+# Users per handler call.
+CHUNK_SIZE = 5000
+
+_CHANGED = "user_changes_ids"
+
+
+def _handlers() -> List[Handler]:
+    from . import contact_routes, dynamic_groups, worklist
+
+    return [contact_routes.refresh_users, worklist.refresh_users, dynamic_groups.refresh_users]
+
+
+def users_changed(
+    db: Session,
+    user_filter: ColumnElement,
+    *,
+    columns: Optional[Collection[str]] = None,
+) -> None:
+    """Update derived data for the users matching `user_filter`; the caller commits.
+
+    Pass `columns` when a bulk statement changed only those `users` columns.
+    """
+    for handler in _handlers():
+        handler(db, user_filter, columns=columns)
+
+
+def user_ids_changed(db: Session, user_ids: Iterable[int]) -> None:
+    ids = sorted(set(user_ids))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        users_changed(db, models.User.id.in_(ids[start:start + CHUNK_SIZE]))
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session: Session, flush_context) -> None:
+    changed: Set[int] = session.info.setdefault(_CHANGED, set())
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, models.User) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_changed_users(session: Session) -> None:
+    if session.new or session.dirty:
+        session.flush()
+    changed = session.info.pop(_CHANGED, None)
+    if changed:
+        user_ids_changed(session, changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session: Session) -> None:
+    session.info.pop(_CHANGED, None)
@@ -0,0 +1,281 @@
+"""The collectors' "next best debtor" worklist.
+
+Every user who still owes money has a row in `worklist_entries` with a
+priority score. The score grows with the remaining balance (on a log scale),
+days overdue, days since the last payment, and how far the user's latest
+strategy execution has got. Finished and archived users, and users with
+nothing left to pay, have no row.
+
+`worklist_entries` is indexed on `score`, so that index is the priority
+queue. Re-scoring a user is one indexed upsert, and the top of the list is
+read in score order without sorting. Scores are kept current incrementally.
+`refresh_users` runs from `user_changes` when payments, status changes or
+ingestion touch users, and from the scheduler when an execution advances.
+Overdue and recency terms also move with the calendar, so `rebuild`
+re-scores everyone in chunks once a day.
+
+Collectors `claim` the top K unclaimed entries. The claim is a single
+`UPDATE ... RETURNING` that re-checks each row is still unclaimed, so
+concurrent collectors never get the same debtor. A claim lasts until it is
+released or its lease expires.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Collection, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from . import models, portfolio
+
+# Score weights: log10 of the balance (about 6 for 1M), days overdue up to
+# a cap, days since the last payment up to a cap, and columns done.
+BALANCE_WEIGHT = 10.0
+OVERDUE_WEIGHT = 30.0
+OVERDUE_CAP_DAYS = 180
+RECENCY_WEIGHT = 10.0
+RECENCY_CAP_DAYS = 90
+STAGE_WEIGHT = 10.0
+STAGE_CAP = 5
+
+CLAIM_TTL_SECONDS = 30 * 60
+CLAIM_MAX_RETRIES = 10
+CHUNK_SIZE = 50000
+
+CLOSED_STATUSES = (models.StatusEnum.FINISHED, models.StatusEnum.ARCHIVED)
+
+COLUMNS = [
+    "id", "status", "group_id", "due_date", "amount_owed", "total_paid", "remaining_amount", "last_payment", "stage",
+]
+
+
+def loader(user_filter: Optional[ColumnElement] = None):
+    """Query for the `COLUMNS` that scores are computed from."""
+    user, execution = models.User, models.StrategyExecution
+    payments = func.json_each(user.details, "$.payment_history").table_valued("value")
+    last_payment = select(
+        func.max(func.substr(func.json_extract(payments.c.value, "$.date"), 1, 10))
+    ).scalar_subquery()
+    stage = (
+        select(execution.columns_done)
+        .where(execution.owner_type == "user", execution.owner_id == user.id)
+        .order_by(execution.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    query = select(
+        user.id,
+        user.status,
+        user.group_id,
+        func.json_extract(user.details, "$.due_date"),
+        func.json_extract(user.details, "$.amount_owed"),
+        func.json_extract(user.details, "$.total_paid"),
+        func.json_extract(user.details, "$.remaining_amount"),
+        last_payment,
+        stage,
+    )
+    return query.where(user_filter) if user_filter is not None else query
+
+
+def score(
+    remaining: np.ndarray,
+    days_overdue: np.ndarray,
+    days_since_payment: np.ndarray,
+    stage: np.ndarray,
+) -> np.ndarray:
+    """Priority per user; NaN days count as not overdue and as never paid."""
+    overdue = np.clip(np.nan_to_num(days_overdue, nan=0.0), 0, OVERDUE_CAP_DAYS) / OVERDUE_CAP_DAYS
+    recency = np.clip(np.nan_to_num(days_since_payment, nan=RECENCY_CAP_DAYS), 0, RECENCY_CAP_DAYS) / RECENCY_CAP_DAYS
+    return np.round(
+        BALANCE_WEIGHT * np.log10(1.0 + np.maximum(remaining, 0.0))
+        + OVERDUE_WEIGHT * overdue
+        + RECENCY_WEIGHT * recency
+        + STAGE_WEIGHT * np.minimum(stage, STAGE_CAP) / STAGE_CAP,
+        4,
+    )
+
+
+def _optional_days(values: np.ndarray) -> List[Optional[int]]:
+    return [None if np.isnan(v) else int(v) for v in values]
+
+
+def _entries(df: pd.DataFrame, today: date, now: datetime) -> tuple:
+    """(entries to upsert, ids of ineligible users) for a frame of `COLUMNS`."""
+    snapshot = portfolio.snapshot_from_frame(df)
+    overdue = portfolio.days_overdue(snapshot, today)
+    paid_on = pd.to_datetime(df["last_payment"], format="%Y-%m-%d", errors="coerce").to_numpy().astype("datetime64[D]")
+    since_payment = (np.datetime64(today, "D") - paid_on).astype("float64")
+    since_payment[np.isnat(paid_on)] = np.nan
+    stage = pd.to_numeric(df["stage"], errors="coerce").fillna(0).to_numpy(dtype="int64")
+    remaining = np.nan_to_num(snapshot.remaining, nan=0.0)
+
+    eligible = (remaining > 0) & ~np.isin(snapshot.status, CLOSED_STATUSES)
+    scores = score(remaining, overdue, since_payment, stage)
+    idx = np.flatnonzero(eligible)
+    entries = [
+        {
+            "user_id": int(uid),
+            "score": float(s),
+            "remaining": float(r),
+            "days_overdue": d,
+            "days_since_payment": p,
+            "stage": int(st),
+            "updated_at": now,
+        }
+        for uid, s, r, d, p, st in zip(
+            snapshot.ids[idx].tolist(),
+            scores[idx].tolist(),
+            remaining[idx].tolist(),
+            _optional_days(overdue[idx]),
+            _optional_days(since_payment[idx]),
+            stage[idx].tolist(),
+        )
+    ]
+    return entries, snapshot.ids[~eligible].tolist()
+
+
+def _write(db: Session, entries: List[Dict[str, Any]], ineligible: Sequence[int]) -> int:
+    """Upsert `entries` and delete the `ineligible` users' entries; returns the number deleted."""
+    entry = models.WorklistEntry
+    if entries:
+        # A Core insert, so the upsert runs as one executemany; re-scoring keeps any claim on the entry.
+        stmt = sqlite_insert(entry.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={
+                name: stmt.excluded[name]
+                for name in ("score", "remaining", "days_overdue", "days_since_payment", "stage", "updated_at")
+            },
+        )
+        db.execute(stmt, entries)
+    removed = 0
+    for start in range(0, len(ineligible), CHUNK_SIZE):
+        removed += db.execute(delete(entry).where(entry.user_id.in_(ineligible[start:start + CHUNK_SIZE]))).rowcount
+    return removed
+
+
+def refresh_frame(db: Session, df: pd.DataFrame, *, today: date, now: Optional[datetime] = None) -> int:
+    """Re-score the users in a frame of `COLUMNS`; the caller commits. Returns the entries removed."""
+    return _write(db, *_entries(df, today, now or datetime.utcnow()))
+
+
+def refresh_users(
+    db: Session,
+    user_filter: ColumnElement,
+    *,
+    today: Optional[date] = None,
+    now: Optional[datetime] = None,
+    columns: Optional[Collection[str]] = None,
+) -> None:
+    """Re-score the users matching `user_filter`; the caller commits."""
+    if columns is not None and not {"status", "details"} & set(columns):
+        return
+    rows = db.execute(loader(user_filter)).all()
+    if rows:
+        refresh_frame(db, pd.DataFrame.from_records(rows, columns=COLUMNS), today=today or date.today(), now=now)
+
+
+def rebuild(db: Session, *, today: Optional[date] = None, chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """Re-score every user, `chunk_size` at a time, and commit. Claims are kept."""
+    today, now = today or date.today(), datetime.utcnow()
+    entry = models.WorklistEntry
+    scored = removed = 0
+    # Scores are written between reads, so page by id rather than holding a cursor open.
+    last_id = 0
+    while True:
+        rows = db.execute(
+            loader(models.User.id > last_id).order_by(models.User.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        entries, ineligible = _entries(pd.DataFrame.from_records(rows, columns=COLUMNS), today, now)
+        removed += _write(db, entries, ineligible)
+        db.commit()
+        scored += len(entries)
+    removed += db.execute(
+        delete(entry).where(entry.user_id.not_in(select(models.User.id)))
+    ).rowcount
+    db.commit()
+    return {"scored": scored, "removed": removed}
+
+
+def _unclaimed(now: datetime) -> ColumnElement:
+    entry = models.WorklistEntry
+    return or_(entry.claimed_by.is_(None), entry.claim_expires_at <= now)
+
+
+def top(db: Session, k: int, *, now: Optional[datetime] = None, include_claimed: bool = False):
+    """The `k` highest-scoring entries, unclaimed ones only unless `include_claimed`."""
+    entry = models.WorklistEntry
+    query = db.query(entry)
+    if not include_claimed:
+        query = query.filter(_unclaimed(now or datetime.utcnow()))
+    return query.order_by(entry.score.desc(), entry.user_id).limit(k).all()
+
+
+def claim(
+    db: Session,
+    collector: str,
+    k: int,
+    *,
+    ttl_seconds: float = CLAIM_TTL_SECONDS,
+    now: Optional[datetime] = None,
+    max_retries: int = CLAIM_MAX_RETRIES,
+) -> List[models.WorklistEntry]:
+    """Claim the top `k` unclaimed entries for `collector` and commit, highest score first."""
+    entry = models.WorklistEntry
+    for attempt in range(max_retries):
+        at = now or datetime.utcnow()
+        picked = (
+            select(entry.user_id)
+            .where(_unclaimed(at))
+            .order_by(entry.score.desc(), entry.user_id)
+            .limit(k)
+        )
+        stmt = (
+            update(entry)
+            .where(entry.user_id.in_(picked), _unclaimed(at))
+            .values(claimed_by=collector, claim_expires_at=at + timedelta(seconds=ttl_seconds))
+            .returning(entry.user_id)
+        )
+        try:
+            user_ids = db.execute(stmt).scalars().all()
+            db.commit()
+        except OperationalError:
+            # Another collector holds the SQLite write lock; retry on a fresh read.
+            db.rollback()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+            continue
+        if not user_ids:
+            return []
+        return db.query(entry).filter(entry.user_id.in_(user_ids)).order_by(entry.score.desc(), entry.user_id).all()
+    return []
+
+
+def release(db: Session, collector: str, user_ids: Optional[Sequence[int]] = None) -> int:
+    """Release `collector`'s claims (on `user_ids`, or all of them) and commit."""
+    entry = models.WorklistEntry
+    stmt = update(entry).where(entry.claimed_by == collector)
+    if user_ids is not None:
+        stmt = stmt.where(entry.user_id.in_(list(user_ids)))
+    released = db.execute(stmt.values(claimed_by=None, claim_expires_at=None)).rowcount
+    db.commit()
+    return released
+
+
+def counts(db: Session, *, now: Optional[datetime] = None) -> Dict[str, int]:
+    entry = models.WorklistEntry
+    now = now or datetime.utcnow()
+    claimed = and_(entry.claimed_by.is_not(None), entry.claim_expires_at > now)
+    total, claimed = db.execute(select(func.count(), func.count().filter(claimed)).select_from(entry)).one()
+    return {"entries": total, "claimed": claimed}
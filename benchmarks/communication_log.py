@@ -0,0 +1,88 @@
+"""
+Benchmark: communication log writes and per-user reads.
+
+Appends N events for 100k users spread over 12 months to a throwaway SQLite
+database in batches of 10k, then times recent-history lookups for random
+users, summary lookups, and `count_responses` for 10k users whose
+executions started in the last month (what the decision engine asks).
+
+Usage: python benchmarks/communication_log.py [events]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import communication_log  # noqa: E402
+from app.database import Base  # noqa: E402
+
+USERS = 100_000
+BATCH = 10_000
+START = datetime(2029, 1, 1)
+DAYS = 365
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    rng = np.random.default_rng(0)
+
+    # Time-ordered, like a live log: each batch covers the next slice of the year.
+    start = time.perf_counter()
+    for offset in range(0, n, BATCH):
+        size = min(BATCH, n - offset)
+        owners = rng.integers(1, USERS + 1, size)
+        inbound = rng.random(size) < 0.1
+        seconds = np.sort(rng.integers(0, DAYS * 86400 // (n // BATCH or 1), size)) + offset // BATCH * (
+            DAYS * 86400 // (n // BATCH or 1)
+        )
+        communication_log.record(
+            db,
+            [
+                {
+                    "owner_id": int(owner),
+                    "direction": "inbound" if is_inbound else "outbound",
+                    "channel": "email",
+                    "outcome": "replied" if is_inbound else "sent",
+                    "occurred_at": START + timedelta(seconds=int(second)),
+                }
+                for owner, is_inbound, second in zip(owners, inbound, seconds)
+            ],
+        )
+        db.commit()
+    elapsed = time.perf_counter() - start
+    print(f"write: {n:,} events in {elapsed:.1f} s ({n / elapsed:,.0f} events/s), "
+          f"{len(communication_log.partitions(db))} partitions")
+
+    sample = rng.integers(1, USERS + 1, 1000).tolist()
+    start = time.perf_counter()
+    for owner in sample:
+        communication_log.history(db, "user", owner, limit=20)
+    print(f"history (20 newest): {(time.perf_counter() - start) / len(sample) * 1000:.2f} ms per user")
+
+    start = time.perf_counter()
+    for owner in sample:
+        communication_log.get_summary(db, "user", owner)
+    print(f"summary: {(time.perf_counter() - start) / len(sample) * 1000:.2f} ms per user")
+
+    owners = np.unique(rng.integers(1, USERS + 1, 10_000))
+    since = np.full(len(owners), np.datetime64(START + timedelta(days=DAYS - 30), "D"))
+    start = time.perf_counter()
+    counts = communication_log.count_responses(db, "user", owners, since)
+    print(f"count_responses: {len(owners):,} owners in {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"({int((counts > 0).sum()):,} responded in the last 30 days)")
+
+
+if __name__ == "__main__":
+    main()
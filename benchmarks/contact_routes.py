@@ -0,0 +1,154 @@
+"""
+Benchmark: bulk strategy enrichment with precomputed contact routes.
+
+Creates N users with several contact methods each in a throwaway SQLite
+database and fills in the contact details of the six-stage default plan for
+all of them, two ways:
+
+- scan: parse each user's `contact_methods` and scan the list for every
+  block, as enrichment did before `contact_routes` existed;
+- routes: load each user's routes from `contact_routes` and look every
+  block up in them.
+
+Usage: python benchmarks/contact_routes.py [users]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import contact_routes, models  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.routers_strategies import _apply_contact_metadata, _default_base_timeline  # noqa: E402
+
+CHUNK_SIZE = 5000
+SOURCE_CANDIDATES = {"email": ["email"], "call": ["phone"], "phone": ["phone"], "sms": ["sms", "phone"]}
+
+
+def _scan(contact_methods: List[Dict[str, Any]], candidates: List[str]) -> Optional[str]:
+    """The per-block lookup enrichment used to do: preferred match, else first match."""
+    normalized = [m.lower() for m in candidates]
+    preferred = next(
+        (cm for cm in contact_methods if cm.get("method", "").lower() in normalized and cm.get("is_preferred")), None
+    )
+    if preferred:
+        return preferred.get("value")
+    fallback = next((cm for cm in contact_methods if cm.get("method", "").lower() in normalized), None)
+    return fallback.get("value") if fallback else None
+
+
+def _enrich_by_scan(
+    timeline: List[Dict[str, Any]], contact_methods: List[Dict[str, Any]], preferred_contact: Optional[str]
+) -> List[Dict[str, Any]]:
+    """`_apply_contact_metadata` as it was: a scan of `contact_methods` per block."""
+    enriched = []
+    for column in timeline:
+        blocks = []
+        for block in column.get("blocks", []):
+            block = dict(block)
+            block["block_type"] = block.get("block_type") or "action"
+            if block["block_type"] == "decision":
+                block.setdefault("decision_sources", [])
+                block.setdefault("decision_outputs", [])
+                blocks.append(block)
+                continue
+            candidates = SOURCE_CANDIDATES.get((block.get("source") or "").lower())
+            value = _scan(contact_methods, candidates) if candidates and contact_methods else None
+            if value and not block.get("contact_method_detail"):
+                block["contact_method_detail"] = value
+            if preferred_contact and not block.get("preferred_contact"):
+                block["preferred_contact"] = preferred_contact
+            blocks.append(block)
+        enriched.append({"timing": column.get("timing") or "Unscheduled", "blocks": blocks})
+    return enriched
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.execute(
+        insert(models.User),
+        [
+            {
+                "name": f"User {i}",
+                "status": "pending",
+                "version": 1,
+                "details": {
+                    "amount_owed": 1000,
+                    "preferred_contact": "phone",
+                    "contact_methods": [
+                        {"method": "Email", "value": f"user{i}@example.com", "label": "Email 1"},
+                        {"method": "Phone", "value": f"+1555{i:07d}", "label": "Phone 1"},
+                        {"method": "phone", "value": f"+1666{i:07d}", "label": "Phone 2", "is_preferred": True},
+                        {"method": "email", "value": f"work{i}@example.com", "label": "Email 2"},
+                    ],
+                },
+            }
+            for i in range(n)
+        ],
+    )
+    db.commit()
+    ids = list(range(1, n + 1))
+    timeline = json.loads(_default_base_timeline("{amount}"))
+
+    start = time.perf_counter()
+    routes_built = contact_routes.rebuild(db)
+    print(f"build routes: {routes_built:,} routes for {n:,} users in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    scanned = []
+    for offset in range(0, n, CHUNK_SIZE):
+        chunk = ids[offset:offset + CHUNK_SIZE]
+        for _, methods in db.execute(
+            select(models.User.id, func.json_extract(models.User.details, "$.contact_methods"))
+            .where(models.User.id.in_(chunk))
+        ):
+            scanned.append(_enrich_by_scan(timeline, json.loads(methods), "phone"))
+    scan_elapsed = time.perf_counter() - start
+    print(f"scan:         {n:,} timelines in {scan_elapsed:.2f} s")
+
+    start = time.perf_counter()
+    routed = []
+    details = {"preferred_contact": "phone"}
+    for offset in range(0, n, CHUNK_SIZE):
+        chunk = ids[offset:offset + CHUNK_SIZE]
+        routes = contact_routes.load(db, chunk)
+        routed.extend(_apply_contact_metadata(timeline, details, routes.get(uid, {})) for uid in chunk)
+    routes_elapsed = time.perf_counter() - start
+    print(f"routes:       {n:,} timelines in {routes_elapsed:.2f} s ({scan_elapsed / routes_elapsed:.1f}x)")
+
+    # The enrichment step alone, with every user's contacts already in memory.
+    contacts = select(func.json_extract(models.User.details, "$.contact_methods")).order_by(models.User.id)
+    methods_by_user = [json.loads(m) for (m,) in db.execute(contacts)]
+    routes_by_user = contact_routes.load(db, ids)
+    start = time.perf_counter()
+    for methods in methods_by_user:
+        _enrich_by_scan(timeline, methods, "phone")
+    scan_only = time.perf_counter() - start
+    start = time.perf_counter()
+    for uid in ids:
+        _apply_contact_metadata(timeline, details, routes_by_user.get(uid, {}))
+    routes_only = time.perf_counter() - start
+    print(f"enrichment only: scan {scan_only:.2f} s, routes {routes_only:.2f} s ({scan_only / routes_only:.1f}x)")
+
+    same = all(
+        [b.get("contact_method_detail") for c in a for b in c["blocks"]]
+        == [b.get("contact_method_detail") for c in r for b in c["blocks"]]
+        for a, r in zip(scanned, routed)
+    )
+    print(f"same contacts: {same}")
+
+
+if __name__ == "__main__":
+    main()
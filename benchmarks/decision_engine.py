@@ -0,0 +1,114 @@
+"""
+Benchmark: evaluating 100k due decision blocks in one scheduler tick.
+
+Creates N users in a throwaway SQLite database (a third of them paid during
+the strategy), starts one execution each whose first column holds the
+default plan's "partial payment / no response" decision, and runs a single
+tick with a batch size of N. Prints the time spent in the vectorized
+decision pass and for the whole tick, including loading and routing the
+executions.
+
+Usage: python benchmarks/decision_engine.py [decisions]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, decision_engine, models, strategy_scheduler  # noqa: E402
+from app.database import Base  # noqa: E402
+
+NOW = datetime(2030, 1, 1, 9)
+
+TIMELINE = [
+    {
+        "timing": "Day 1-7",
+        "blocks": [
+            {
+                "block_type": "decision",
+                "decision_prompt": "Check if user has made any partial payment or contacted us",
+                "decision_sources": ["payment_history", "communication_log"],
+                "decision_outputs": [
+                    {"condition": "If partial payment received", "next_timing": "Day 31-50"},
+                    {"condition": "If no response", "next_timing": "Day 15-30"},
+                ],
+            }
+        ],
+    },
+    {"timing": "Day 15-30", "blocks": [{"block_type": "action", "source": "email", "content": "Reminder"}]},
+    {"timing": "Day 31-50", "blocks": [{"block_type": "action", "source": "call", "content": "Plan"}]},
+]
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    db.execute(
+        insert(models.User),
+        [
+            {
+                "name": f"User {i}",
+                "status": "ongoing",
+                "version": 1,
+                "details": {
+                    "amount_owed": 1000,
+                    "due_date": "2029-11-15",
+                    "payment_history": [{"amount": 100, "date": "2029-06-01"}]
+                    + ([{"amount": 250, "date": "2030-01-01"}] if i % 3 == 0 else []),
+                },
+            }
+            for i in range(n)
+        ],
+    )
+    strategy = crud.create_or_update_strategy_for_owner(db, owner_id=1, owner_type="user", timeline=TIMELINE)
+    db.execute(
+        insert(models.StrategyExecution),
+        [
+            {
+                "strategy_id": strategy.id,
+                "owner_type": "user",
+                "owner_id": i,
+                "anchor_date": NOW.date(),
+                "next_due_at": datetime(2030, 1, 1),
+                "started_at": datetime(2030, 1, 1),
+            }
+            for i in range(1, n + 1)
+        ],
+    )
+    db.commit()
+
+    timed = {}
+    decide = decision_engine.decide
+
+    def timed_decide(*args, **kwargs):
+        start = time.perf_counter()
+        result = decide(*args, **kwargs)
+        timed["decide"] = time.perf_counter() - start
+        return result
+
+    decision_engine.decide = timed_decide
+    try:
+        start = time.perf_counter()
+        stats = strategy_scheduler.tick(db, now=NOW, batch_size=n)
+        elapsed = time.perf_counter() - start
+    finally:
+        decision_engine.decide = decide
+
+    print(f"decisions: {stats['decisions']:,}, routed: {stats['routed']:,}")
+    print(f"decision pass: {timed['decide']:.2f} s ({stats['decisions'] / timed['decide']:,.0f} decisions/s)")
+    print(f"whole tick:    {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: outbox throughput per channel with one slow channel.
+
+Queues N messages per channel in a throwaway SQLite database and drains them
+with in-memory adapters that simulate provider latency: email and sms take
+20 ms per batch of 100, calls take 500 ms per batch of 10. Prints each
+channel's throughput in messages/s and when it finished; email and sms
+should finish at the same time whether or not calls are being sent.
+
+Usage: python benchmarks/dispatch.py [messages per channel]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import dispatch, models  # noqa: E402
+from app.database import Base  # noqa: E402
+
+NOW = datetime(2030, 1, 1, 9)
+
+
+def make_session_factory(n: int, channels):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.execute(
+        insert(models.OutboxMessage),
+        [
+            {
+                "owner_type": "user",
+                "owner_id": i,
+                "channel": channel,
+                "recipient": f"user{i}@{channel}",
+                "content": "Reminder",
+                "next_attempt_at": NOW,
+            }
+            for channel in channels
+            for i in range(n if channel != "call" else n // 20)
+        ],
+    )
+    db.commit()
+    db.close()
+    return factory
+
+
+async def drain(factory, channels):
+    finished = {}
+    dispatcher = dispatch.Dispatcher(session_factory=factory, clock=lambda: NOW)
+
+    async def run(channel):
+        await dispatcher.run_channel(channel, stop_when_idle=True)
+        finished[channel] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(channel) for channel in channels))
+    return dispatcher.metrics(), finished
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    dispatch.set_adapter("email", dispatch.MemorySink(latency=0.02, batch_size=100))
+    dispatch.set_adapter("sms", dispatch.MemorySink(latency=0.02, batch_size=100))
+    dispatch.set_adapter("call", dispatch.MemorySink(latency=0.5, batch_size=10, concurrency=2))
+
+    for channels in (("email", "sms"), ("email", "sms", "call")):
+        stats, finished = asyncio.run(drain(make_session_factory(n, channels), channels))
+        print(f"channels: {', '.join(channels)}")
+        for channel in channels:
+            print(
+                f"  {channel:>5}: {stats[channel]['sent']:>7,} sent, "
+                f"{stats[channel]['messages_per_second']:>8,.0f} messages/s, done at {finished[channel]:.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
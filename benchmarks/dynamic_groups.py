@@ -0,0 +1,80 @@
+"""
+Benchmark: materializing a rule-based group and refreshing it incrementally.
+
+Inserts N users into a throwaway SQLite database, creates a group for
+"remaining > 10k, more than 60 days overdue, prefers phone", then times a
+single user's update (re-evaluated on commit) against a full refresh.
+
+Usage: python benchmarks/dynamic_groups.py [users]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, dynamic_groups, models  # noqa: E402
+from app.database import Base  # noqa: E402
+
+RULE = {
+    "all": [
+        {"field": "remaining", "op": "gt", "value": 10000},
+        {"field": "days_overdue", "op": "gt", "value": 60},
+        {"field": "preferred_contact", "value": "phone"},
+    ]
+}
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    rng = random.Random(0)
+    today = date.today()
+    db.execute(
+        insert(models.User),
+        [
+            {
+                "name": f"User {i}",
+                "status": "ongoing",
+                "version": 1,
+                "details": {
+                    "amount_owed": rng.randint(0, 50000),
+                    "due_date": (today - timedelta(days=rng.randint(0, 180))).isoformat(),
+                    "contact_methods": [
+                        {"method": rng.choice(["phone", "email"]), "value": "x", "is_preferred": True}
+                    ],
+                },
+            }
+            for i in range(n)
+        ],
+    )
+    db.commit()
+
+    start = time.perf_counter()
+    group = crud.create_dynamic_group(db, name="High risk, phone", rule=RULE)
+    members = crud.count_group_members(db, group.id)
+    print(f"create:             {members:,} of {n:,} users in {time.perf_counter() - start:.2f} s")
+
+    user = db.get(models.User, 1)
+    start = time.perf_counter()
+    user.details = {**user.details, "amount_owed": 60000, "due_date": (today - timedelta(days=90)).isoformat()}
+    db.commit()
+    print(f"one user's update:  {(time.perf_counter() - start) * 1000:.1f} ms including the commit")
+
+    start = time.perf_counter()
+    dynamic_groups.refresh(db, full=True)
+    print(f"full refresh:       {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
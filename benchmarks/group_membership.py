@@ -0,0 +1,54 @@
+"""
+Benchmark: creating and editing a very large group.
+
+Inserts N users into a throwaway SQLite database, then times
+`crud.create_group_with_users` for all of them, adding N/10 more users and
+removing N/10 members.
+
+Usage: python benchmarks/group_membership.py [members]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, models  # noqa: E402
+from app.database import Base  # noqa: E402
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    extra = n // 10
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.execute(
+        insert(models.User),
+        [{"name": f"User {i}", "status": "pending", "version": 1, "details": {}} for i in range(n + extra)],
+    )
+    db.commit()
+    ids = list(range(1, n + extra + 1))
+
+    start = time.perf_counter()
+    group = crud.create_group_with_users(db, name="Large group", user_ids=ids[:n])
+    print(f"create: {n:,} members in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    added = crud.add_group_members(db, group, ids[n:])
+    print(f"add:    {added:,} members in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    removed = crud.remove_group_members(db, group, ids[:extra])
+    print(f"remove: {removed:,} members in {time.perf_counter() - start:.2f} s")
+    assert crud.count_group_members(db, group.id) == n
+
+
+if __name__ == "__main__":
+    main()
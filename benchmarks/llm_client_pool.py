@@ -0,0 +1,85 @@
+"""
+Benchmark: per-call httpx.AsyncClient vs the shared pooled client.
+
+Starts a local stub of the chat completions endpoint with uvicorn and times
+sequential calls both ways. The difference is the connection setup saved per
+call (TCP only here; a real HTTPS endpoint also pays the TLS handshake).
+
+Usage: python benchmarks/llm_client_pool.py [calls]
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import llm_client  # noqa: E402
+
+HOST, PORT = "127.0.0.1", 8765
+RESPONSE = b'{"choices": [{"message": {"content": "ok"}}]}'
+
+
+async def stub_app(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    while (await receive()).get("more_body"):
+        pass
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": RESPONSE})
+
+
+def start_stub() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub_app, host=HOST, port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def per_call(n: int, payload: dict) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            resp = await client.post(llm_client.chat_completions_url(), json=payload)
+            resp.raise_for_status()
+    return (time.perf_counter() - start) / n
+
+
+async def pooled(n: int, payload: dict) -> float:
+    await llm_client.startup()
+    try:
+        await llm_client.post_chat_completion(payload, api_key="bench")  # warm the pool
+        start = time.perf_counter()
+        for _ in range(n):
+            await llm_client.post_chat_completion(payload, api_key="bench")
+        return (time.perf_counter() - start) / n
+    finally:
+        await llm_client.shutdown()
+
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    os.environ["OPENAI_API_BASE_URL"] = f"http://{HOST}:{PORT}/v1"
+    server = start_stub()
+    payload = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+    try:
+        fresh = asyncio.run(per_call(calls, payload))
+        shared = asyncio.run(pooled(calls, payload))
+    finally:
+        server.should_exit = True
+
+    print(f"calls:              {calls}")
+    print(f"new client per call:  {fresh * 1000:.2f} ms/call")
+    print(f"shared pooled client: {shared * 1000:.2f} ms/call")
+    print(f"saved per call:       {(fresh - shared) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark: the nightly re-aging job over a large portfolio.
+
+Inserts N users with stale `days_overdue` and statuses into a throwaway
+SQLite database, then times a full `reaging.run` (which also re-scores the
+worklist) and a second run on the same day, when almost nothing changes.
+
+Usage: python benchmarks/reaging.py [users]
+"""
+
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import models, reaging  # noqa: E402
+from app.database import Base  # noqa: E402
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    rng = random.Random(0)
+    today = date.today()
+    for start in range(0, n, 100_000):
+        rows = []
+        for i in range(start, min(n, start + 100_000)):
+            owed = rng.randint(0, 50000)
+            paid = owed if rng.random() < 0.2 else 0
+            paid_on = (today - timedelta(days=rng.randint(0, 300))).isoformat()
+            rows.append({
+                "name": f"User {i}",
+                "status": rng.choice(["pending", "ongoing", "finished"]),
+                "version": 1,
+                "details": {
+                    "amount_owed": owed,
+                    "total_paid": paid,
+                    "due_date": (today - timedelta(days=rng.randint(-60, 400))).isoformat(),
+                    "days_overdue": rng.randint(0, 30),
+                    "status": "pending",
+                    "payment_history": [{"amount": paid, "date": paid_on}] if paid else [],
+                },
+            })
+        db.execute(insert(models.User), rows)
+        db.commit()
+
+    start = time.perf_counter()
+    stats = reaging.run(db, today=today)
+    elapsed = time.perf_counter() - start
+    print(f"first run:   {n:,} users in {elapsed:.1f} s ({n / elapsed:,.0f} users/s)")
+    print(f"             {stats}")
+
+    start = time.perf_counter()
+    stats = reaging.run(db, today=today)
+    print(f"second run:  {time.perf_counter() - start:.1f} s, {stats['updated']:,} users updated")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory: {peak:,.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
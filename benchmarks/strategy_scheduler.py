@@ -0,0 +1,87 @@
+"""
+Benchmark: scheduler tick cost against the number of active strategies.
+
+Fills throwaway SQLite databases with N active strategy executions of the
+default six-stage plan, of which only `due` fall due at the tick, and times
+`strategy_scheduler.tick`. The tick should cost about the same whether N is
+100k or 1M, because it only reads the due rows through the
+`(status, next_due_at)` index.
+
+Usage: python benchmarks/strategy_scheduler.py [due] [sizes...]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, models, strategy_scheduler  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.routers_strategies import _default_base_timeline  # noqa: E402
+
+NOW = datetime(2030, 1, 1, 9)
+CHUNK = 100_000
+
+
+def make_db(active: int, due: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    timeline = json.loads(_default_base_timeline("your outstanding balance"))
+    strategy = crud.create_or_update_strategy_for_owner(db, owner_id=1, owner_type="user", timeline=timeline)
+
+    # The first `due` executions start today; the rest are in their first
+    # column and wait for the second, which opens over the next month.
+    for start in range(0, active, CHUNK):
+        db.execute(
+            insert(models.StrategyExecution),
+            [
+                {
+                    "strategy_id": strategy.id,
+                    "owner_type": "user",
+                    "owner_id": i,
+                    "anchor": "execution",
+                    "anchor_date": anchor,
+                    "status": "active",
+                    "next_step": 0 if i < due else 1,
+                    "next_due_at": datetime.combine(anchor, datetime.min.time()) + timedelta(days=0 if i < due else 7),
+                }
+                for i, anchor in (
+                    (i, NOW.date() if i < due else date(2029, 12, 27) + timedelta(days=i % 30))
+                    for i in range(start, min(start + CHUNK, active))
+                )
+            ],
+        )
+    db.commit()
+    return db
+
+
+def main() -> None:
+    due = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    sizes = [int(n) for n in sys.argv[2:]] or [100_000, 1_000_000]
+
+    print(f"due per tick: {due}")
+    for active in sizes:
+        db = make_db(active, due)
+        blocks = []
+        start = time.perf_counter()
+        stats = strategy_scheduler.tick(db, now=NOW, on_due=lambda _, batch: blocks.extend(batch))
+        elapsed = time.perf_counter() - start
+        assert stats["executions"] == due, stats
+        print(
+            f"{active:>9,} active: tick {elapsed:.2f} s for {stats['executions']:,} executions, "
+            f"{len(blocks):,} blocks ({stats['executions'] / elapsed:,.0f} executions/s)"
+        )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: time to first timeline column, streaming vs blocking generation.
+
+Starts a local stub of the chat completions endpoint with uvicorn that
+"generates" a six-column timeline at a fixed token rate (streamed when the
+request asks for `stream: true`). Then it times the first `column` event
+from `/strategies/{id}/ai-generate/stream` against the full response of
+`/strategies/{id}/ai-generate`.
+
+Usage: python benchmarks/strategy_stream.py [seconds_per_response]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HOST, PORT, API_PORT = "127.0.0.1", 8766, 8767
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+
+TIMELINE = {
+    "timeline": [
+        {
+            "timing": timing,
+            "blocks": [
+                {"block_type": "action", "source": "email", "tone": "friendly", "content": "Reminder " * 20}
+            ],
+        }
+        for timing in ["Day 1-7", "Day 8-14", "Day 15-30", "Day 31-50", "Day 51-90", "Day 90+"]
+    ]
+}
+DOCUMENT = json.dumps(TIMELINE)
+PIECES = [DOCUMENT[i:i + 8] for i in range(0, len(DOCUMENT), 8)]
+
+
+async def stub_app(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    stream = json.loads(body).get("stream")
+    delay = DURATION / len(PIECES)
+
+    if not stream:
+        await asyncio.sleep(DURATION)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        payload = {"choices": [{"message": {"content": DOCUMENT}}]}
+        await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+        return
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream")]})
+    for piece in PIECES:
+        await asyncio.sleep(delay)
+        chunk = {"choices": [{"delta": {"content": piece}}]}
+        await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(),
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host=HOST, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(user_id: int) -> None:
+    base = f"http://{HOST}:{API_PORT}/strategies/{user_id}"
+    body = {"prompt": "Benchmark", "use_cache": False}
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        start = time.perf_counter()
+        resp = await client.post(f"{base}/ai-generate", json=body)
+        resp.raise_for_status()
+        blocking = time.perf_counter() - start
+
+        first_column = None
+        start = time.perf_counter()
+        async with client.stream("POST", f"{base}/ai-generate/stream", json=body) as resp:
+            async for line in resp.aiter_lines():
+                if line == "event: column" and first_column is None:
+                    first_column = time.perf_counter() - start
+        streaming_total = time.perf_counter() - start
+
+    print(f"blocking ai-generate:        {blocking:.2f} s until any content")
+    print(f"streaming first column:      {first_column:.2f} s")
+    print(f"streaming complete strategy: {streaming_total:.2f} s")
+
+
+def main() -> None:
+    os.environ["OPENAI_API_BASE_URL"] = f"http://{HOST}:{PORT}/v1"
+    os.environ["OPENAI_API_KEY"] = "bench"
+
+    from app import crud  # noqa: E402
+    from app.database import SessionLocal  # noqa: E402
+    from main import app  # noqa: E402
+
+    db = SessionLocal()
+    user = crud.create_user(db, name="Stream Benchmark", details={"amount_owed": 1000})
+    db.close()
+
+    stub = serve(stub_app, PORT)
+    api = serve(app, API_PORT)
+    try:
+        asyncio.run(measure(user.id))
+    finally:
+        stub.should_exit = True
+        api.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: latest-strategy lookup as versions accumulate.
+
+Builds throwaway SQLite databases where every owner has 1, 10, 100 or 500
+strategy versions, then times reading random owners' latest strategy
+through the `strategy_heads` pointer (`crud.get_latest_strategy_for_owner`)
+against the previous `ORDER BY created_at DESC LIMIT 1` scan.
+
+Usage: python benchmarks/strategy_versions.py [owners] [lookups]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, models  # noqa: E402
+from app.database import Base  # noqa: E402
+
+
+def make_db(owners: int, versions: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.execute(
+        insert(models.User),
+        [{"name": f"User {i}", "status": "pending", "version": 1, "details": {}} for i in range(owners)],
+    )
+    timeline = [{"timing": "Day 1-7", "blocks": []}]
+    shared = crud.store_timelines(db, [timeline])[0]
+    db.flush()
+    start = datetime(2025, 1, 1)
+    # Versions are interleaved across owners, as they would be in practice.
+    for version in range(1, versions + 1):
+        db.execute(
+            insert(models.Strategy),
+            [
+                {
+                    "user_id": owner_id,
+                    "version": version,
+                    "timeline_inline": [],
+                    "timeline_hash": shared.hash,
+                    "created_at": start + timedelta(minutes=version),
+                }
+                for owner_id in range(1, owners + 1)
+            ],
+        )
+    latest = db.execute(
+        select(models.Strategy.user_id, models.Strategy.id).where(models.Strategy.version == versions)
+    ).all()
+    db.execute(
+        insert(models.StrategyHead),
+        [
+            {"owner_type": "user", "owner_id": owner_id, "strategy_id": strategy_id, "version": versions}
+            for owner_id, strategy_id in latest
+        ],
+    )
+    db.commit()
+    return db
+
+
+def time_lookups(db, owner_ids, lookup) -> float:
+    start = time.perf_counter()
+    for owner_id in owner_ids:
+        db.expunge_all()
+        assert lookup(owner_id) is not None
+    return (time.perf_counter() - start) / len(owner_ids) * 1e6
+
+
+def main() -> None:
+    owners = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    print(f"owners: {owners}, lookups: {lookups}")
+    print(f"{'versions/owner':>14} {'head pointer':>14} {'order by scan':>14}")
+    for versions in (1, 10, 100, 500):
+        db = make_db(owners, versions)
+        owner_ids = [random.randint(1, owners) for _ in range(lookups)]
+        head = time_lookups(
+            db, owner_ids, lambda oid: crud.get_latest_strategy_for_owner(db, owner_id=oid, owner_type="user")
+        )
+        scan = time_lookups(
+            db,
+            owner_ids,
+            lambda oid: db.query(models.Strategy)
+            .filter(models.Strategy.user_id == oid)
+            .order_by(models.Strategy.created_at.desc())
+            .first(),
+        )
+        print(f"{versions:>14} {head:>11.0f} us {scan:>11.0f} us")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: bulk template apply throughput.
+
+Creates N users in a throwaway SQLite database, saves a six-stage template
+and applies it to all of them twice: once inserting new strategies and once
+overwriting them.
+
+Usage: python benchmarks/template_apply.py [users]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import contact_routes, models, strategy_templates  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.routers_strategies import _default_base_timeline  # noqa: E402
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    db.execute(
+        insert(models.User),
+        [
+            {
+                "name": f"User {i}",
+                "status": "pending",
+                "version": 1,
+                "details": {
+                    "amount_owed": 1000 + i % 50000,
+                    "due_date": "2025-01-15",
+                    "preferred_contact": "email",
+                    "contact_methods": [
+                        {"method": "email", "value": f"user{i}@example.com"},
+                        {"method": "phone", "value": f"+1555{i:07d}"},
+                    ],
+                },
+            }
+            for i in range(n)
+        ],
+    )
+    db.commit()
+    # Bulk inserts bypass the ORM, so build the contact routes ingestion would have.
+    contact_routes.rebuild(db)
+    owner_ids = list(range(1, n + 1))
+
+    # The built-in default plan, with the amount left as a placeholder.
+    timeline = json.loads(_default_base_timeline("{amount}"))
+    template = strategy_templates.save_template(db, name="default", timeline=timeline)
+
+    for label in ("insert", "overwrite"):
+        start = time.perf_counter()
+        stats = strategy_templates.apply_template(
+            db, template, owner_type="user", owner_ids=owner_ids
+        )
+        elapsed = time.perf_counter() - start
+        print(f"{label:>9}: {stats['applied']} owners in {elapsed:.2f} s ({stats['applied'] / elapsed:,.0f} owners/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: per-strategy timeline copies vs content-addressed shared timelines.
+
+Assigns the default six-stage plan to N users in two throwaway SQLite
+databases: one with a full JSON copy per strategy (the old layout) and one
+through `crud.bulk_save_strategies`, where they share one stored row. Prints
+the database file size and the time to load every strategy's timeline.
+
+Usage: python benchmarks/timeline_dedup.py [users]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, models  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.routers_strategies import _default_base_timeline  # noqa: E402
+
+
+def make_db(n: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.execute(
+        insert(models.User),
+        [{"name": f"User {i}", "status": "pending", "version": 1, "details": {}} for i in range(n)],
+    )
+    db.commit()
+    return path, engine, db
+
+
+def load_all(db) -> float:
+    db.expunge_all()
+    start = time.perf_counter()
+    loaded = [s.timeline for s in db.query(models.Strategy)]
+    assert all(loaded)
+    return time.perf_counter() - start
+
+
+def size_mb(path: str, engine) -> float:
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    return os.path.getsize(path) / 1e6
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    timeline = json.loads(_default_base_timeline("your outstanding balance"))
+
+    path, engine, db = make_db(n)
+    db.execute(insert(models.Strategy), [{"user_id": i, "timeline_inline": timeline} for i in range(1, n + 1)])
+    db.commit()
+    inline = (size_mb(path, engine), load_all(db))
+
+    path, engine, db = make_db(n)
+    crud.bulk_save_strategies(
+        db, owner_type="user", timelines={i: timeline for i in range(1, n + 1)}, apply_contacts=True
+    )
+    shared = (size_mb(path, engine), load_all(db))
+
+    print(f"strategies: {n}")
+    print(f"copy per strategy: {inline[0]:7.1f} MB, load {inline[1]:.2f} s")
+    print(f"shared timeline:   {shared[0]:7.1f} MB, load {shared[1]:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
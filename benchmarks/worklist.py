@@ -0,0 +1,95 @@
+"""
+Benchmark: building the collector worklist and serving claims from it.
+
+Inserts N users into a throwaway SQLite database, scores them all with
+`worklist.rebuild`, then times re-scoring one user on a payment and
+collectors claiming the next debtors from several threads at once.
+
+Usage: python benchmarks/worklist.py [users]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, models, schemas, worklist  # noqa: E402
+from app.database import Base  # noqa: E402
+
+COLLECTORS = 8
+CLAIMS_PER_COLLECTOR = 50
+CLAIM_SIZE = 5
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    rng = random.Random(0)
+    today = date.today()
+    for start in range(0, n, 100_000):
+        db.execute(
+            insert(models.User),
+            [
+                {
+                    "name": f"User {i}",
+                    "status": rng.choice(["pending", "ongoing", "ongoing", "finished"]),
+                    "version": 1,
+                    "details": {
+                        "amount_owed": rng.randint(0, 50000),
+                        "due_date": (today - timedelta(days=rng.randint(-30, 365))).isoformat(),
+                        "payment_history": [
+                            {"amount": 10, "date": (today - timedelta(days=rng.randint(0, 200))).isoformat()}
+                        ] if rng.random() < 0.5 else [],
+                    },
+                }
+                for i in range(start, min(n, start + 100_000))
+            ],
+        )
+    db.commit()
+
+    start = time.perf_counter()
+    result = worklist.rebuild(db)
+    print(f"rebuild:            {result['scored']:,} of {n:,} users scored in {time.perf_counter() - start:.2f} s")
+
+    user_id = worklist.top(db, 1)[0].user_id
+    start = time.perf_counter()
+    crud.add_user_payment(db, user_id=user_id, payment=schemas.PaymentCreate(amount=100, date=today.isoformat()))
+    print(f"payment re-score:   {(time.perf_counter() - start) * 1000:.1f} ms including the commit")
+
+    def collect(collector: int) -> list:
+        session, latencies = Session(), []
+        try:
+            for _ in range(CLAIMS_PER_COLLECTOR):
+                began = time.perf_counter()
+                worklist.claim(session, f"collector-{collector}", CLAIM_SIZE)
+                latencies.append(time.perf_counter() - began)
+        finally:
+            session.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=COLLECTORS) as pool:
+        latencies = sorted(t for ts in pool.map(collect, range(COLLECTORS)) for t in ts)
+    elapsed = time.perf_counter() - start
+    claimed = worklist.counts(db)["claimed"]
+    print(
+        f"claims:             {len(latencies):,} by {COLLECTORS} collectors in {elapsed:.2f} s, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+    )
+    print(f"debtors claimed:    {claimed:,} (expected {COLLECTORS * CLAIMS_PER_COLLECTOR * CLAIM_SIZE:,}, no overlaps)")
+
+
+if __name__ == "__main__":
+    main()
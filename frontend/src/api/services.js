@@ -47,3 +47,10 @@ export const aiGenerateBlockContent = (userId, block, prompt) =>
     block,
     prompt,
   });
+
+// Fill every action block of a timeline in one request
+export const aiGenerateTimelineContent = (userId, timeline, prompt) =>
+  apiClient.post(`/strategies/${userId}/ai-generate-timeline-content`, {
+    timeline,
+    prompt,
+  });
@@ -36,7 +36,7 @@ import {
   updateStrategy as updateStrategyThunk,
 } from '../features/strategies/strategiesSlice.js';
 import { fetchUsers, fetchAnalytics } from '../features/users/usersSlice.js';
-import { getUser, aiGenerateBlockContent } from '../api/services.js';
+import { getUser, aiGenerateBlockContent, aiGenerateTimelineContent } from '../api/services.js';
 import { Trash2, AlertTriangle, Plus } from 'lucide-react';
 
 const DEFAULT_COLUMNS = ['Day 1-7', 'Day 8-14', 'Day 15-30', 'Day 31-50', 'Day 51-90', 'Day 90+'];
@@ -86,6 +86,7 @@ const StrategyPlanning = () => {
   const [blockAIPrompt, setBlockAIPrompt] = useState('');
   const [blockAIGenerating, setBlockAIGenerating] = useState(false);
   const [blockAIError, setBlockAIError] = useState(null);
+  const [timelineAIGenerating, setTimelineAIGenerating] = useState(false);
 
   const currentStrategy = strategyState[selectedId];
 
@@ -391,6 +392,23 @@ const StrategyPlanning = () => {
     }
   };
 
+  const handleGenerateAllContent = async () => {
+    try {
+      setTimelineAIGenerating(true);
+      setValidationError(null);
+      const res = await aiGenerateTimelineContent(selectedId, timeline, prompt);
+      const filled = res?.data?.timeline;
+      if (filled) {
+        setTimeline(filled);
+      }
+    } catch (err) {
+      console.error('Failed to generate timeline content with AI', err);
+      setValidationError('Failed to generate content. Please try again.');
+    } finally {
+      setTimelineAIGenerating(false);
+    }
+  };
+
   const handleExecute = async () => {
     await dispatch(executeThunk(selectedId));
     // Refresh users & analytics to reflect status change
@@ -414,6 +432,9 @@ const StrategyPlanning = () => {
         <Button variant="outline" onClick={openPromptDialog}>
           AI Generate
         </Button>
+        <Button variant="outline" onClick={handleGenerateAllContent} disabled={timelineAIGenerating}>
+          {timelineAIGenerating ? 'Generating...' : 'Fill All Content'}
+        </Button>
         <Button onClick={handleSave}>
           Save Strategy
         </Button>
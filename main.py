@@ -1,18 +1,72 @@
 from __future__ import annotations
 
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app import database, models
+from app import (
+    communication_log,
+    contact_routes,
+    crud,
+    database,
+    dispatch,
+    llm_client,
+    migrations,
+    models,
+    reaging,
+    strategy_scheduler,
+)
+from app.routers_communications import router as communications_router
+from app.routers_dispatch import router as dispatch_router
+from app.routers_exports import router as exports_router
 from app.routers_ingestion import router as ingestion_router
+from app.routers_metrics import router as metrics_router
+from app.routers_reconciliation import router as reconciliation_router
 from app.routers_users import router as users_router
-from app.routers_strategies import router as strategies_router
+from app.routers_worklist import router as worklist_router
+from app.routers_strategies import enqueue_due, router as strategies_router
 
 
-# Create DB tables
+# Create DB tables, then add the columns older databases are missing
 models.Base.metadata.create_all(bind=database.engine)
+migrations.upgrade(database.engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client for all LLM calls; it and the dispatch adapters are closed on shutdown
+    await llm_client.startup()
+    # Drop communication log partitions past retention; backfill strategy heads and contact routes
+    # for older databases
+    with database.SessionLocal() as db:
+        communication_log.drop_expired(db)
+        crud.ensure_strategy_heads(db)
+        contact_routes.ensure_built(db)
+    # Background strategy scheduler, outbox dispatcher and re-aging, when their intervals are set
+    tasks = []
+    interval = strategy_scheduler.interval_from_env()
+    if interval > 0:
+        tasks.append(asyncio.create_task(strategy_scheduler.run_forever(interval, on_due=enqueue_due)))
+    poll_interval = dispatch.interval_from_env()
+    if poll_interval > 0:
+        tasks.append(asyncio.create_task(dispatch.dispatcher.run_forever(poll_interval=poll_interval)))
+    reaging_interval = reaging.interval_from_env()
+    if reaging_interval > 0:
+        tasks.append(asyncio.create_task(reaging.run_forever(reaging_interval)))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        await dispatch.shutdown()
+        await llm_client.shutdown()
+
 
-app = FastAPI(title="Collections Strategy Backend", version="0.1.0")
+app = FastAPI(title="Collections Strategy Backend", version="0.1.0", lifespan=lifespan)
 
 # CORS: allow all origins for prototype; tighten for production
 # Note: Cannot use allow_origins=["*"] with allow_credentials=True
@@ -30,6 +84,12 @@ app.add_middleware(
 app.include_router(ingestion_router)
 app.include_router(users_router)
 app.include_router(strategies_router)
+app.include_router(reconciliation_router)
+app.include_router(exports_router)
+app.include_router(metrics_router)
+app.include_router(dispatch_router)
+app.include_router(communications_router)
+app.include_router(worklist_router)
 
 
 @app.get("/")
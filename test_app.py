@@ -1,3 +1,6 @@
+from uuid import uuid4
+
+import pytest
 from fastapi.testclient import TestClient
 
 from main import app
@@ -82,3 +85,1782 @@ def test_ai_generate_injects_contact_details():
     ]
     assert decision_blocks, "Generated strategy should include a decision block"
     assert decision_blocks[0]["decision_outputs"], "Decision block must include outputs"
+
+
+def test_concurrent_payments_are_not_lost():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app import crud, schemas
+    from app.database import SessionLocal
+
+    payload = {"name": "Concurrent Payer", "details": {"amount_owed": 100000}}
+    resp = client.post("/ingestion/add-user", json=payload)
+    assert resp.status_code == 200
+    user_id = resp.json()["id"]
+
+    workers, per_worker = 8, 10
+
+    def post_payments(worker: int) -> None:
+        db = SessionLocal()
+        try:
+            for i in range(per_worker):
+                payment = schemas.PaymentCreate(
+                    amount=10, date="2025-11-01", notes=f"w{worker}-{i}"
+                )
+                crud.add_user_payment(db, user_id=user_id, payment=payment)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(post_payments, range(workers)))
+
+    resp = client.get(f"/users/{user_id}")
+    details = resp.json()["data"]["details"]
+    assert len(details["payment_history"]) == workers * per_worker
+    assert details["total_paid"] == 10 * workers * per_worker
+    assert details["remaining_amount"] == 100000 - 10 * workers * per_worker
+
+
+def test_reconcile_statement_auto_posts_and_queues():
+    alpha = client.post(
+        "/ingestion/add-user",
+        json={"name": "Reconcile Alpha", "details": {"amount_owed": 1000, "due_date": "2025-11-01"}},
+    ).json()["id"]
+    beta = client.post(
+        "/ingestion/add-user",
+        json={"name": "Reconcile Beta", "details": {"amount_owed": 500, "due_date": "2025-11-01"}},
+    ).json()["id"]
+
+    statement = (
+        "Date,Payer,Amount,Reference\n"
+        "2025-11-03,\"ALPHA, RECONCILE\",1000.00,TX1\n"
+        "2025-11-04,Reconcile Betaa,500,TX2\n"
+        "2025-11-05,Nobody Known,42.50,TX3\n"
+    )
+    resp = client.post(
+        "/reconciliation/statements",
+        files={"file": ("statement.csv", statement, "text/csv")},
+    )
+    assert resp.status_code == 200
+    batch = resp.json()
+    assert batch["total_lines"] == 3
+    assert batch["auto_posted"] == 2
+    assert batch["queued"] == 1
+
+    for user_id in (alpha, beta):
+        details = client.get(f"/users/{user_id}").json()["data"]
+        assert details["status"] == "finished"
+        assert details["details"]["payment_history"][0]["installment_number"] == 1
+
+    queue = client.get("/reconciliation/review-queue", params={"batch_id": batch["id"]}).json()
+    assert [item["payer_name"] for item in queue] == ["Nobody Known"]
+
+    resp = client.post(
+        f"/reconciliation/review-queue/{queue[0]['id']}/resolve", json={"user_id": alpha}
+    )
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "resolved"
+    details = client.get(f"/users/{alpha}").json()["data"]["details"]
+    assert details["total_paid"] == 1042.5
+
+
+def test_reconciliation_posts_once_and_queues_vanished_users(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app import models, reconciliation
+    from app.database import SessionLocal
+
+    payer = client.post("/ingestion/add-user", json={"name": "Resolve Race", "details": {"amount_owed": 900}}).json()
+    statement = "Payer,Amount\nSomeone Unknown,90\n"
+    batch = client.post("/reconciliation/statements", files={"file": ("s.csv", statement, "text/csv")}).json()
+    item_id = client.get("/reconciliation/review-queue", params={"batch_id": batch["id"]}).json()[0]["id"]
+
+    def resolve(_):
+        db = SessionLocal()
+        try:
+            item = db.get(models.ReconciliationItem, item_id)
+            reconciliation.resolve_item(db, item, user_id=payer["id"])
+            return True
+        except ValueError:
+            return False
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert sorted(pool.map(resolve, range(4))) == [False, False, False, True]
+    assert client.get(f"/users/{payer['id']}").json()["data"]["details"]["total_paid"] == 90
+
+    # A confident match whose user is gone is queued for review, not counted as posted.
+    ghost = 10**9
+    index = reconciliation.DebtorIndex()
+    index.add(ghost, "Ghost Payer", {"amount_owed": 75})
+    monkeypatch.setattr(reconciliation.DebtorIndex, "from_db", classmethod(lambda cls, db: index))
+    statement = "Payer,Amount\nGhost Payer,75\n"
+    batch = client.post("/reconciliation/statements", files={"file": ("s.csv", statement, "text/csv")}).json()
+    assert (batch["auto_posted"], batch["queued"]) == (0, 1)
+    queued = client.get("/reconciliation/review-queue", params={"batch_id": batch["id"]}).json()
+    assert queued[0]["reason"].endswith(f"matched user {ghost} no longer exists")
+
+    # Resolving it against the missing user is a 404 and leaves it in review.
+    resp = client.post(f"/reconciliation/review-queue/{queued[0]['id']}/resolve", json={})
+    assert resp.status_code == 404
+    assert client.get("/reconciliation/review-queue", params={"batch_id": batch["id"]}).json()[0]["status"] == "review"
+
+
+def test_aging_report_buckets():
+    import pandas as pd
+
+    from app import portfolio
+
+    frame = pd.DataFrame(
+        {
+            "id": [1, 2, 3, 4, 5, 6],
+            "status": ["pending", "ongoing", "ongoing", "pending", "finished", "pending"],
+            "group_id": [None, 7, 7, None, None, None],
+            "due_date": ["2025-01-20", "2024-12-15", "2024-10-01", "2025-03-01", "2024-01-01", None],
+            "amount_owed": [100, 200, 300, 50, 80, 40],
+            "total_paid": [None, 50, None, None, 80, None],
+            "remaining_amount": [None, None, None, None, 0, None],
+        }
+    )
+    snapshot = portfolio.snapshot_from_frame(frame)
+    report = portfolio.compute_aging_report(snapshot, today=pd.Timestamp("2025-02-01").date())
+
+    assert report["buckets"] == ["0-30", "31-60", "61-90", "91+"]
+    assert report["total"]["counts"] == [2, 1, 0, 1]
+    assert report["total"]["balances"] == [150.0, 150.0, 0.0, 300.0]
+    assert report["by_status"]["ongoing"]["counts"] == [0, 1, 0, 1]
+    assert {g["group_id"]: g["counts"] for g in report["by_group"]} == {
+        None: [2, 0, 0, 0],
+        7: [0, 1, 0, 1],
+    }
+    assert report["undated"] == {"count": 1, "balance": 40.0}
+
+    # Rule-based memberships count too, and a user counts toward each of their groups.
+    memberships = pd.DataFrame({"group_id": [7, 7, 9, 9, 9], "user_id": [2, 3, 1, 2, 99]})
+    snapshot = portfolio.snapshot_from_frame(frame, memberships=memberships)
+    report = portfolio.compute_aging_report(snapshot, today=pd.Timestamp("2025-02-01").date())
+    assert {g["group_id"]: g["counts"] for g in report["by_group"]} == {
+        None: [1, 0, 0, 0],
+        7: [0, 1, 0, 1],
+        9: [1, 1, 0, 0],
+    }
+
+    resp = client.get("/users/analytics/aging", params={"edges": [15, 45]})
+    assert resp.status_code == 200
+    assert resp.json()["buckets"] == ["0-15", "16-45", "46+"]
+    assert client.get("/users/analytics/aging", params={"edges": [60, 30]}).status_code == 400
+
+
+def test_group_analytics_single_query():
+    from sqlalchemy import event
+
+    from app.database import engine
+
+    ids = []
+    for name, details, in [
+        ("Group Analytics A", {"amount_owed": 1000, "total_paid": 400, "due_date": "2000-01-01"}),
+        ("Group Analytics B", {"amount_owed": 500, "due_date": "2999-01-01"}),
+    ]:
+        ids.append(client.post("/ingestion/add-user", json={"name": name, "details": details}).json()["id"])
+    resp = client.post("/users/group", json={"name": f"Analytics Group {uuid4().hex[:8]}", "user_ids": ids})
+    assert resp.status_code == 200
+    group_id = resp.json()["id"]
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        resp = client.get("/users/groups/analytics")
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert resp.status_code == 200
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+
+    row = next(g for g in resp.json() if g["group_id"] == group_id)
+    assert row["member_count"] == 2
+    assert row["total_amount_owed"] == 1500
+    assert row["total_amount_collected"] == 400
+    assert row["total_remaining"] == 1100
+    assert row["counts_by_status"]["pending"] == 2
+    assert row["avg_overdue_days"] > 365 * 20
+
+
+def test_streaming_exports():
+    import gzip
+    import json
+
+    payload = {"name": "Export Me", "details": {"amount_owed": 300, "service": "Termite"}}
+    user_id = client.post("/ingestion/add-user", json=payload).json()["id"]
+    client.post(f"/users/{user_id}/payments", json={"amount": 100, "date": "2025-11-01"})
+    client.post(f"/strategies/{user_id}/ai-generate")
+
+    resp = client.get(
+        "/exports/users",
+        params={"format": "ndjson", "fields": ["amount_owed", "service"]},
+        headers={"Accept-Encoding": "identity"},
+    )
+    assert resp.status_code == 200
+    assert "content-encoding" not in resp.headers
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    row = next(r for r in rows if r["id"] == user_id)
+    assert row["service"] == "Termite" and row["amount_owed"] == 300
+
+    resp = client.get("/exports/payments", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.text.splitlines()[0] == "user_id,user_name,amount,date,installment_number,notes,added_at"
+    assert any(line.startswith(f"{user_id},Export Me,100.0,2025-11-01") for line in resp.text.splitlines())
+
+    with client.stream("GET", "/exports/strategies", params={"format": "ndjson"},
+                       headers={"Accept-Encoding": "gzip"}) as stream:
+        raw = b"".join(stream.iter_raw())
+    rows = [json.loads(line) for line in gzip.decompress(raw).decode().splitlines()]
+    assert any(r["owner_id"] == user_id and r["owner_type"] == "user" and r["timeline"] for r in rows)
+
+
+def test_ai_generate_uses_shared_llm_client(monkeypatch):
+    import json
+
+    import httpx
+
+    from app import llm_client
+
+    calls = []
+    timeline = [{"timing": "Day 1-7", "blocks": [{"block_type": "action", "source": "email",
+                                                  "tone": "friendly", "content": "From the model"}]}]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        body = {"choices": [{"message": {"content": json.dumps({"timeline": timeline})}}]}
+        return httpx.Response(200, json=body)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_API_BASE_URL", "http://llm.test/v1")
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        user_id = client.post("/ingestion/add-user", json={"name": "Pooled", "details": {"amount_owed": 10}}).json()["id"]
+        resp = client.post(f"/strategies/{user_id}/ai-generate")
+    finally:
+        llm_client.set_client(None)
+
+    assert resp.status_code == 200
+    assert resp.json()["timeline"][0]["blocks"][0]["content"] == "From the model"
+    assert len(calls) == 1
+    assert str(calls[0].url) == "http://llm.test/v1/chat/completions"
+    assert calls[0].headers["authorization"] == "Bearer test-key"
+
+
+def test_llm_client_from_another_loop_is_closed_when_replaced():
+    import asyncio
+    import threading
+
+    from app import llm_client
+
+    async def current():
+        client = llm_client.get_client()
+        await asyncio.sleep(0)  # let a replaced client's close run
+        return client
+
+    llm_client.set_client(None)
+    try:
+        finished = asyncio.run(current())  # that loop is closed once run() returns
+        replacement = asyncio.run(current())
+        assert replacement is not finished and finished.is_closed
+
+        # A client whose loop still runs elsewhere is closed on that loop.
+        other = asyncio.new_event_loop()
+        thread = threading.Thread(target=other.run_forever, daemon=True)
+        thread.start()
+        on_other = asyncio.run_coroutine_threadsafe(current(), other).result()
+        assert asyncio.run(current()) is not on_other
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), other).result()
+        assert on_other.is_closed
+        other.call_soon_threadsafe(other.stop)
+        thread.join()
+        other.close()
+    finally:
+        llm_client.set_client(None)
+
+
+def test_llm_cache_reuses_timeline_across_similar_debtors(monkeypatch, tmp_path):
+    import json
+    import sqlite3
+
+    import httpx
+
+    from app import llm_cache, llm_client
+
+    calls = []
+    timeline = [{"timing": "Day 1-7", "blocks": [{"block_type": "action", "source": "email",
+                                                  "tone": "friendly", "content": "Cached plan"}]}]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        body = {"choices": [{"message": {"content": json.dumps({"timeline": timeline})}}]}
+        return httpx.Response(200, json=body)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        user_ids = []
+        for email in ("one@example.com", "two@example.com"):
+            details = {
+                "amount_owed": 777,
+                "service": "Cache Test",
+                "contact_methods": [{"method": "email", "value": email, "is_preferred": True}],
+            }
+            user_ids.append(
+                client.post("/ingestion/add-user", json={"name": email, "details": details}).json()["id"]
+            )
+
+        first = client.post(f"/strategies/{user_ids[0]}/ai-generate").json()
+        second = client.post(f"/strategies/{user_ids[1]}/ai-generate").json()
+        assert len(calls) == 1
+        assert first["timeline"][0]["blocks"][0]["contact_method_detail"] == "one@example.com"
+        assert second["timeline"][0]["blocks"][0]["contact_method_detail"] == "two@example.com"
+
+        client.post(f"/strategies/{user_ids[1]}/ai-generate", json={"use_cache": False})
+        assert len(calls) == 2
+    finally:
+        llm_client.set_client(None)
+
+    metrics = client.get("/metrics/").json()["llm_cache"]
+    assert metrics["hits"] >= 1 and metrics["misses"] >= 1
+
+    # Persistence across restarts and TTL/LRU behaviour
+    path = str(tmp_path / "cache.sqlite")
+    cache = llm_cache.LLMCache(max_entries=2, ttl_seconds=60, path=path)
+    for key in ("a", "b", "c"):
+        cache.set(key, {"value": key})
+    assert cache.get("a") == {"value": "a"}  # evicted from memory, reloaded from disk
+    assert llm_cache.LLMCache(path=path).get("c") == {"value": "c"}
+    assert llm_cache.LLMCache(ttl_seconds=-1).get("missing") is None
+
+    # Expired rows are deleted from the file on write and on open, not just skipped.
+    conn = sqlite3.connect(path, isolation_level=None)
+
+    def keys():
+        return sorted(key for key, in conn.execute("SELECT key FROM llm_cache"))
+
+    conn.execute("UPDATE llm_cache SET expires_at = 0 WHERE key = 'a'")
+    cache.set("d", {"value": "d"})
+    assert keys() == ["b", "c", "d"]
+    conn.execute("UPDATE llm_cache SET expires_at = 0 WHERE key = 'b'")
+    llm_cache.LLMCache(path=path)
+    assert keys() == ["c", "d"]
+    conn.close()
+
+
+def test_batch_ai_generate_with_fallback(monkeypatch):
+    import asyncio
+    import json
+
+    import httpx
+
+    from app import llm_client, schemas, strategy_batch
+    from app.database import SessionLocal
+
+    timeline = [{"timing": "Day 1-7", "blocks": [{"block_type": "action", "source": "sms",
+                                                  "tone": "neutral", "content": "Batch plan"}]}]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if "Amount owed: 13" in request.content.decode():
+            return httpx.Response(503)
+        body = {"choices": [{"message": {"content": json.dumps({"timeline": timeline})}}]}
+        return httpx.Response(200, json=body)
+
+    user_ids = [
+        client.post("/ingestion/add-user", json={"name": f"Batch {amount}", "details": {"amount_owed": amount}}).json()["id"]
+        for amount in (11, 12, 13, 14, 15)
+    ]
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        resp = client.post(
+            "/strategies/batch/ai-generate",
+            json={
+                "owner_ids": user_ids,
+                "prompt": "Batch prompt",
+                "concurrency": 2,
+                "chunk_size": 2,
+                "requests_per_minute": 6000,
+                "tokens_per_minute": 10_000_000,
+            },
+        )
+    finally:
+        llm_client.set_client(None)
+    assert resp.status_code == 202
+    job = client.get(f"/strategies/batch/{resp.json()['id']}").json()
+
+    assert job["status"] == "completed"
+    assert job["total"] == job["processed"] == 5
+    assert job["ai_generated"] == 4
+    assert job["fallback"] == 1
+
+    contents = {
+        uid: client.get(f"/strategies/{uid}").json()["timeline"][0]["blocks"][0]["content"]
+        for uid in user_ids
+    }
+    assert contents[user_ids[2]].startswith("Gentle reminder")
+    assert all(contents[uid] == "Batch plan" for uid in user_ids if uid != user_ids[2])
+
+    # An owner whose generation raises is counted as failed only, not also as a fallback.
+    async def generate(details, prompt, use_cache=True):
+        if details["amount_owed"] == 12:
+            raise RuntimeError("model exploded")
+        return timeline, "ai"
+
+    db = SessionLocal()
+    try:
+        body = schemas.StrategyBatchRequest(owner_ids=user_ids)
+        job_id = strategy_batch.create_job(db, body=body, owner_ids=user_ids).id
+    finally:
+        db.close()
+    asyncio.run(strategy_batch.run_job(job_id, generate=generate, fallback=lambda d, p: [], chunk_size=2))
+    job = client.get(f"/strategies/batch/{job_id}").json()
+    assert (job["status"], job["processed"], job["ai_generated"], job["fallback"], job["failed"]) == (
+        "completed", 5, 4, 0, 1)
+
+    # A failed save stops the job: no task keeps generating or waiting on the queue after it finishes.
+    calls = []
+
+    async def slow_generate(details, prompt, use_cache=True):
+        calls.append(details["amount_owed"])
+        await asyncio.sleep(0.01)
+        return timeline, "ai"
+
+    def failing_save(*args):
+        raise RuntimeError("disk full")
+
+    async def run_failing_job():
+        await strategy_batch.run_job(
+            job_id, generate=slow_generate, fallback=lambda d, p: [], concurrency=1, chunk_size=1
+        )
+        generated = len(calls)
+        await asyncio.sleep(0.05)
+        return generated, asyncio.all_tasks() - {asyncio.current_task()}
+
+    monkeypatch.setattr(strategy_batch, "_save", failing_save)
+    generated, leftover = asyncio.run(run_failing_job())
+    assert len(calls) == generated and not leftover
+    job = client.get(f"/strategies/batch/{job_id}").json()
+    assert (job["status"], job["error"]) == ("failed", "disk full")
+
+
+def test_ai_generate_timeline_content_fans_out(monkeypatch):
+    import asyncio
+    import time
+
+    import httpx
+
+    from app import llm_client
+
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"Message {len(calls)}"}}]})
+
+    user = client.post("/ingestion/add-user", json={"name": "Timeline Fill", "details": {"amount_owed": 900}}).json()
+    timeline = [
+        {"timing": f"Day {i}", "blocks": [
+            {"block_type": "action", "source": source, "tone": "friendly", "content": ""},
+            {"block_type": "decision", "decision_prompt": "Paid?"},
+        ]}
+        for i, source in enumerate(["email", "sms", "call", "email", "whatsapp", "letter"])
+    ]
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        start = time.perf_counter()
+        resp = client.post(
+            f"/strategies/{user['id']}/ai-generate-timeline-content",
+            json={"timeline": timeline, "prompt": "Fill all", "use_cache": False},
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        llm_client.set_client(None)
+
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["generated"] == 6
+    # Five distinct channels -> five concurrent calls, not six serial ones.
+    assert len(calls) == 5
+    assert elapsed < 0.6
+    actions = [col["blocks"][0] for col in data["timeline"]]
+    assert all(block["content"].startswith("Message") for block in actions)
+    assert actions[0]["content"] == actions[3]["content"]
+    assert data["timeline"][0]["blocks"][1]["block_type"] == "decision"
+
+
+def _sse_events(text):
+    import json
+
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_ai_generate_stream_emits_columns_then_strategy(monkeypatch):
+    import json
+
+    import httpx
+
+    from app import llm_client
+    from app.timeline_stream import TimelineColumnParser
+
+    document = json.dumps({"timeline": [
+        {"timing": "Day 1-7", "blocks": [{"block_type": "action", "source": "email",
+                                          "tone": "friendly", "content": "Hi {there}"}]},
+        {"timing": "Day 8-14", "blocks": [{"block_type": "action", "source": "sms",
+                                           "tone": "firm", "content": "Pay \"now\""}]},
+    ]})
+
+    # Columns become available one at a time, before the document is complete.
+    parser = TimelineColumnParser()
+    seen = [len(parser.feed(ch)) for ch in document]
+    assert sum(seen) == 2 and seen.index(1) < len(document) - len(document) // 3
+
+    async def chunks():
+        for i in range(0, len(document), 16):
+            delta = {"choices": [{"delta": {"content": document[i:i + 16]}}]}
+            yield f"data: {json.dumps(delta)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=chunks())
+
+    user = client.post(
+        "/ingestion/add-user",
+        json={"name": "Stream User", "details": {"amount_owed": 321, "contact_methods": [
+            {"method": "email", "value": "stream@example.com"}]}},
+    ).json()
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        resp = client.post(f"/strategies/{user['id']}/ai-generate/stream", json={"use_cache": False})
+    finally:
+        llm_client.set_client(None)
+
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(resp.text)
+    assert [name for name, _ in events] == ["start", "column", "column", "strategy"]
+    assert events[1][1]["column"]["blocks"][0]["contact_method_detail"] == "stream@example.com"
+    final = events[-1][1]
+    assert final["source"] == "ai"
+    assert [col["timing"] for col in final["timeline"]] == ["Day 1-7", "Day 8-14"]
+    assert client.get(f"/strategies/{user['id']}").json()["id"] == final["id"]
+
+
+def test_llm_deadline_and_circuit_breaker_fail_fast(monkeypatch):
+    import asyncio
+    import time
+
+    import httpx
+
+    from app import llm_client, routers_strategies
+
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(1.0)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "too late"}}]})
+
+    user = client.post("/ingestion/add-user", json={"name": "Breaker User", "details": {"amount_owed": 50}}).json()
+    block = {"block_type": "action", "source": "email", "tone": "firm", "content": ""}
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(routers_strategies, "BLOCK_CONTENT_DEADLINE_SECONDS", 0.05)
+    monkeypatch.setattr(llm_client.breaker, "failure_threshold", 3)
+    llm_client.breaker.reset()
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        start = time.perf_counter()
+        for _ in range(5):
+            resp = client.post(
+                f"/strategies/{user['id']}/ai-generate-block-content",
+                json={"block": block, "use_cache": False},
+            )
+            assert resp.status_code == 200
+            assert resp.json()["content"].startswith("This is a reminder")
+        elapsed = time.perf_counter() - start
+        breaker = client.get("/metrics/").json()["llm_client"]["breaker"]
+    finally:
+        llm_client.set_client(None)
+        llm_client.breaker.reset()
+
+    # Three calls hit the deadline, then the open breaker skips the API entirely.
+    assert len(calls) == 3
+    assert elapsed < 1.0
+    assert breaker["state"] == "open"
+    assert breaker["short_circuited"] == 2
+
+
+def test_llm_probe_cancelled_on_rate_limiter_is_released(monkeypatch):
+    import asyncio
+
+    import httpx
+
+    from app import llm_client
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    payload = {"messages": [{"role": "user", "content": "hi"}]}
+
+    async def scenario():
+        llm_client.breaker.reset()
+        llm_client.breaker.record_failure()  # open, and due for a half-open probe right away
+        limiter = llm_client.RateLimiter(requests_per_minute=1)
+        await limiter.acquire(1)  # budget spent: the next call waits about a minute
+        with llm_client.rate_limited(limiter):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(llm_client.post_chat_completion(payload, api_key="k"), 0.05)
+        # The abandoned probe does not keep the breaker rejecting every later call.
+        return await llm_client.post_chat_completion(payload, api_key="k")
+
+    monkeypatch.setattr(llm_client.breaker, "failure_threshold", 1)
+    monkeypatch.setattr(llm_client.breaker, "reset_timeout", 0.0)
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        data = asyncio.run(scenario())
+        state = llm_client.breaker.state
+    finally:
+        llm_client.set_client(None)
+        llm_client.breaker.reset()
+    assert data["choices"][0]["message"]["content"] == "ok"
+    assert state == "closed"
+
+
+def test_llm_hedged_request_wins_over_slow_call(monkeypatch):
+    import asyncio
+
+    import httpx
+
+    from app import llm_client
+
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(2.0 if len(calls) == 1 else 0.01)
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"call {len(calls)}"}}]})
+
+    async def run():
+        llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            return await llm_client.post_chat_completion({"messages": []}, api_key="k", deadline=1.0)
+        finally:
+            llm_client.set_client(None)
+
+    monkeypatch.setenv("LLM_HEDGE", "1")
+    monkeypatch.setattr(llm_client, "latencies", llm_client.LatencyTracker())
+    for _ in range(20):
+        llm_client.latencies.record(0.05)
+    hedge_wins = llm_client.metrics()["hedge_wins"]
+
+    data = asyncio.run(run())
+
+    assert data["choices"][0]["message"]["content"] == "call 2"
+    assert len(calls) == 2
+    assert llm_client.metrics()["hedge_wins"] == hedge_wins + 1
+
+
+def test_segment_refresh_reuses_one_strategy_per_segment(monkeypatch):
+    import asyncio
+    import json
+    from datetime import date, timedelta
+
+    import httpx
+
+    from app import llm_client, segmentation
+
+    service = f"fiber-{uuid4().hex[:8]}"
+    segment_calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        prompt = json.loads(request.content)["messages"][1]["content"]
+        if service in prompt:
+            segment_calls.append(prompt)
+        timeline = [{"timing": "Day 1-7", "blocks": [
+            {"block_type": "action", "source": "sms", "tone": "firm", "content": "Segment message"}]}]
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps({"timeline": timeline})}}]})
+
+    due = (date.today() - timedelta(days=45)).isoformat()
+    users = [
+        client.post("/ingestion/add-user", json={"name": f"Segment {i}", "details": {
+            "amount_owed": 7000, "due_date": due, "preferred_contact": "sms", "service": service,
+            "contact_methods": [{"method": "sms", "value": f"+1555000{i}"}],
+        }}).json()
+        for i in range(3)
+    ]
+
+    # The bulk steps run in a worker thread, not on the event loop.
+    on_loop = []
+    for step in ("refresh_memberships", "assign_segment_strategies"):
+        def record(*args, _step=getattr(segmentation, step), **kwargs):
+            on_loop.append(asyncio._get_running_loop() is not None)
+            return _step(*args, **kwargs)
+        monkeypatch.setattr(segmentation, step, record)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    llm_client.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        first = client.post("/strategies/segments/refresh", json={"prompt": "Segment prompt"}).json()
+        second = client.post("/strategies/segments/refresh", json={"prompt": "Segment prompt"}).json()
+        client.post(f"/users/{users[0]['id']}/payments", json={"amount": 5000, "date": date.today().isoformat()})
+        third = client.post("/strategies/segments/refresh", json={"prompt": "Segment prompt"}).json()
+    finally:
+        llm_client.set_client(None)
+
+    assert on_loop and not any(on_loop)
+    # Three members of one profile cost one model call.
+    assert len(segment_calls) == 2  # original segment, then the 0-5000 band user 0 moved into
+    assert first["assigned"] >= 3
+    assert second["checked"] == 0 and second["generated"] == 0 and second["assigned"] == 0
+    assert third["checked"] == 1 and third["moved"] == 1 and third["assigned"] == 1
+
+    for i, user in enumerate(users):
+        block = client.get(f"/strategies/{user['id']}").json()["timeline"][0]["blocks"][0]
+        assert block["content"] == "Segment message"
+        assert block["contact_method_detail"] == f"+1555000{i}"
+
+    segments = {s["key"]: s for s in client.get("/strategies/segments").json()}
+    key = f"amount_band=5000-20000|overdue_band=31-60|preferred_contact=sms|service={service}"
+    assert segments[key]["member_count"] == 2
+
+
+def test_strategy_template_versions_and_bulk_apply():
+    name = f"soft-touch-{uuid4().hex[:8]}"
+    timeline = [
+        {"timing": "Day 1-7", "blocks": [
+            {"block_type": "action", "source": "email", "tone": "friendly",
+             "content": "Hi {name}, {amount} was due on {due_date}."}]},
+        {"timing": "Day 8-14", "blocks": [
+            {"block_type": "action", "source": "sms", "tone": "firm", "content": "Reply \"PAY\" to settle {amount}."},
+            {"block_type": "decision", "decision_prompt": "Paid?"}]},
+    ]
+
+    bad = client.post("/strategies/templates", json={"name": name, "timeline": [
+        {"timing": "Day 1", "blocks": [{"content": "{balance}"}]}]})
+    assert bad.status_code == 400 and "balance" in bad.json()["detail"]
+
+    v1 = client.post("/strategies/templates", json={"name": name, "timeline": timeline}).json()
+    timeline[0]["blocks"][0]["tone"] = "neutral"
+    v2 = client.post("/strategies/templates", json={"name": name, "timeline": timeline}).json()
+    assert (v1["version"], v2["version"]) == (1, 2)
+    assert [t["version"] for t in client.get("/strategies/templates", params={"name": name}).json()] == [1, 2]
+
+    users = [
+        client.post("/ingestion/add-user", json={"name": f"Tpl {i}", "details": {
+            "amount_owed": 1200 * (i + 1), "due_date": "2025-01-15",
+            "contact_methods": [{"method": "email", "value": f"tpl{i}@example.com"}],
+        }}).json()
+        for i in range(3)
+    ]
+    existing = client.post(f"/strategies/{users[0]['id']}", json={"timeline": [{"timing": "Old", "blocks": []}]}).json()
+
+    resp = client.post("/strategies/templates/apply", json={
+        "name": name, "version": 1, "owner_ids": [u["id"] for u in users]})
+    assert resp.status_code == 200, resp.text
+    assert resp.json() == {"template_id": v1["id"], "name": name, "version": 1,
+                           "applied": 3, "created": 2, "updated": 1}
+
+    strategy = client.get(f"/strategies/{users[1]['id']}").json()
+    first, second = strategy["timeline"][0]["blocks"][0], strategy["timeline"][1]["blocks"]
+    assert first["content"] == "Hi Tpl 1, ₹2,400 was due on 2025-01-15."
+    assert first["tone"] == "friendly"
+    assert first["contact_method_detail"] == "tpl1@example.com"
+    assert second[0]["content"] == 'Reply "PAY" to settle ₹2,400.'
+    assert second[0]["contact_method_detail"] is None
+    assert second[1]["block_type"] == "decision"
+    assert strategy["prompt"] == f"template:{name}@v1"
+    latest = client.get(f"/strategies/{users[0]['id']}").json()
+    assert latest["id"] != existing["id"] and latest["version"] == existing["version"] + 1
+
+
+def test_shared_timelines_are_stored_once_with_copy_on_write():
+    from app import crud, models
+    from app.database import SessionLocal
+
+    marker = uuid4().hex
+    shared = [{"timing": "Day 1-7", "blocks": [
+        {"block_type": "action", "source": "email", "tone": "friendly", "content": f"Campaign {marker}"}]}]
+    users = [
+        client.post("/ingestion/add-user", json={"name": f"Campaign {i}", "details": {
+            "contact_methods": [{"method": "email", "value": f"campaign{i}@example.com"}]}}).json()
+        for i in range(4)
+    ]
+    ids = [u["id"] for u in users]
+
+    db = SessionLocal()
+    try:
+        crud.bulk_save_strategies(
+            db, owner_type="user", timelines={uid: shared for uid in ids}, apply_contacts=True
+        )
+        hashes = {s.timeline_hash for s in db.query(models.Strategy).filter(models.Strategy.user_id.in_(ids))}
+        assert len(hashes) == 1 and None not in hashes
+        shared_hash = hashes.pop()
+
+        # Each owner still reads their own contact details.
+        first = client.get(f"/strategies/{ids[0]}").json()
+        assert first["timeline"][0]["blocks"][0]["contact_method_detail"] == "campaign0@example.com"
+
+        # Editing one owner's copy leaves the shared row and the other owners alone.
+        edited = first["timeline"]
+        edited[0]["blocks"][0]["content"] = "Edited"
+        client.post(f"/strategies/{ids[0]}", json={"timeline": edited})
+        intermediate = crud.get_latest_strategy_for_owner(db, owner_id=ids[0], owner_type="user").timeline_hash
+        edited[0]["blocks"][0]["content"] = "Edited again"
+        client.post(f"/strategies/{ids[0]}", json={"timeline": edited})
+
+        db.expire_all()
+        strategies = {uid: crud.get_latest_strategy_for_owner(db, owner_id=uid, owner_type="user") for uid in ids}
+        assert strategies[ids[0]].timeline_hash != shared_hash
+        assert strategies[ids[0]].timeline[0]["blocks"][0]["content"] == "Edited again"
+        assert all(strategies[uid].timeline_hash == shared_hash for uid in ids[1:])
+        assert client.get(f"/strategies/{ids[1]}").json()["timeline"][0]["blocks"][0]["content"] == f"Campaign {marker}"
+
+        # Earlier versions keep pointing at their own copies.
+        assert intermediate not in (shared_hash, strategies[ids[0]].timeline_hash)
+        assert db.get(models.StrategyTimeline, intermediate) is not None
+        assert db.get(models.StrategyTimeline, shared_hash) is not None
+    finally:
+        db.close()
+
+
+def test_strategy_versions_are_append_only_with_diff():
+    user_id = client.post("/ingestion/add-user", json={"name": "Versioned", "details": {}}).json()["id"]
+    assert client.get(f"/strategies/{user_id}").json() is None
+
+    def column(timing, content, tone="friendly"):
+        return {"timing": timing, "blocks": [
+            {"block_type": "action", "source": "email", "tone": tone, "content": content}]}
+
+    v1 = client.post(f"/strategies/{user_id}", json={"timeline": [column("Day 1-7", "Hello")]}).json()
+    v2 = client.post(f"/strategies/{user_id}", json={"timeline": [
+        column("Day 1-7", "Hello", tone="firm"), column("Day 8-14", "Pay now")]}).json()
+    v3 = client.post(f"/strategies/{user_id}", json={"timeline": [column("Day 8-14", "Pay now")]}).json()
+    assert [v["version"] for v in (v1, v2, v3)] == [1, 2, 3]
+
+    latest = client.get(f"/strategies/{user_id}").json()
+    assert latest["id"] == v3["id"] and latest["version"] == 3
+
+    versions = client.get(f"/strategies/{user_id}/versions").json()
+    assert [(v["version"], v["latest"]) for v in versions] == [(3, True), (2, False), (1, False)]
+    old = client.get(f"/strategies/{user_id}/versions/1").json()
+    assert old["timeline"][0]["blocks"][0]["content"] == "Hello"
+    assert client.get(f"/strategies/{user_id}/versions/9").status_code == 404
+
+    diff = client.get(f"/strategies/{user_id}/versions/diff", params={"from": 1, "to": 2}).json()
+    assert not diff["identical"]
+    assert {(c["op"], c["path"]) for c in diff["changes"]} == {
+        ("changed", "Day 1-7/0/tone"), ("added", "Day 8-14")}
+    latest_diff = client.get(f"/strategies/{user_id}/versions/diff").json()
+    assert (latest_diff["from_version"], latest_diff["to_version"]) == (2, 3)
+    assert [c["op"] for c in latest_diff["changes"]] == ["removed"]
+    same = client.get(f"/strategies/{user_id}/versions/diff", params={"from": 3, "to": 3}).json()
+    assert same["identical"] and same["changes"] == []
+
+    # Strategies saved before strategy_heads existed are found once heads are backfilled.
+    from sqlalchemy import insert
+
+    from app import crud, models
+    from app.database import SessionLocal
+
+    legacy = client.post("/ingestion/add-user", json={"name": "Legacy", "details": {}}).json()["id"]
+    db = SessionLocal()
+    try:
+        ids = db.execute(insert(models.Strategy).returning(models.Strategy.id, sort_by_parameter_order=True), [
+            {"user_id": legacy, "version": v, "timeline": [column("Day 1-7", f"Old {v}")]} for v in (1, 2)
+        ]).scalars().all()
+        db.commit()
+        assert client.get(f"/strategies/{legacy}").json() is None
+        assert crud.backfill_strategy_heads(db) >= 1
+        assert crud.backfill_strategy_heads(db) == 0
+    finally:
+        db.close()
+    latest = client.get(f"/strategies/{legacy}").json()
+    assert (latest["id"], latest["version"]) == (ids[1], 2)
+    assert client.post(f"/strategies/{legacy}", json={"timeline": [column("Day 1-7", "New")]}).json()["version"] == 3
+
+
+def test_scheduler_runs_timeline_columns_on_a_simulated_clock():
+    from datetime import datetime
+
+    from app import strategy_scheduler
+    from app.database import SessionLocal
+
+    assert strategy_scheduler.parse_timing("Day 8-14") == (8, 14)
+    assert strategy_scheduler.parse_timing("Day 90+") == (90, None)
+    assert strategy_scheduler.parse_timing("Week 2") == (8, 14)
+    assert strategy_scheduler.parse_timing("Unscheduled") is None
+
+    def column(timing, *sources):
+        return {"timing": timing, "blocks": [
+            {"block_type": "action", "source": source, "tone": "friendly", "content": timing} for source in sources]}
+
+    timeline = [column("Day 8-14", "sms"), column("Day 1-7", "email", "call"), column("Day 90+", "call"),
+                column("Someday", "email")]
+    fresh = client.post("/ingestion/add-user", json={"name": "Sched", "details": {"amount_owed": 100}}).json()["id"]
+    late = client.post("/ingestion/add-user", json={"name": "Sched Late", "details": {
+        "amount_owed": 100, "due_date": "2029-10-01"}}).json()["id"]
+    for uid in (fresh, late):
+        client.post(f"/strategies/{uid}", json={"timeline": timeline})
+
+    clock = strategy_scheduler.SimulatedClock(datetime(2030, 1, 1, 9))
+    strategy_scheduler.set_clock(clock)
+    db = SessionLocal()
+    seen = []
+
+    def run():
+        mine = []
+        strategy_scheduler.tick(db, on_due=lambda _, due: seen.extend(due))
+        while seen:
+            block = seen.pop()
+            if block.owner_id in (fresh, late):
+                mine.append((block.owner_id, block.timing, block.block["source"]))
+        return sorted(mine)
+
+    try:
+        first = client.post(f"/strategies/{fresh}/execute").json()["execution_id"]
+        second = client.post(f"/strategies/{fresh}/execute").json()["execution_id"]
+        client.post(f"/strategies/{late}/execute", params={"anchor": "due_date"})
+        execution = client.get(f"/strategies/{fresh}/execution").json()
+        assert execution["id"] == second != first
+        assert execution["status"] == "active" and execution["next_due_at"] == "2030-01-01T00:00:00"
+
+        # The late user's first two windows closed before execution; Day 90+ is open.
+        assert run() == [(fresh, "Day 1-7", "call"), (fresh, "Day 1-7", "email"), (late, "Day 90+", "call")]
+        assert client.get(f"/strategies/{late}/execution").json()["columns_expired"] == 2
+        assert client.get(f"/strategies/{late}/execution").json()["status"] == "completed"
+
+        clock.advance(days=3)
+        assert run() == []
+        clock.advance(days=5)
+        assert run() == [(fresh, "Day 8-14", "sms")]
+        clock.advance(days=100)
+        resp = client.post("/strategies/scheduler/tick")
+        assert resp.status_code == 200 and resp.json()["completed"] >= 1
+        execution = client.get(f"/strategies/{fresh}/execution").json()
+        assert (execution["status"], execution["current_timing"], execution["columns_done"]) == ("completed", "Day 90+", 3)
+    finally:
+        strategy_scheduler.set_clock(None)
+        db.close()
+
+
+def test_decision_blocks_route_executions_by_payment_history():
+    from datetime import datetime
+
+    from app import strategy_scheduler
+    from app.database import SessionLocal
+
+    def action(timing):
+        return {"timing": timing, "blocks": [{"block_type": "action", "source": "email", "content": timing}]}
+
+    decision = {"timing": "Day 8-14", "blocks": [{
+        "block_type": "decision", "decision_prompt": "Did they pay?",
+        "decision_sources": ["payment_history", "communication_log"],
+        "decision_outputs": [
+            {"condition": "If partial payment received", "next_timing": "Day 31-50", "action": "Thank them"},
+            {"condition": "If the moon is full", "next_timing": "Day 90+"},
+            {"condition": "If no response", "next_timing": "Day 15-30", "action": "Escalate"},
+        ]}]}
+    timeline = [action("Day 1-7"), decision, action("Day 15-30"), action("Day 31-50"), action("Day 90+")]
+    payer, silent, settled = [
+        client.post("/ingestion/add-user", json={"name": name, "details": {"amount_owed": 1000}}).json()["id"]
+        for name in ("Decides Payer", "Decides Silent", "Decides Settled")
+    ]
+
+    clock = strategy_scheduler.SimulatedClock(datetime(2031, 1, 1, 9))
+    strategy_scheduler.set_clock(clock)
+    db = SessionLocal()
+    try:
+        for uid in (payer, silent, settled):
+            client.post(f"/strategies/{uid}", json={"timeline": timeline})
+            client.post(f"/strategies/{uid}/execute")
+        # An old payment does not count; one made during the strategy does.
+        client.post(f"/users/{payer}/payments", json={"amount": 50, "date": "2030-06-01"})
+        client.post(f"/users/{silent}/payments", json={"amount": 50, "date": "2030-06-01"})
+        client.post(f"/users/{payer}/payments", json={"amount": 200, "date": "2031-01-04"})
+        client.post(f"/users/{settled}/payments", json={"amount": 1000, "date": "2031-01-04"})
+
+        clock.advance(days=7)
+        ties = []
+
+        def tie_breaker(contexts):
+            ties.extend(contexts)
+            return [1 for _ in contexts]
+
+        stats = strategy_scheduler.tick(db, tie_breaker=tie_breaker)
+        assert stats["decisions"] >= 3 and stats["routed"] >= 3
+
+        executions = {uid: client.get(f"/strategies/{uid}/execution").json() for uid in (payer, silent, settled)}
+        assert executions[payer]["last_decision"]["condition"] == "If partial payment received"
+        assert executions[payer]["last_decision"]["source"] == "rule"
+        assert executions[payer]["next_due_at"] == "2031-01-31T00:00:00"
+        assert executions[silent]["last_decision"]["action"] == "Escalate"
+        assert executions[silent]["next_due_at"] == "2031-01-15T00:00:00"
+        # Paid in full matches neither rule, so the unparsed condition is a tie.
+        assert executions[settled]["last_decision"]["source"] == "tie_breaker"
+        assert executions[settled]["last_decision"]["next_timing"] == "Day 90+"
+        assert any(facts["remaining_amount"] == 0 for _, facts in ties)
+    finally:
+        strategy_scheduler.set_clock(None)
+        db.close()
+
+
+def test_dispatch_sends_each_channel_independently_and_retries():
+    import asyncio
+    import time
+    from datetime import datetime
+
+    from app import dispatch, models, strategy_scheduler
+    from app.database import SessionLocal
+
+    timeline = [{"timing": "Day 1-7", "blocks": [
+        {"block_type": "action", "source": source, "tone": "friendly", "content": f"Hello by {source}"}
+        for source in ("email", "sms", "call", "letter")]}]
+    user_ids = []
+    for i in range(3):
+        user_ids.append(client.post("/ingestion/add-user", json={"name": f"Outbox {uuid4()}", "details": {
+            "amount_owed": 100, "contact_methods": [
+                {"method": "email", "value": f"outbox{i}@example.com"},
+                {"method": "phone", "value": f"+1555000{i}"}]}}).json()["id"])
+
+    finished = {}
+
+    class Recording(dispatch.MemorySink):
+        def __init__(self, channel, **kwargs):
+            super().__init__(**kwargs)
+            self.channel = channel
+
+        async def send_batch(self, messages):
+            results = await super().send_batch(messages)
+            finished.setdefault(self.channel, time.perf_counter())
+            return results
+
+    # sms is slow and sends one message at a time; calls fail on their first attempt.
+    adapters = {
+        "email": Recording("email"),
+        "sms": Recording("sms", latency=0.2, batch_size=1, concurrency=1),
+        "call": Recording("call", fail=lambda m: "line busy" if m.attempts == 1 else None),
+    }
+    clock = strategy_scheduler.SimulatedClock(datetime(2031, 1, 1, 9))
+    strategy_scheduler.set_clock(clock)
+    for channel, adapter in adapters.items():
+        dispatch.set_adapter(channel, adapter)
+    db = SessionLocal()
+    try:
+        for uid in user_ids:
+            client.post(f"/strategies/{uid}", json={"timeline": timeline})
+            client.post(f"/strategies/{uid}/execute")
+        assert client.post("/strategies/scheduler/tick").status_code == 200
+
+        outbox = models.OutboxMessage
+        mine = db.query(outbox).filter(outbox.owner_type == "user", outbox.owner_id.in_(user_ids)).all()
+        assert sorted((m.channel, m.status) for m in mine if m.owner_id == user_ids[0]) == [
+            ("call", "pending"), ("email", "pending"), ("letter", "undeliverable"), ("sms", "pending")]
+        assert {m.recipient for m in mine if m.channel == "sms"} == {"+15550000", "+15550001", "+15550002"}
+        assert client.get("/dispatch/outbox").json()["letter"]["undeliverable"] >= 3
+
+        dispatcher = dispatch.Dispatcher()
+        start = time.perf_counter()
+        stats = asyncio.run(dispatcher.drain())
+        # The slow channel never held up email.
+        assert finished["email"] - start < 0.2 < finished["sms"] - start
+        assert stats["sms"]["sent"] >= 3 and stats["email"]["messages_per_second"]
+        assert stats["call"]["retried"] >= 3 and stats["call"]["sent"] == 0
+
+        db.expire_all()
+        calls = [m for m in mine if m.channel == "call"]
+        assert {(m.status, m.attempts, m.last_error) for m in calls} == {("pending", 1, "line busy")}
+        assert {m.status for m in mine if m.channel in ("email", "sms")} == {"sent"}
+        assert {m.recipient for m in adapters["email"].sent if m.owner_id in user_ids} == {
+            "outbox0@example.com", "outbox1@example.com", "outbox2@example.com"}
+
+        # Retries wait for their backoff.
+        assert asyncio.run(dispatcher.drain(["call"]))["call"]["sent"] == 0
+        clock.advance(hours=2)
+        assert asyncio.run(dispatcher.drain(["call"]))["call"]["sent"] >= 3
+        db.expire_all()
+        assert {(m.status, m.attempts) for m in calls} == {("sent", 2)}
+        # email, sms and both call attempts are in the communication log.
+        history = client.get(f"/communications/{user_ids[0]}").json()
+        assert sorted(e["outcome"] for e in history["events"]) == ["retrying", "sent", "sent", "sent"]
+    finally:
+        for channel in adapters:
+            dispatch.set_adapter(channel, None)
+        strategy_scheduler.set_clock(None)
+        db.close()
+
+
+def test_webhook_sink_reuses_one_client_until_shutdown():
+    import asyncio
+    import json
+
+    import httpx
+
+    from app import dispatch
+
+    batches = []
+
+    def handler(request):
+        batches.append(len(json.loads(request.content)["messages"]))
+        return httpx.Response(200 if len(batches) < 3 else 503)
+
+    sink = dispatch.WebhookSink("http://delivery.test/send", "sms", transport=httpx.MockTransport(handler))
+    message = dispatch.Outbound(1, "sms", "+1555", "Hi", None, "Day 1", "user", 1, 0)
+
+    async def send_then_shut_down():
+        results, clients = [], set()
+        for n in (1, 2, 1):
+            results.append(await sink.send_batch([message] * n))
+            clients.add(sink._client)
+        dispatch.set_adapter("sms", sink)
+        await dispatch.shutdown()
+        return results, clients
+
+    results, clients = asyncio.run(send_then_shut_down())
+    assert batches == [1, 2, 1] and len(clients) == 1
+    client = clients.pop()
+    assert [[r.ok for r in batch] for batch in results] == [[True], [True, True], [False]]
+    assert results[2][0].retryable and client.is_closed and sink._client is None
+
+
+
+def test_communication_log_partitions_summaries_and_decisions():
+    from datetime import datetime
+
+    from app import communication_log, strategy_scheduler
+    from app.database import SessionLocal
+
+    decision = {"timing": "Day 8-14", "blocks": [{
+        "block_type": "decision", "decision_prompt": "Did they get back to us?",
+        "decision_sources": ["communication_log"],
+        "decision_outputs": [
+            {"condition": "If they responded", "next_timing": "Day 15-30"},
+            {"condition": "If no response", "next_timing": "Day 31-50"},
+        ]}]}
+    timeline = [decision] + [{"timing": t, "blocks": [{"block_type": "action", "source": "email", "content": t}]}
+                             for t in ("Day 15-30", "Day 31-50")]
+    replied, silent = (client.post("/ingestion/add-user", json={"name": f"Comms {uuid4()}", "details": {
+        "amount_owed": 100}}).json()["id"] for _ in range(2))
+
+    clock = strategy_scheduler.SimulatedClock(datetime(2032, 1, 25, 9))
+    strategy_scheduler.set_clock(clock)
+    db = SessionLocal()
+    try:
+        for uid in (replied, silent):
+            client.post(f"/strategies/{uid}", json={"timeline": timeline})
+            client.post(f"/strategies/{uid}/execute")
+        events = [
+            {"owner_id": replied, "direction": "outbound", "channel": "email", "outcome": "sent",
+             "occurred_at": "2031-12-20T10:00:00"},
+            {"owner_id": replied, "direction": "inbound", "channel": "sms", "outcome": "replied",
+             "occurred_at": "2032-02-01T12:00:00"},
+            {"owner_id": silent, "direction": "inbound", "channel": "email", "outcome": "replied",
+             "occurred_at": "2031-12-21T12:00:00"},  # before the execution started
+            {"owner_id": silent, "direction": "outbound", "channel": "call", "outcome": "no_answer",
+             "occurred_at": "2032-01-30T12:00:00"},
+        ]
+        assert client.post("/communications/", json=events).json() == {"recorded": 4}
+        assert {"communication_log_203112", "communication_log_203202"} <= set(communication_log.partitions(db))
+
+        history = client.get(f"/communications/{replied}").json()
+        assert [e["outcome"] for e in history["events"]] == ["replied", "sent"]
+        assert (history["summary"]["attempts"], history["summary"]["responses"]) == (1, 1)
+        assert client.get(f"/communications/{replied}", params={"since": "2032-01-01T00:00:00"}).json()[
+            "events"][0]["outcome"] == "replied"
+        summary = client.get(f"/users/{silent}").json()["communication"]
+        assert summary["last_channel"] == "call" and [e["outcome"] for e in summary["recent"]] == [
+            "no_answer", "replied"]
+
+        # Only the reply after the execution started counts.
+        clock.advance(days=8)
+        strategy_scheduler.tick(db)
+        routes = {uid: client.get(f"/strategies/{uid}/execution").json()["last_decision"]["next_timing"]
+                  for uid in (replied, silent)}
+        assert routes == {replied: "Day 15-30", silent: "Day 31-50"}
+
+        communication_log.record(db, [{"owner_id": silent, "occurred_at": datetime(2020, 1, 5)}])
+        db.commit()
+        assert communication_log.drop_expired(db, keep_months=12, now=datetime(2021, 1, 15)) == [
+            "communication_log_202001"]
+        assert "communication_log_202001" not in communication_log.partitions(db)
+    finally:
+        strategy_scheduler.set_clock(None)
+        db.close()
+
+
+def test_group_execution_is_set_based():
+    import time
+    from datetime import datetime
+
+    from sqlalchemy import event, func, insert
+
+    from app import models, strategy_scheduler
+    from app.database import SessionLocal, engine
+
+    timeline = [{"timing": "Day 8-14", "blocks": [{"block_type": "action", "source": "email", "content": "Hi"}]}]
+    db = SessionLocal()
+
+    def make_group(size, owing):
+        group = models.Group(name=f"Set Based {uuid4()}")
+        db.add(group)
+        db.flush()
+        db.execute(insert(models.User), [
+            {"name": f"Member {i}", "status": "pending", "version": 1, "group_id": group.id,
+             "details": {"amount_owed": 100 if i < owing else 0, "due_date": "2033-03-01"}}
+            for i in range(size)])
+        db.commit()
+        client.post(f"/strategies/{group.id}", json={"owner_type": "group", "timeline": timeline})
+        return group.id
+
+    def execute(group_id, **params):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+        event.listen(engine, "before_cursor_execute", listener)
+        start = time.perf_counter()
+        try:
+            resp = client.post(f"/strategies/{group_id}/execute", params={"owner_type": "group", **params})
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert resp.status_code == 200
+        return resp.json(), statements, time.perf_counter() - start
+
+    strategy_scheduler.set_clock(strategy_scheduler.SimulatedClock(datetime(2033, 1, 1, 9)))
+    try:
+        settled = make_group(3, owing=0)
+        assert execute(settled)[0]["group_status"] == "finished"
+
+        small, large = make_group(10, owing=4), make_group(5000, owing=2500)
+        small_result, small_statements, _ = execute(small, members="true")
+        result, statements, elapsed = execute(large, members="true", anchor="due_date")
+        # Same statements whatever the group size, and no member rows are loaded.
+        assert len(statements) == len(small_statements) <= 15
+        assert elapsed < 2.0
+        assert (result["group_status"], result["members_updated"], result["member_executions"]) == (
+            "ongoing", 5000, 5000)
+        assert small_result["member_executions"] == 10
+
+        user, execution = models.User, models.StrategyExecution
+        statuses = dict(db.query(user.status, func.count(user.id)).filter(user.group_id == large).group_by(user.status))
+        assert statuses == {"ongoing": 2500, "finished": 2500}
+        assert {u.version for u in db.query(user).filter(user.group_id == large)} == {2}
+        member = db.query(user.id).filter(user.group_id == large).first()[0]
+        row = client.get(f"/strategies/{member}/execution").json()
+        assert (row["anchor_date"], row["next_due_at"], row["status"]) == ("2033-03-01", "2033-03-08T00:00:00", "active")
+
+        # Re-executing replaces the members' active executions.
+        execute(large, members="true")
+        active = db.query(execution).filter(execution.owner_type == "user", execution.owner_id == member,
+                                            execution.status == "active").all()
+        assert len(active) == 1 and active[0].anchor_date.isoformat() == "2033-01-01"
+    finally:
+        strategy_scheduler.set_clock(None)
+        db.close()
+
+
+def test_group_membership_updates_in_bulk():
+    import time
+
+    from sqlalchemy import event, insert, select
+
+    from app import models
+    from app.database import SessionLocal, engine
+
+    db = SessionLocal()
+    try:
+        ids = list(db.execute(insert(models.User).returning(models.User.id, sort_by_parameter_order=True), [
+            {"name": f"Bulk Member {i}", "status": "pending", "version": 1, "details": {}} for i in range(12000)
+        ]).scalars())
+        db.commit()
+    finally:
+        db.close()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    start = time.perf_counter()
+    try:
+        resp = client.post("/users/group", json={"name": f"Bulk Group {uuid4()}", "user_ids": ids[:10000]})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert resp.status_code == 200 and time.perf_counter() - start < 2.0
+    # One validation query and one UPDATE per 5000 users; no user rows are loaded.
+    assert sum(s.lstrip().upper().startswith("UPDATE USERS") for s in statements) == 2
+    assert not any(s.lstrip().startswith("SELECT users.") for s in statements)
+    group_id = resp.json()["id"]
+
+    resp = client.post(f"/users/group/{group_id}/members", json={"user_ids": ids[9000:] + [ids[9000]]})
+    assert resp.json() == {"group_id": group_id, "added": 3000, "removed": 0, "member_count": 12000}
+    resp = client.request("DELETE", f"/users/group/{group_id}/members", json={"user_ids": ids[:2000]})
+    assert resp.json() == {"group_id": group_id, "added": 0, "removed": 2000, "member_count": 10000}
+
+    missing = max(ids) + 10**6
+    resp = client.post(f"/users/group/{group_id}/members", json={"user_ids": [ids[0], missing]})
+    assert resp.status_code == 400 and str(missing) in resp.json()["detail"]
+    resp = client.request("DELETE", f"/users/group/{group_id}/members", json={"user_ids": [ids[0], ids[-1]]})
+    assert resp.status_code == 400 and str(ids[0]) in resp.json()["detail"]
+    assert client.post("/users/group", json={"name": f"Bad {uuid4()}", "user_ids": [missing]}).status_code == 400
+    assert client.post(f"/users/group/{10**9}/members", json={"user_ids": ids[:1]}).status_code == 404
+
+    db = SessionLocal()
+    try:
+        user = models.User
+        rows = db.execute(select(user.group_id, user.version).where(user.id.in_([ids[0], ids[9500], ids[-1]]))).all()
+        assert rows == [(None, 3), (group_id, 3), (group_id, 2)]
+    finally:
+        db.close()
+
+
+def _clear_rule_groups(tag):
+    """Turn the rule-based groups a test created (names containing `tag`) back into empty static groups."""
+    from sqlalchemy import null
+
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        groups = db.query(models.Group).filter(models.Group.name.contains(tag), models.Group.rule.is_not(None)).all()
+        member = models.DynamicGroupMember
+        db.query(member).filter(member.group_id.in_([g.id for g in groups])).delete(synchronize_session=False)
+        for group in groups:
+            group.rule = null()  # SQL NULL, not JSON null
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_rule_based_groups_follow_user_changes():
+    from datetime import date, timedelta
+
+    from app import dynamic_groups, models
+    from app.database import SessionLocal
+
+    tag = uuid4().hex[:8]
+    overdue = (date.today() - timedelta(days=90)).isoformat()
+    recent = (date.today() - timedelta(days=10)).isoformat()
+    phone = [{"method": "phone", "value": "+15550100", "is_preferred": True},
+             {"method": "email", "value": "x@example.com"}]
+    email = [{"method": "phone", "value": "+15550101"}, {"method": "email", "value": "y@example.com", "is_preferred": True}]
+
+    def add(amount, due, contacts, **extra):
+        details = {"amount_owed": amount, "due_date": due, "contact_methods": contacts, "segment_tag": tag, **extra}
+        return client.post("/ingestion/add-user", json={"name": f"Rule {tag}", "details": details}).json()["id"]
+
+    match = add(20000, overdue, phone)
+    partly_paid = add(30000, overdue, phone, total_paid=25000)
+    too_recent = add(20000, recent, phone)
+    by_email = add(20000, overdue, email)
+    rule = {"all": [
+        {"field": "segment_tag", "value": tag},
+        {"field": "remaining", "op": "gt", "value": 10000},
+        {"field": "days_overdue", "op": "gt", "value": 60},
+        {"field": "preferred_contact", "value": "Phone"},
+        {"field": "status", "op": "ne", "value": "archived"},
+    ]}
+    resp = client.post("/users/group/dynamic", json={"name": f"Rule Group {tag}", "rule": rule})
+    assert resp.status_code == 200
+    group = resp.json()
+    assert group["member_count"] == 1 and group["rule"]["all"][1]["op"] == "gt"
+    gid = group["id"]
+    try:
+        def members():
+            # GET /users/{id} prefers a user with the same id, so read the group's members directly.
+            db = SessionLocal()
+            try:
+                return sorted(u.id for u in db.query(models.User).filter(dynamic_groups.members_clause(db, gid)))
+            finally:
+                db.close()
+
+        assert members() == [match]
+        # Ingestion, payments and status updates re-evaluate just the changed user.
+        joined = add(50000, overdue, phone)
+        assert members() == [match, joined]
+        client.post(f"/users/{joined}/payments", json={"amount": 45000, "date": date.today().isoformat()})
+        client.patch(f"/users/{match}/status", json={"status": "archived"})
+        assert members() == []
+        client.patch(f"/users/{match}/status", json={"status": "ongoing"})
+        assert members() == [match]
+
+        # Usable wherever a group id is.
+        timeline = [{"timing": "Day 1-7", "blocks": [{"block_type": "action", "source": "sms", "content": "Hi"}]}]
+        assert client.post(f"/strategies/{gid}", json={"owner_type": "group", "timeline": timeline}).status_code == 200
+        executed = client.post(f"/strategies/{gid}/execute", params={"owner_type": "group", "members": "true"}).json()
+        assert (executed["group_status"], executed["member_executions"]) == ("ongoing", 1)
+        assert client.get(f"/strategies/{match}/execution").json()["owner_id"] == match
+        analytics = next(g for g in client.get("/users/groups/analytics").json() if g["group_id"] == gid)
+        assert analytics["member_count"] == 1 and analytics["total_remaining"] == 20000
+
+        # Loosening the rule re-evaluates the whole portfolio once.
+        rule["all"][3] = {"field": "preferred_contact", "op": "in", "value": ["phone", "email"]}
+        assert client.put(f"/users/group/{gid}/rule", json=rule).json()["member_count"] == 2
+        assert members() == sorted([match, by_email])
+        assert partly_paid not in members() and too_recent not in members()
+
+        assert client.post(f"/users/group/{gid}/members", json={"user_ids": [too_recent]}).status_code == 400
+        bad = {"all": [{"field": "remaining", "op": "gt", "value": "lots"}]}
+        assert client.post("/users/group/dynamic", json={"name": f"Bad {tag}", "rule": bad}).status_code == 400
+        assert client.post("/users/groups/refresh").json() == {"groups": 0}
+        assert client.post("/users/groups/refresh", params={"full": "true"}).json()["groups"] >= 1
+    finally:
+        _clear_rule_groups(tag)
+
+
+def test_rule_group_refresh_statements_do_not_grow_with_groups():
+    from sqlalchemy import event
+
+    from app import dynamic_groups, models
+    from app.database import SessionLocal, engine
+
+    tag = uuid4().hex[:8]
+    details = {"amount_owed": 700, "segment_tag": tag, "contact_methods": [{"method": "sms", "value": "+15550200"}]}
+    uid = client.post("/ingestion/add-user", json={"name": f"Rules {tag}", "details": details}).json()["id"]
+    db = SessionLocal()
+
+    def refresh_statements():
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            dynamic_groups.refresh_users(db, models.User.id == uid)
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        db.commit()
+        return len(statements)
+
+    def add_group(i, rule):
+        resp = client.post("/users/group/dynamic", json={"name": f"Rules {tag} {i}", "rule": rule})
+        assert resp.status_code == 200
+        return resp.json()["id"]
+
+    try:
+        tagged = {"field": "segment_tag", "value": tag}
+        first = add_group(0, {"all": [tagged]})
+        counted = refresh_statements()
+        others = [
+            add_group(i, {"all": [tagged, {"field": "remaining", "op": "gt", "value": 100 * i}]}) for i in range(1, 11)
+        ]
+        # One SELECT of the rules, one INSERT and one DELETE, whatever the number of groups.
+        assert refresh_statements() == counted <= 3
+
+        member = models.DynamicGroupMember
+        groups_of = lambda: {g for (g,) in db.query(member.group_id).filter(member.user_id == uid)}  # noqa: E731
+        assert groups_of() == {first, *others[:6]}
+        client.post(f"/users/{uid}/payments", json={"amount": 350, "date": "2030-01-01"})
+        db.expire_all()
+        assert groups_of() == {first, *others[:3]}
+    finally:
+        db.close()
+        _clear_rule_groups(tag)
+
+
+def test_worklist_scores_and_claims_debtors():
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import date, timedelta
+
+    from app import worklist
+    from app.database import SessionLocal
+
+    tag = uuid4().hex[:8]
+    due = (date.today() - timedelta(days=120)).isoformat()
+
+    def add(amount):
+        details = {"amount_owed": amount, "due_date": due}
+        return client.post("/ingestion/add-user", json={"name": f"Worklist {tag}", "details": details}).json()["id"]
+
+    uid = add(99999)
+    entry = client.get(f"/worklist/{uid}").json()
+    assert (entry["remaining"], entry["days_overdue"], entry["days_since_payment"]) == (99999, 120, None)
+    assert entry["score"] == 50 + 20 + 10  # balance, overdue, never paid
+
+    # A payment re-scores the user; settling or archiving takes them off the list.
+    client.post(f"/users/{uid}/payments", json={"amount": 90000, "date": date.today().isoformat()})
+    entry = client.get(f"/worklist/{uid}").json()
+    assert (entry["remaining"], entry["days_since_payment"]) == (9999, 0)
+    assert entry["score"] == 40 + 20
+    client.patch(f"/users/{uid}/status", json={"status": "archived"})
+    assert client.get(f"/worklist/{uid}").status_code == 404
+    client.patch(f"/users/{uid}/status", json={"status": "ongoing"})
+    assert client.get(f"/worklist/{uid}").status_code == 200
+
+    # Concurrent collectors never get the same debtor.
+    for _ in range(12):
+        add(10 ** 9)
+    collectors = [f"collector-{tag}-{i}" for i in range(4)]
+
+    def claim(collector):
+        db = SessionLocal()
+        try:
+            return [e.user_id for e in worklist.claim(db, collector, 3)]
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        claimed = list(pool.map(claim, collectors))
+    ids = [i for ids in claimed for i in ids]
+    assert all(len(ids) == 3 for ids in claimed) and len(set(ids)) == 12
+    top = [e["user_id"] for e in client.get("/worklist/top", params={"k": 1000}).json()]
+    assert not set(ids) & set(top)
+
+    resp = client.post("/worklist/claim", json={"collector": collectors[0], "k": 2})
+    assert [e["claimed_by"] for e in resp.json()] == [collectors[0]] * 2
+    for collector in collectors:
+        assert client.post("/worklist/release", json={"collector": collector}).json()["released"] >= 3
+    assert client.post("/worklist/rebuild").json()["scored"] >= 13
+
+
+def test_reaging_recomputes_overdue_days_and_statuses():
+    from datetime import date, timedelta
+
+    today = date.today()
+
+    def add(details, status=None):
+        uid = client.post("/ingestion/add-user", json={"name": "Reage", "details": details}).json()["id"]
+        if status:
+            client.patch(f"/users/{uid}/status", json={"status": status})
+        return uid
+
+    def user(uid):
+        return client.get(f"/users/{uid}").json()["data"]
+
+    def paid(days_ago):
+        return [{"amount": 100, "date": (today - timedelta(days=days_ago)).isoformat()}]
+
+    overdue = add({"amount_owed": 500, "due_date": (today - timedelta(days=10)).isoformat(), "days_overdue": 2})
+    not_due = add({"amount_owed": 500, "due_date": (today + timedelta(days=5)).isoformat()})
+    settled_long_ago = add({"amount_owed": 100, "total_paid": 100, "payment_history": paid(100)}, "ongoing")
+    settled_lately = add({"amount_owed": 100, "total_paid": 100, "payment_received": paid(10)}, "finished")
+    unknown = add({"note": "no balance"})
+
+    resp = client.post("/users/reage", params={"as_of": today.isoformat()})
+    assert resp.status_code == 200
+    stats = resp.json()
+    assert stats["users"] >= 5 and stats["ongoing"] >= 1 and stats["archived"] >= 1
+
+    assert user(overdue)["status"] == "ongoing"
+    assert (user(overdue)["details"]["days_overdue"], user(overdue)["details"]["status"]) == (10, "overdue")
+    assert user(not_due)["status"] == "pending"
+    assert (user(not_due)["details"]["days_overdue"], user(not_due)["details"]["status"]) == (0, "pending")
+    assert user(settled_long_ago)["status"] == "archived"
+    assert user(settled_lately)["status"] == "finished"
+    assert user(unknown)["status"] == "pending" and "days_overdue" not in user(unknown)["details"]
+    assert client.get(f"/worklist/{overdue}").json()["days_overdue"] == 10
+    assert client.get(f"/worklist/{settled_long_ago}").status_code == 404
+
+    # Nothing left to change on the same day; later, the recent settlement is archived too.
+    assert client.post("/users/reage", params={"as_of": today.isoformat()}).json()["updated"] == 0
+    later = (today + timedelta(days=85)).isoformat()
+    client.post("/users/reage", params={"as_of": later, "archive_after_days": 90})
+    assert user(settled_lately)["status"] == "archived"
+    assert user(overdue)["details"]["days_overdue"] == 95
+
+
+
+def test_reaging_stats_skip_users_changed_during_the_run(monkeypatch):
+    from datetime import date, timedelta
+
+    from sqlalchemy import update
+
+    from app import models, reaging
+    from app.database import SessionLocal
+
+    today = date.today()
+    details = {"amount_owed": 500, "due_date": (today - timedelta(days=10)).isoformat()}
+    uid = client.post("/ingestion/add-user", json={"name": "Raced", "details": details}).json()["id"]
+
+    db = SessionLocal()
+    changed = []
+    age = reaging.age
+
+    def racing_age(df, *args, **kwargs):
+        # Another writer commits a change to the user after the chunk was loaded.
+        db.execute(update(models.User).where(models.User.id == uid).values(version=models.User.version + 1))
+        aged = age(df, *args, **kwargs)
+        to_ongoing = (aged["status"] == "ongoing") & (df["status"].to_numpy(dtype=object) != "ongoing")
+        changed.append((int(aged["changed"].sum()), int(to_ongoing.sum())))
+        return aged
+
+    monkeypatch.setattr(reaging, "age", racing_age)
+    try:
+        stats = reaging.run(db, today=today, chunk_size=100000)
+        assert (stats["updated"], stats["ongoing"]) == tuple(sum(counts) - 1 for counts in zip(*changed))
+        db.expire_all()
+        user = db.get(models.User, uid)
+        assert user.status == "pending" and "days_overdue" not in user.details
+    finally:
+        db.close()
+
+
+def test_contact_routes_follow_contact_method_edits():
+    from app import contact_routes, models
+    from app.database import SessionLocal
+
+    methods = [
+        {"method": "Phone", "value": "+15550001"},
+        {"method": "email", "value": "a@example.com"},
+        {"method": "phone", "value": "+15550002", "is_preferred": True},
+    ]
+    resp = client.post("/ingestion/add-user", json={"name": "Routes", "details": {"contact_methods": methods}})
+    uid = resp.json()["id"]
+
+    db = SessionLocal()
+    try:
+        def routes():
+            db.expire_all()
+            return {r.channel: (r.value, r.fallback, r.preferred)
+                    for r in db.query(models.ContactRoute).filter(models.ContactRoute.user_id == uid)}
+
+        assert routes() == {
+            "phone": ("+15550002", "+15550001", True),
+            "sms": ("+15550002", "+15550001", True),
+            "email": ("a@example.com", None, False),
+        }
+        assert contact_routes.for_user(db, uid) == {"phone": "+15550002", "sms": "+15550002", "email": "a@example.com"}
+
+        # Any committed edit to the user rebuilds their routes.
+        user = db.get(models.User, uid)
+        user.details = {**user.details, "contact_methods": [{"method": "sms", "value": "+15550003"}]}
+        db.commit()
+        assert routes() == {"sms": ("+15550003", None, False)}
+    finally:
+        db.close()
+
+    # Template placeholders and action blocks read the routes.
+    name = f"routes-{uuid4().hex[:8]}"
+    timeline = [{"timing": "Day 1", "blocks": [
+        {"block_type": "action", "source": "sms", "content": "Text {contact_sms}"},
+        {"block_type": "action", "source": "call", "content": "Call"}]}]
+    client.post("/strategies/templates", json={"name": name, "timeline": timeline})
+    client.post("/strategies/templates/apply", json={"name": name, "owner_ids": [uid]})
+    blocks = client.get(f"/strategies/{uid}").json()["timeline"][0]["blocks"]
+    assert [b["contact_method_detail"] for b in blocks] == ["+15550003", None]
+    assert blocks[0]["content"] == "Text +15550003"
+
+
+# Tables as the first release of the app created them, before any column was added.
+BASELINE_SCHEMA = [
+    """CREATE TABLE groups (id INTEGER NOT NULL, name VARCHAR NOT NULL, created_at DATETIME,
+        status VARCHAR NOT NULL, PRIMARY KEY (id))""",
+    """CREATE TABLE users (id INTEGER NOT NULL, name VARCHAR NOT NULL, details JSON NOT NULL,
+        status VARCHAR NOT NULL, group_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(group_id) REFERENCES groups (id))""",
+    """CREATE TABLE strategies (id INTEGER NOT NULL, user_id INTEGER, group_id INTEGER, timeline JSON NOT NULL,
+        prompt VARCHAR, executed BOOLEAN NOT NULL, created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id), FOREIGN KEY(group_id) REFERENCES groups (id))""",
+    """CREATE TABLE user_documents (id INTEGER NOT NULL, user_id INTEGER NOT NULL, filename VARCHAR NOT NULL,
+        file_path VARCHAR NOT NULL, file_type VARCHAR, uploaded_at DATETIME, PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id))""",
+    """INSERT INTO users (id, name, details, status) VALUES (1, 'Legacy', '{"amount_owed": 100}', 'pending')""",
+]
+
+
+def _baseline_database(path):
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+    for statement in BASELINE_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def test_contact_routes_backfill_only_runs_when_a_user_has_routes(monkeypatch, tmp_path):
+    import json
+
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+
+    from app import contact_routes, models
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'routes.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    rebuilds = []
+    monkeypatch.setattr(contact_routes, "rebuild", lambda db: rebuilds.append(1))
+
+    def add_user(details):
+        # Raw SQL, so the user_changes hooks do not build the routes.
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO users (name, details, status, version) VALUES ('r', :details, 'pending', 1)"),
+                {"details": json.dumps(details)},
+            )
+
+    add_user({"amount_owed": 10})
+    add_user({"contact_methods": [{"method": "fax", "value": "123"}, {"method": "email", "value": ""}, "oops"]})
+    with Session(engine) as db:
+        contact_routes.ensure_built(db)
+        assert rebuilds == []
+        add_user({"contact_methods": [{"method": "Email", "value": "r@example.com"}]})
+        contact_routes.ensure_built(db)
+        assert rebuilds == [1]
+    engine.dispose()
+
+def test_migrations_upgrade_a_baseline_database(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from sqlalchemy.orm import Session
+
+    from app import migrations, models
+
+    path = tmp_path / "baseline.db"
+    _baseline_database(path)
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    assert {"users.version", "groups.rule", "groups.refreshed_on"} <= set(migrations.upgrade(engine))
+    assert migrations.upgrade(engine) == []
+    assert "ix_users_group_id" in {index["name"] for index in inspect(engine).get_indexes("users")}
+
+    with Session(engine) as db:
+        user = db.get(models.User, 1)
+        assert user.version == 1
+        user.status = "ongoing"
+        db.commit()
+        assert user.version == 2
+    engine.dispose()
+
+
+def test_app_starts_on_a_baseline_database(tmp_path):
+    import json
+    import os
+    import sqlite3
+    import subprocess
+    import sys
+
+    _baseline_database(tmp_path / "test.db")
+    conn = sqlite3.connect(tmp_path / "test.db")
+    timeline = '[{"timing": "Day 1", "blocks": [{"block_type": "action", "source": "email", "content": "%s"}]}]'
+    conn.executemany(
+        "INSERT INTO strategies (user_id, timeline, prompt, executed) VALUES (1, ?, ?, 0)",
+        [(timeline % "first", "first"), (timeline % "second", "second")],
+    )
+    conn.commit()
+    conn.close()
+
+    # The database path is relative to the working directory, so boot the app (lifespan included) from there.
+    script = (
+        "import json, sys\n"
+        f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+        "from fastapi.testclient import TestClient\n"
+        "import main\n"
+        "with TestClient(main.app) as client:\n"
+        "    latest = client.get('/strategies/1').json()\n"
+        "    versions = client.get('/strategies/1/versions').json()\n"
+        "    status = client.patch('/users/1/status', json={'status': 'ongoing'}).status_code\n"
+        "print(json.dumps([latest['prompt'], latest['version'], [v['version'] for v in versions], status]))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.splitlines()[-1]) == ["second", 2, [2, 1], 200]